@@ -0,0 +1,148 @@
+# audit.py
+"""
+Escrita dos registos de auditoria (audit_logs).
+
+Por omissão cada evento vai para uma fila em memória e uma thread grava-os
+em lote (um INSERT executemany e um commit por lote), no máximo
+AUDIT_FLUSH_MS depois de entrar na fila ou logo que há AUDIT_BATCH_SIZE
+eventos. O pedido não espera por esse commit. Na paragem da aplicação a fila
+é despejada.
+
+Acções em AUDIT_SYNC_ACTIONS (ou todas, com AUDIT_MODE=sync) são gravadas
+na sessão de quem chama, com commit antes da resposta: um crash do processo
+não as perde (os eventos ainda na fila perdem-se).
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import List, Optional, Union
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from db_writer import db_writer
+from models import AuditLog, User
+from security import Principal
+
+
+logger = logging.getLogger(__name__)
+
+AUDIT_MODE = os.getenv("AUDIT_MODE", "async").lower()
+AUDIT_SYNC_ACTIONS = {
+    a.strip()
+    for a in os.getenv(
+        "AUDIT_SYNC_ACTIONS",
+        "create_user,update_user_status,reset_user_password,delete_infosource,update_risk_decision",
+    ).split(",")
+    if a.strip()
+}
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+AUDIT_FLUSH_MS = int(os.getenv("AUDIT_FLUSH_MS", "200"))
+
+_STOP = object()
+
+
+class AuditLogWriter:
+    def __init__(
+        self,
+        batch_size: int = AUDIT_BATCH_SIZE,
+        flush_seconds: float = AUDIT_FLUSH_MS / 1000,
+        writer=db_writer,
+    ) -> None:
+        self._batch_size = batch_size
+        self._flush_seconds = flush_seconds
+        self._writer = writer
+        self._queue: "queue.Queue" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def put(self, row: dict) -> None:
+        self._ensure_started()
+        self._queue.put(row)
+
+    def stop(self) -> None:
+        """Grava o que está na fila e pára a thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join(timeout=30)
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="audit-log", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch: List[dict] = [item]
+            deadline = time.monotonic() + self._flush_seconds
+            while len(batch) < self._batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._write(batch)
+        # eventos que chegaram depois do pedido de paragem
+        rest = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                rest.append(item)
+        if rest:
+            self._write(rest)
+
+    def _write(self, batch: List[dict]) -> None:
+        try:
+            self._writer.run(lambda db: db.execute(insert(AuditLog.__table__), batch))
+        except Exception:
+            logger.exception("Falha a gravar %s registos de auditoria", len(batch))
+
+
+audit_writer = AuditLogWriter()
+
+
+def log_event(
+    db: Session,
+    action: str,
+    user: Optional[Union[User, Principal]] = None,
+    details: Optional[str] = None,
+    ip_address: Optional[str] = None,
+    sync: Optional[bool] = None,
+) -> None:
+    """
+    Regista um evento de auditoria. `sync` (por omissão: AUDIT_MODE /
+    AUDIT_SYNC_ACTIONS) grava-o já, com commit na sessão `db`; senão vai
+    para a fila do audit_writer.
+    """
+    if sync is None:
+        sync = AUDIT_MODE == "sync" or action in AUDIT_SYNC_ACTIONS
+    row = {
+        "timestamp": datetime.utcnow(),
+        "user_id": user.id if user else None,
+        "username": user.username if user else None,
+        "action": action,
+        "details": details,
+        "ip_address": ip_address,
+    }
+    if sync:
+        db.add(AuditLog(**row))
+        db.commit()
+    else:
+        audit_writer.put(row)
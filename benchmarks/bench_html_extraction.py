@@ -0,0 +1,97 @@
+# benchmarks/bench_html_extraction.py
+"""
+Benchmark: extractor HTML antigo (BeautifulSoup, get_text em cada <div>)
+contra html_extraction.extract_entities_from_html_content (uma passagem).
+
+Uso (na raiz do projecto):
+    python benchmarks/bench_html_extraction.py [pagina.html ...]
+
+Sem ficheiros, gera uma página sintética com layout aninhado (o caso
+quadrático); com ficheiros, mede snapshots guardados de páginas reais.
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from html_extraction import extract_entities_from_html_content  # noqa: E402
+
+
+ROLES = ["Ministro das Finanças", "Secretário de Estado", "Governador Provincial", "Director"]
+NAMES = ["José Santos", "Ana Dias", "Manuel Nunes", "Teresa Costa", "Paulo Neto", "Isabel Silva"]
+
+
+def synthetic_page(rng: random.Random, sections: int = 200, depth: int = 12) -> str:
+    """Secções com `depth` divs aninhados, uma lista e uma tabela cada."""
+    parts = ["<html><body>"]
+    for s in range(sections):
+        parts.append("<div class='wrap'>" * depth)
+        parts.append(f"<h2>Secção {s}</h2>")
+        for _ in range(5):
+            parts.append(f"<div class='card'>{rng.choice(NAMES)} {rng.choice(ROLES)} {s}</div>")
+        parts.append("<ul>")
+        for _ in range(5):
+            parts.append(f"<li>{rng.choice(NAMES)} – {rng.choice(ROLES)} {s}</li>")
+        parts.append("</ul><table><tr><th>Nome</th><th>Cargo</th></tr>")
+        for _ in range(5):
+            parts.append(f"<tr><td>{rng.choice(NAMES)}</td><td>{rng.choice(ROLES)} {s}</td></tr>")
+        parts.append("</table>")
+        parts.append("</div>" * depth)
+    parts.append("</body></html>")
+    return "".join(parts)
+
+
+def legacy_extract(html: str, default_country: str = "Angola") -> list:
+    """Extractor anterior (só a parte dos <div>, que domina o tempo)."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "html.parser")
+    entities = []
+    for div in soup.find_all("div"):
+        txt = div.get_text(" ", strip=True)
+        lower = txt.lower()
+        if "ministro" in lower or "secretário" in lower or "governador" in lower:
+            parts = txt.split()
+            if len(parts) >= 2:
+                entities.append(
+                    {"person_name": " ".join(parts[0:3]), "role": txt, "country": default_country}
+                )
+    unique = {}
+    for e in entities:
+        key = (e["person_name"].upper(), e["role"].upper(), e["country"].upper())
+        unique.setdefault(key, e)
+    return list(unique.values())
+
+
+def timed(label, fn, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    print(f"  {label:<36} {best * 1000:10.1f} ms  {len(result):6} entidades")
+    return result
+
+
+def main() -> None:
+    if len(sys.argv) > 1:
+        pages = []
+        for path in sys.argv[1:]:
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                pages.append((os.path.basename(path), f.read()))
+    else:
+        pages = [("sintética (200 secções, 12 níveis)", synthetic_page(random.Random(42)))]
+
+    for label, html in pages:
+        print(f"{label}: {len(html) / 1024:.0f} KiB")
+        try:
+            timed("BeautifulSoup + get_text por div", lambda: legacy_extract(html))
+        except ImportError:
+            print("  (beautifulsoup4 não instalado: extractor antigo não medido)")
+        timed("html_extraction (uma passagem)", lambda: extract_entities_from_html_content(html))
+
+
+if __name__ == "__main__":
+    main()
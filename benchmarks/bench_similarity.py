@@ -0,0 +1,111 @@
+# benchmarks/bench_similarity.py
+"""
+Microbenchmark: difflib.SequenceMatcher (caminho antigo do find_matches)
+contra similarity.name_similarity (escalar) e name_similarity_many (numpy).
+Antes de medir, verifica que o caminho numpy dá os mesmos scores que o
+escalar (nomes aleatórios, vazios, de um só token e com transposições).
+
+Uso (na raiz do projecto):
+    python benchmarks/bench_similarity.py [num_candidatos]
+"""
+import difflib
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from normalization import name_key  # noqa: E402
+from similarity import NAME_MATCH_THRESHOLD, name_similarity, name_similarity_many  # noqa: E402
+
+
+FIRST = ["José", "João", "Maria", "Ana", "Isabel", "Manuel", "António", "Teresa", "Francisco", "Paulo"]
+LAST = ["Santos", "Silva", "Lourenço", "Ferreira", "Gonçalves", "Costa", "Pereira", "Neto", "Dias", "Cardoso"]
+PARTICLES = ["", "da", "dos", "de"]
+
+
+def random_name(rng: random.Random) -> str:
+    parts = [rng.choice(FIRST), rng.choice(FIRST)]
+    particle = rng.choice(PARTICLES)
+    if particle:
+        parts.append(particle)
+    parts.append(rng.choice(LAST))
+    return " ".join(parts)
+
+
+def transpose(name: str, rng: random.Random) -> str:
+    """Troca duas letras seguidas de um nome ('Silva' -> 'Silav')."""
+    if len(name) < 2:
+        return name
+    i = rng.randrange(len(name) - 1)
+    return name[:i] + name[i + 1] + name[i] + name[i + 2 :]
+
+
+def equivalence_names(rng: random.Random, n: int) -> list:
+    names = ["", " ", "da", "Santos", "José", "Jose", "Ana", "Na", None]
+    for _ in range(n):
+        name = random_name(rng)
+        names.append(name)
+        names.append(transpose(name, rng))
+        names.append(rng.choice(FIRST + LAST))
+    return names
+
+
+def check_equivalence(rng: random.Random, n: int = 500) -> None:
+    """name_similarity_many tem de coincidir com name_similarity, par a par."""
+    candidates = equivalence_names(rng, n)
+    queries = ["", "Santos", "Jose Eduardo Santos", "Maria da Silva"]
+    queries += [transpose(random_name(rng), rng) for _ in range(10)]
+    for query in queries:
+        for th in (0.0, NAME_MATCH_THRESHOLD):
+            many = name_similarity_many(query, candidates, th)
+            for candidate, got in zip(candidates, many):
+                expected = name_similarity(query, candidate, th)
+                if abs(got - expected) > 1e-9:
+                    raise AssertionError(
+                        f"{query!r} vs {candidate!r} (limiar {th}): "
+                        f"numpy={got} escalar={expected}"
+                    )
+    print(f"equivalência numpy/escalar: ok ({len(queries)} x {len(candidates)} pares x 2 limiares)")
+
+
+def difflib_scores(query, candidates):
+    q = query.upper()
+    return [difflib.SequenceMatcher(None, q, (c or "").upper()).ratio() for c in candidates]
+
+
+def timed(label, fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    print(f"{label:<44} {best * 1000:9.2f} ms")
+    return result
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rng = random.Random(42)
+    check_equivalence(random.Random(7))
+    candidates = [random_name(rng) for _ in range(n)]
+    query = "Jose Eduardo Santos"
+    th = NAME_MATCH_THRESHOLD
+
+    print(f"{n} candidatos, query={query!r}, limiar={th}")
+    old = timed("difflib.SequenceMatcher.ratio", lambda: difflib_scores(query, candidates))
+    timed("name_similarity (escalar)", lambda: [name_similarity(query, c, th) for c in candidates])
+    new = timed("name_similarity_many (numpy)", lambda: name_similarity_many(query, candidates, th))
+    # no find_matches o name_key já vem calculado do ingest
+    keys = [name_key(c) for c in candidates]
+    timed(
+        "name_similarity_many (name_key do ingest)",
+        lambda: name_similarity_many(query, candidates, th, candidate_keys=keys),
+    )
+
+    print(f"acima do limiar: difflib={sum(s >= th for s in old)} novo={sum(s >= th for s in new)}")
+
+
+if __name__ == "__main__":
+    main()
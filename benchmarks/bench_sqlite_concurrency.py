@@ -0,0 +1,135 @@
+# benchmarks/bench_sqlite_concurrency.py
+"""
+Benchmark: /risk/check concorrente em SQLite (RiskRecord + AuditLog por
+pedido), antes e depois do perfil de produção.
+
+  antes:  journal por omissão (rollback), synchronous FULL, cada thread faz
+          commit na sua sessão
+  depois: WAL, PRAGMAs de database.configure_sqlite e escritas pelo
+          escritor único (db_writer.DatabaseWriter)
+
+Em ambos há leitores em paralelo (contagem de risk_records), como os GET
+da aplicação. Uso (na raiz do projecto):
+    python benchmarks/bench_sqlite_concurrency.py [threads] [pedidos_por_thread]
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, func  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+from database import Base, configure_sqlite  # noqa: E402
+from db_writer import DatabaseWriter  # noqa: E402
+from models import AuditLog, RiskRecord  # noqa: E402
+
+
+READERS = 4
+
+
+def risk_check_rows(db: Session, n: int) -> None:
+    record = RiskRecord(
+        full_name=f"Cliente {n}",
+        nif=str(n),
+        risk_score=10,
+        risk_level="LOW",
+        matches_json="[]",
+        factors_json="[]",
+        analyst_notes="",
+        analyst_id=1,
+    )
+    db.add(record)
+    db.flush()
+    db.add(AuditLog(user_id=1, username="bench", action="risk_check", details=f"RiskRecord {record.id}"))
+
+
+def run(label: str, production: bool, threads: int, per_thread: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(
+            f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+            connect_args={"check_same_thread": False},
+            pool_size=threads + READERS + 2,
+        )
+        if production:
+            configure_sqlite(engine)
+        Base.metadata.create_all(bind=engine)
+        writer = DatabaseWriter(engine, serialized=True) if production else None
+
+        latencies = []
+        errors = []
+        reads = [0]
+        done = threading.Event()
+        lock = threading.Lock()
+
+        def write(n: int) -> None:
+            if writer is not None:
+                writer.run(lambda db: risk_check_rows(db, n))
+                return
+            db = Session(bind=engine)
+            try:
+                risk_check_rows(db, n)
+                db.commit()
+            finally:
+                db.close()
+
+        def client(t: int) -> None:
+            for i in range(per_thread):
+                start = time.perf_counter()
+                try:
+                    write(t * per_thread + i)
+                except OperationalError as exc:
+                    with lock:
+                        errors.append(str(exc.orig))
+                    continue
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+
+        def reader() -> None:
+            while not done.is_set():
+                with Session(bind=engine) as db:
+                    db.query(func.count(RiskRecord.id)).scalar()
+                with lock:
+                    reads[0] += 1
+
+        readers = [threading.Thread(target=reader) for _ in range(READERS)]
+        clients = [threading.Thread(target=client, args=(t,)) for t in range(threads)]
+        for th in readers:
+            th.start()
+        start = time.perf_counter()
+        for th in clients:
+            th.start()
+        for th in clients:
+            th.join()
+        elapsed = time.perf_counter() - start
+        done.set()
+        for th in readers:
+            th.join()
+        if writer is not None:
+            writer.stop()
+        engine.dispose()
+
+        latencies.sort()
+        p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000 if latencies else float("nan")
+        print(
+            f"  {label:<8} {len(latencies) / elapsed:8.0f} escritas/s  p95 {p95:7.1f} ms  "
+            f"{len(errors):4} erros  {reads[0] / elapsed:8.0f} leituras/s"
+        )
+        if errors:
+            print(f"           ex.: {errors[0]}")
+
+
+def main() -> None:
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    per_thread = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    print(f"{threads} threads x {per_thread} pedidos, {READERS} leitores")
+    run("antes", False, threads, per_thread)
+    run("depois", True, threads, per_thread)
+
+
+if __name__ == "__main__":
+    main()
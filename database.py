@@ -1,18 +1,70 @@
 # database.py
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 # Para começar, usamos SQLite local.
 # No futuro podes trocar por Postgres alterando esta URL.
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./check_insurance_risk.db")
 
+# Perfil de produção do SQLite (PRAGMAs aplicados a cada ligação nova):
+#   synchronous NORMAL: em WAL, um commit não faz fsync (só os checkpoints);
+#     um crash do SO pode perder os últimos commits, nunca corromper a BD
+#   busy_timeout: um escritor espera pelo lock em vez de falhar logo
+#   cache_size (KiB por ligação) e mmap_size: menos leituras ao disco
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper()
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE_KIB = int(os.getenv("SQLITE_CACHE_SIZE_KIB", "65536"))
+SQLITE_MMAP_SIZE_BYTES = int(os.getenv("SQLITE_MMAP_SIZE_BYTES", str(256 * 1024 * 1024)))
+
+if SQLITE_SYNCHRONOUS not in ("OFF", "NORMAL", "FULL", "EXTRA"):
+    raise RuntimeError(f"SQLITE_SYNCHRONOUS inválido: {SQLITE_SYNCHRONOUS}")
+
+
+def configure_sqlite(engine) -> None:
+    """Aplica o perfil de produção (ver acima) a cada ligação do engine."""
+
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_connection, connection_record):
+        # WAL: as leituras (endpoints, snapshot) não bloqueiam durante a
+        # transacção longa de uma ingestão em background
+        dbapi_connection.execute("PRAGMA journal_mode=WAL")
+        dbapi_connection.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        dbapi_connection.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        dbapi_connection.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KIB}")
+        dbapi_connection.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE_BYTES}")
+
+
 connect_args = {}
 if DATABASE_URL.startswith("sqlite"):
     connect_args = {"check_same_thread": False}
 
 engine = create_engine(DATABASE_URL, connect_args=connect_args)
 
+if DATABASE_URL.startswith("sqlite"):
+    configure_sqlite(engine)
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
+
+
+def add_missing_columns(table) -> None:
+    """
+    create_all não altera tabelas já existentes: acrescenta as colunas
+    (e índices) novos a bases de dados criadas por versões anteriores.
+    """
+    inspector = inspect(engine)
+    if not inspector.has_table(table.name):
+        return
+    existing = {c["name"] for c in inspector.get_columns(table.name)}
+    with engine.begin() as conn:
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            col_type = column.type.compile(dialect=engine.dialect)
+            conn.execute(
+                text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {col_type}')
+            )
+    for index in table.indexes:
+        index.create(bind=engine, checkfirst=True)
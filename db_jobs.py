@@ -0,0 +1,211 @@
+# db_jobs.py
+"""
+Base comum das filas de jobs persistidas na BD (ingestion_jobs, risk_jobs).
+
+Um job é uma linha com status (PENDING, RUNNING, DONE, FAILED), started_at,
+finished_at, heartbeat_at e error. O DbJobRunner tem:
+  - um pool de threads (workers) e um conjunto dos ids já entregues ao pool
+    neste processo, para o mesmo job não ficar em fila duas vezes;
+  - um sweeper que, no arranque e depois periodicamente, põe em fila os
+    jobs PENDING e os RUNNING sem heartbeat há mais de `stale_seconds`
+    (interrompidos por um reinício ou crash);
+  - um claim por UPDATE condicional: com vários processos, só um corre o job;
+  - enquanto o job corre, uma thread que grava heartbeat_at (sessão própria)
+    a cada `heartbeat_seconds`, por mais que demore cada passo do job.
+As subclasses definem `model`, `label` e `_process`.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Set
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+
+logger = logging.getLogger(__name__)
+
+
+def job_rows_per_second(job, rows: int) -> Optional[float]:
+    """Débito de `rows` linhas desde o started_at do job (até ao fim, se terminou)."""
+    if not job.started_at:
+        return None
+    end = job.finished_at or datetime.utcnow()
+    elapsed = (end - job.started_at).total_seconds()
+    if elapsed <= 0:
+        return None
+    return round(rows / elapsed, 1)
+
+
+class DbJobRunner:
+    model: Any = None
+    # nome para threads e logs (ex.: "ingest", "risk")
+    label = "job"
+
+    def __init__(
+        self,
+        session_factory,
+        workers: int,
+        stale_seconds: float,
+        heartbeat_seconds: float,
+        sweep_seconds: float,
+    ) -> None:
+        self._session_factory = session_factory
+        self._workers = workers
+        self._stale_seconds = stale_seconds
+        self._heartbeat_seconds = heartbeat_seconds
+        self._sweep_seconds = sweep_seconds
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._stop = threading.Event()
+        self._sweeper: Optional[threading.Thread] = None
+        # jobs já entregues ao executor (em fila ou a correr) neste processo
+        self._submitted: Set[int] = set()
+        self._submitted_lock = threading.Lock()
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self._workers, thread_name_prefix=f"{self.label}-job"
+        )
+        self._sweeper = threading.Thread(
+            target=self._sweep, name=f"{self.label}-job-sweeper", daemon=True
+        )
+        self._sweeper.start()
+
+    def stop(self) -> None:
+        """Espera pelos jobs em curso; os que estão em fila ficam PENDING."""
+        self._stop.set()
+        if self._executor:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+        if self._sweeper:
+            self._sweeper.join(timeout=5)
+            self._sweeper = None
+
+    def submit(self, job_id: int) -> None:
+        """Põe o job na fila, se ainda não estiver em fila ou a correr aqui."""
+        if not self._executor or self._stop.is_set():
+            return
+        with self._submitted_lock:
+            if job_id in self._submitted:
+                return
+            self._submitted.add(job_id)
+        self._executor.submit(self._run, job_id)
+
+    # ---------- retoma de jobs interrompidos ----------
+
+    def _runnable(self, now: datetime):
+        """PENDING, ou RUNNING sem heartbeat há mais de stale_seconds."""
+        stale_before = now - timedelta(seconds=self._stale_seconds)
+        return or_(
+            self.model.status == "PENDING",
+            (self.model.status == "RUNNING") & (self.model.heartbeat_at < stale_before),
+        )
+
+    def _sweep(self) -> None:
+        while not self._stop.is_set():
+            try:
+                db = self._session_factory()
+                try:
+                    ids = [
+                        job_id
+                        for (job_id,) in db.query(self.model.id).filter(
+                            self._runnable(datetime.utcnow())
+                        )
+                    ]
+                finally:
+                    db.close()
+                for job_id in ids:
+                    self.submit(job_id)
+            except Exception:
+                logger.exception("Falha a procurar jobs %s pendentes", self.label)
+            self._stop.wait(self._sweep_seconds)
+
+    def _claim_values(self) -> Dict[Any, Any]:
+        """Colunas extra gravadas no claim (ex.: reiniciar contadores)."""
+        return {}
+
+    def _claim(self, db: Session, job_id: int) -> bool:
+        """Marca o job como RUNNING, se nenhum outro worker o tiver."""
+        now = datetime.utcnow()
+        claimed = (
+            db.query(self.model)
+            .filter(self.model.id == job_id, self._runnable(now))
+            .update(
+                {
+                    self.model.status: "RUNNING",
+                    self.model.started_at: now,
+                    self.model.heartbeat_at: now,
+                    **self._claim_values(),
+                },
+                synchronize_session=False,
+            )
+        )
+        db.commit()
+        return bool(claimed)
+
+    # ---------- execução ----------
+
+    def _run(self, job_id: int) -> None:
+        try:
+            if not self._stop.is_set():
+                self._run_claimed(job_id)
+        finally:
+            with self._submitted_lock:
+                self._submitted.discard(job_id)
+
+    def _run_claimed(self, job_id: int) -> None:
+        db = self._session_factory()
+        done = threading.Event()
+        try:
+            if not self._claim(db, job_id):
+                return
+            threading.Thread(
+                target=self._heartbeat,
+                args=(job_id, done),
+                name=f"{self.label}-heartbeat-{job_id}",
+                daemon=True,
+            ).start()
+            job = db.query(self.model).filter(self.model.id == job_id).first()
+            try:
+                self._process(db, job)
+            except Exception as exc:
+                logger.exception("Job %s %s falhou", self.label, job_id)
+                db.rollback()
+                self._fail(job, exc)
+                db.commit()
+        finally:
+            done.set()
+            self._finished(job_id)
+            db.close()
+
+    def _heartbeat(self, job_id: int, done: threading.Event) -> None:
+        """Actualiza heartbeat_at (sessão própria) até `done` ficar set."""
+        while not done.wait(self._heartbeat_seconds):
+            db = self._session_factory()
+            try:
+                db.query(self.model).filter(
+                    self.model.id == job_id, self.model.status == "RUNNING"
+                ).update(
+                    {self.model.heartbeat_at: datetime.utcnow()},
+                    synchronize_session=False,
+                )
+                db.commit()
+            except Exception:
+                # ex.: SQLite com o lock de escrita de uma transacção longa do job
+                db.rollback()
+                logger.debug("Heartbeat do job %s %s adiado", self.label, job_id, exc_info=True)
+            finally:
+                db.close()
+
+    def _fail(self, job, exc: Exception) -> None:
+        job.status = "FAILED"
+        job.error = str(exc)
+        job.finished_at = datetime.utcnow()
+
+    def _finished(self, job_id: int) -> None:
+        """Chamado no fim de cada execução (com ou sem sucesso)."""
+
+    def _process(self, db: Session, job) -> None:
+        raise NotImplementedError
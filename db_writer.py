@@ -0,0 +1,104 @@
+# db_writer.py
+"""
+Escritor único para as escritas dos pedidos (ex.: /risk/check).
+
+Em SQLite só uma transacção escreve de cada vez: com vários pedidos a fazer
+commit em simultâneo, uns esperam pelo lock (busy_timeout) e, sob carga,
+falham com "database is locked". Aqui as escritas passam todas por uma
+thread com uma ligação própria, pela ordem de chegada; as leituras
+continuam no pool do engine e, em WAL, nunca bloqueiam.
+
+Noutras bases de dados a escrita corre na thread de quem chama, numa
+sessão nova (não há razão para a serializar).
+Os jobs em background (ingestão, screening em massa) escrevem com as suas
+sessões; o busy_timeout faz com que esperem pelo escritor.
+"""
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Callable, Optional, TypeVar
+
+from sqlalchemy.orm import Session
+
+from database import engine as default_engine
+
+
+T = TypeVar("T")
+
+_STOP = object()
+
+
+class DatabaseWriter:
+    """
+    `run(fn)` executa fn(db) e faz commit (rollback e re-raise em erro).
+    Os objectos ORM devolvidos vêm desligados da sessão, com os atributos
+    carregados: podem ser lidos, mas não têm lazy loading.
+    """
+
+    def __init__(self, engine=default_engine, serialized: Optional[bool] = None) -> None:
+        self._engine = engine
+        self._serialized = (
+            engine.dialect.name == "sqlite" if serialized is None else serialized
+        )
+        self._queue: "queue.Queue" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def run(self, fn: Callable[[Session], T]) -> T:
+        if not self._serialized:
+            db = Session(bind=self._engine, expire_on_commit=False)
+            try:
+                return self._apply(db, fn)
+            finally:
+                db.close()
+        future: Future = Future()
+        self._ensure_started()
+        self._queue.put((fn, future))
+        return future.result()
+
+    def stop(self) -> None:
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join(timeout=10)
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+
+    @staticmethod
+    def _apply(db: Session, fn: Callable[[Session], T]) -> T:
+        try:
+            result = fn(db)
+            db.commit()
+            return result
+        except BaseException:
+            db.rollback()
+            raise
+        finally:
+            db.expunge_all()
+
+    def _run(self) -> None:
+        connection = self._engine.connect()
+        db = Session(bind=connection, expire_on_commit=False)
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _STOP:
+                    break
+                fn, future = item
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    future.set_result(self._apply(db, fn))
+                except BaseException as exc:
+                    future.set_exception(exc)
+        finally:
+            db.close()
+            connection.close()
+
+
+db_writer = DatabaseWriter()
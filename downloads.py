@@ -0,0 +1,190 @@
+# downloads.py
+"""
+Download de fontes por URL (/infosources/from-url).
+
+Um único httpx.AsyncClient (pool de ligações com keep-alive) corre num
+event loop próprio, numa thread de fundo; os workers de ingestão (threads)
+chamam downloader.download() e esperam pelo resultado. Vários downloads
+correm em simultâneo e reutilizam as ligações. O corpo é escrito em disco em
+blocos, com SHA-256 e o limite UPLOAD_MAX_BYTES (como nos uploads), sem
+nunca estar todo em memória.
+
+Pedidos condicionais: com o ETag / Last-Modified da versão anterior da
+fonte, um servidor que responda 304 evita o download e a re-ingestão.
+"""
+import asyncio
+import codecs
+import logging
+import os
+import threading
+from typing import NamedTuple, Optional
+
+from uploads import UPLOAD_CHUNK_BYTES, UPLOAD_MAX_BYTES, UploadWriter
+
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_TIMEOUT_SECONDS = float(os.getenv("DOWNLOAD_TIMEOUT_SECONDS", "30"))
+DOWNLOAD_MAX_CONNECTIONS = int(os.getenv("DOWNLOAD_MAX_CONNECTIONS", "10"))
+
+# Extensões guardadas tal como chegam; o resto (HTML) é guardado em UTF-8.
+BINARY_EXTENSIONS = (".csv", ".xls", ".xlsx", ".pdf")
+
+
+def url_extension(url: str) -> str:
+    """Extensão pela URL (sem querystring); sem extensão conhecida, '.html'."""
+    ext = os.path.splitext(url.split("?", 1)[0])[1].lower()
+    return ext if ext in BINARY_EXTENSIONS else ".html"
+
+
+class Download(NamedTuple):
+    # 304: o conteúdo não mudou desde (etag, last_modified) e nada foi gravado
+    not_modified: bool
+    path: Optional[str] = None
+    size: int = 0
+    sha256: Optional[str] = None
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+
+def _text_decoder(encoding: Optional[str]):
+    try:
+        return codecs.getincrementaldecoder(encoding or "utf-8")(errors="replace")
+    except LookupError:
+        return codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+
+class Downloader:
+    """Cliente HTTP assíncrono partilhado; arranca no primeiro download."""
+
+    def __init__(
+        self,
+        max_connections: int = DOWNLOAD_MAX_CONNECTIONS,
+        timeout: float = DOWNLOAD_TIMEOUT_SECONDS,
+        max_bytes: int = UPLOAD_MAX_BYTES,
+    ) -> None:
+        self._max_connections = max_connections
+        self._timeout = timeout
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._client = None
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is not None:
+                return self._loop
+            try:
+                import httpx
+            except ImportError:
+                raise RuntimeError("Dependência 'httpx' não está instalada no servidor.")
+
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="downloads", daemon=True)
+            thread.start()
+
+            async def make_client():
+                return httpx.AsyncClient(
+                    timeout=self._timeout,
+                    follow_redirects=True,
+                    limits=httpx.Limits(
+                        max_connections=self._max_connections,
+                        max_keepalive_connections=self._max_connections,
+                    ),
+                )
+
+            self._client = asyncio.run_coroutine_threadsafe(make_client(), loop).result()
+            self._loop, self._thread = loop, thread
+            return loop
+
+    def stop(self) -> None:
+        with self._lock:
+            if self._loop is None:
+                return
+            try:
+                asyncio.run_coroutine_threadsafe(self._client.aclose(), self._loop).result(
+                    timeout=5
+                )
+            except Exception:
+                logger.warning("Falha a fechar o cliente HTTP", exc_info=True)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+            self._loop.close()
+            self._loop = self._thread = self._client = None
+
+    def download(
+        self,
+        url: str,
+        ext: str,
+        directory: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> Download:
+        """Versão síncrona de `fetch`, para os workers de ingestão."""
+        loop = self._ensure_started()
+        future = asyncio.run_coroutine_threadsafe(
+            self.fetch(url, ext, directory, etag, last_modified), loop
+        )
+        return future.result()
+
+    async def fetch(
+        self,
+        url: str,
+        ext: str,
+        directory: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> Download:
+        """
+        GET condicional (If-None-Match / If-Modified-Since, se houver) com o
+        corpo gravado em `directory`. Devolve Download(not_modified=True) num 304.
+        """
+        import httpx
+
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        try:
+            async with self._client.stream("GET", url, headers=headers) as resp:
+                if resp.status_code == 304:
+                    return Download(
+                        True,
+                        etag=resp.headers.get("ETag", etag),
+                        last_modified=resp.headers.get("Last-Modified", last_modified),
+                    )
+                if resp.status_code != 200:
+                    raise RuntimeError(
+                        f"Não foi possível obter o conteúdo da URL (HTTP {resp.status_code})."
+                    )
+
+                # HTML: guarda-se o texto (snapshot da página) em UTF-8
+                decoder = None if ext in BINARY_EXTENSIONS else _text_decoder(resp.charset_encoding)
+                writer = UploadWriter(directory, self._max_bytes)
+                try:
+                    async for chunk in resp.aiter_bytes(UPLOAD_CHUNK_BYTES):
+                        if decoder is not None:
+                            chunk = decoder.decode(chunk).encode("utf-8")
+                        writer.write(chunk)
+                    if decoder is not None:
+                        writer.write(decoder.decode(b"", final=True).encode("utf-8"))
+                except BaseException:
+                    writer.abort()
+                    raise
+                stored = writer.commit(directory, f"url{ext}", content_named=True)
+                return Download(
+                    False,
+                    stored.path,
+                    stored.size,
+                    stored.sha256,
+                    resp.headers.get("ETag"),
+                    resp.headers.get("Last-Modified"),
+                )
+        except httpx.HTTPError:
+            raise RuntimeError("Não foi possível obter o conteúdo da URL.")
+
+
+downloader = Downloader()
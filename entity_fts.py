@@ -0,0 +1,121 @@
+# entity_fts.py
+"""
+Índice FTS5 (SQLite) sobre normalized_entities: person_name, role, country.
+
+Tabela virtual de conteúdo externo (content=normalized_entities), mantida
+por triggers de INSERT / DELETE / UPDATE, pelo que as inserções em bloco e
+os deletes do ingest a actualizam sem código extra. O tokenizer unicode61
+ignora maiúsculas e acentos ('José' = 'JOSE').
+
+O /risk/check passa-o ao find_matches para recolher candidatos por token,
+ordenados por bm25 (o screening em massa e o re-screening ficam só no
+snapshot, sem queries): tokens raros (apelidos pouco comuns) pesam mais do que no pré-score de
+trigramas, que continua a dar os candidatos com erros de escrita. Fora do
+SQLite (ou sem FTS5 compilado, ou com ENTITY_FTS=0) não há índice e o
+screening usa só o snapshot em memória.
+"""
+import logging
+import os
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from normalization import NAME_PARTICLES, name_tokens
+
+
+logger = logging.getLogger(__name__)
+
+ENTITY_FTS = os.getenv("ENTITY_FTS", "1") == "1"
+# Candidatos lidos do FTS por pesquisa (o top-K por tipo de fonte aplica-se depois).
+ENTITY_FTS_LIMIT = int(os.getenv("ENTITY_FTS_LIMIT", "200"))
+
+FTS_TABLE = "normalized_entities_fts"
+
+_DDL = [
+    f"""
+    CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        person_name, role, country,
+        content='normalized_entities', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON normalized_entities BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, person_name, role, country)
+        VALUES (new.id, new.person_name, new.role, new.country);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON normalized_entities BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, person_name, role, country)
+        VALUES ('delete', old.id, old.person_name, old.role, old.country);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au
+    AFTER UPDATE OF person_name, role, country ON normalized_entities BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, person_name, role, country)
+        VALUES ('delete', old.id, old.person_name, old.role, old.country);
+        INSERT INTO {FTS_TABLE}(rowid, person_name, role, country)
+        VALUES (new.id, new.person_name, new.role, new.country);
+    END
+    """,
+]
+
+
+class EntityFts:
+    def __init__(self) -> None:
+        self._engine: Optional[Engine] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._engine is not None
+
+    def create(self, engine: Engine) -> bool:
+        """
+        Cria (se não existir) a tabela FTS5 e os triggers; numa base de dados
+        com entidades já indexadas preenche o índice (rebuild). Devolve se o
+        índice fica activo.
+        """
+        if not ENTITY_FTS or engine.dialect.name != "sqlite":
+            return False
+        try:
+            with engine.begin() as conn:
+                exists = conn.execute(
+                    text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                    {"name": FTS_TABLE},
+                ).first()
+                for i, ddl in enumerate(_DDL):
+                    if i == 0 and exists:
+                        continue
+                    conn.execute(text(ddl))
+                if not exists:
+                    conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+        except Exception:
+            # sqlite3 sem FTS5: o screening funciona só com o snapshot
+            logger.exception("Índice FTS5 indisponível; pesquisa só no snapshot")
+            return False
+        self._engine = engine
+        return True
+
+    def search(self, name: Optional[str], limit: int = ENTITY_FTS_LIMIT) -> List[int]:
+        """Ids das entidades com algum token de `name` no nome, por bm25."""
+        if self._engine is None:
+            return []
+        tokens = [t for t in dict.fromkeys(name_tokens(name)) if t not in NAME_PARTICLES]
+        if not tokens:
+            return []
+        query = "{person_name} : (" + " OR ".join(f'"{t}"' for t in tokens) + ")"
+        with self._engine.connect() as conn:
+            rows = conn.execute(
+                text(
+                    f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :query "
+                    "ORDER BY rank LIMIT :limit"
+                ),
+                {"query": query, "limit": limit},
+            )
+            return [entity_id for (entity_id,) in rows]
+
+
+entity_fts = EntityFts()
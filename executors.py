@@ -0,0 +1,112 @@
+# executors.py
+"""
+Executores dedicados para trabalho bloqueante ou pesado em CPU, e um
+detector de bloqueios do event loop.
+
+Endpoints `async def` correm no event loop: qualquer chamada síncrona
+(SQLAlchemy, escrita em disco) congela todos os pedidos desse worker,
+incluindo /health. Esse trabalho vai para `io_executor` com `await run(...)`.
+O trabalho pesado em CPU (relatórios PDF) tem um executor próprio, com
+tamanho fixo (REPORT_WORKERS), e o endpoint, async, espera-o com `await
+run(...)`: os pedidos em espera não ocupam threads do threadpool do Starlette.
+A ingestão (IngestionJobRunner, INGEST_JOBS_WORKERS) e a extracção de PDF
+(processos, PDF_EXTRACT_WORKERS) já têm os seus pools.
+
+O EventLoopStallDetector regista (WARNING, com o stack do loop) qualquer
+bloqueio maior do que EVENT_LOOP_STALL_MS.
+"""
+import asyncio
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Callable, Optional, TypeVar
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+BLOCKING_IO_WORKERS = int(os.getenv("BLOCKING_IO_WORKERS", "8"))
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "2"))
+
+EVENT_LOOP_STALL_MS = int(os.getenv("EVENT_LOOP_STALL_MS", "200"))
+
+io_executor = ThreadPoolExecutor(BLOCKING_IO_WORKERS, thread_name_prefix="blocking-io")
+report_executor = ThreadPoolExecutor(REPORT_WORKERS, thread_name_prefix="report")
+
+
+async def run(executor: Executor, fn: Callable[..., T], *args, **kwargs) -> T:
+    """Para código async: corre fn no executor sem bloquear o event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+
+
+class EventLoopStallDetector:
+    """
+    Uma tarefa no loop marca um batimento a cada `threshold / 4`; uma thread
+    de vigia verifica-o. Se o loop não bater durante mais de `threshold`,
+    a vigia regista o stack da thread do loop (o código que o bloqueia); quando
+    o loop volta, regista a duração total do bloqueio.
+    """
+
+    def __init__(self, threshold_ms: int = EVENT_LOOP_STALL_MS) -> None:
+        self._threshold = threshold_ms / 1000
+        self._interval = self._threshold / 4
+        self._beat = time.monotonic()
+        self._reported = False
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Chamar de dentro do loop (ex.: evento de startup async)."""
+        if self._threshold <= 0 or self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._watchdog = threading.Thread(
+            target=self._watch, name="event-loop-watchdog", daemon=True
+        )
+        self._watchdog.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=5)
+            self._watchdog = None
+
+    async def _heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(self._interval)
+            now = time.monotonic()
+            stalled = now - self._beat - self._interval
+            if stalled > self._threshold:
+                logger.warning("Event loop bloqueado durante %.0f ms", stalled * 1000)
+            self._beat = now
+            self._reported = False
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self._interval):
+            stalled = time.monotonic() - self._beat - self._interval
+            if stalled <= self._threshold or self._reported:
+                continue
+            self._reported = True
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "?"
+            logger.warning(
+                "Event loop bloqueado há mais de %.0f ms, em:\n%s", stalled * 1000, stack
+            )
+
+
+stall_detector = EventLoopStallDetector()
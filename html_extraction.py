@@ -0,0 +1,263 @@
+# html_extraction.py
+"""
+Extracção heurística de entidades de páginas HTML, numa única passagem.
+
+O extractor anterior (BeautifulSoup) chamava get_text() em cada <div>: com
+layouts aninhados cada texto era percorrido uma vez por antepassado
+(quadrático na profundidade) e cada nível gerava mais uma entidade quase
+igual. Aqui o HTML é lido em streaming (html.parser da biblioteca padrão) e
+cada nó de texto é visitado uma só vez e entregue a um único dono:
+
+  - a célula (<td>/<th>) ou o item de lista (<li>) aberto mais interior;
+  - senão, o bloco (<div>, <p>, <section>, ...) aberto mais interior.
+
+Quando um elemento fecha, o seu texto é interpretado: tabelas com cabeçalho
+(nome / cargo / país), itens "Nome – Cargo" e blocos com "Ministro",
+"Secretário" ou "Governador". Fechos implícitos (<li>, <td>, <tr>, <p> sem
+fecho) são tratados como num browser, de forma simplificada.
+"""
+import re
+from html.parser import HTMLParser
+from typing import List, Optional
+
+from pdf_extraction import dedupe_entities
+
+
+ROLE_KEYWORDS = ("ministro", "secretário", "governador")
+
+BLOCK_TAGS = {
+    "address", "article", "aside", "blockquote", "dd", "div", "dl", "dt",
+    "footer", "header", "h1", "h2", "h3", "h4", "h5", "h6", "main", "nav",
+    "p", "section",
+}
+LIST_TAGS = {"ul", "ol"}
+CELL_TAGS = {"td", "th"}
+# conteúdo que não é texto da página
+SKIP_TAGS = {"script", "style", "template", "noscript"}
+# elementos sem fecho que separam palavras
+BREAK_TAGS = {"br", "hr", "img"}
+
+_SPACES = re.compile(r"\s+")
+
+
+def _clean(parts: List[str]) -> str:
+    return _SPACES.sub(" ", "".join(parts)).strip()
+
+
+def _has_role_keyword(text: str) -> bool:
+    lower = text.lower()
+    return any(k in lower for k in ROLE_KEYWORDS)
+
+
+class _Frame:
+    __slots__ = ("tag", "kind", "text", "cells", "rows")
+
+    def __init__(self, tag: str, kind: str) -> None:
+        self.tag = tag
+        self.kind = kind  # table, row, cell, list, item, block
+        self.text: List[str] = []
+        self.cells: List[str] = []  # row
+        self.rows: List[List[str]] = []  # table
+
+
+class _EntityParser(HTMLParser):
+    def __init__(self, default_country: str) -> None:
+        super().__init__(convert_charrefs=True)
+        self.default_country = default_country
+        self.entities: List[dict] = []
+        self._stack: List[_Frame] = []
+        # índices no _stack dos donos de texto (célula / item, e blocos)
+        self._items: List[int] = []
+        self._blocks: List[int] = []
+        self._skip = 0
+
+    # ---------- estrutura ----------
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self._skip += 1
+        elif tag in BREAK_TAGS:
+            self.handle_data(" ")
+        elif tag == "table":
+            self._push(tag, "table")
+        elif tag == "tr":
+            self._close_inside("table")
+            self._push(tag, "row")
+        elif tag in CELL_TAGS:
+            self._close_inside("row", "table")
+            self._push(tag, "cell")
+        elif tag in LIST_TAGS:
+            self._push(tag, "list")
+        elif tag == "li":
+            self._close_inside("list", stop_at_kind="item")
+            self._push(tag, "item")
+        elif tag in BLOCK_TAGS:
+            # um bloco fecha o <p> aberto (fecho implícito)
+            if self._stack and self._stack[-1].tag == "p":
+                self._pop()
+            self._push(tag, "block")
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in BREAK_TAGS:
+            self.handle_data(" ")
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self._skip = max(0, self._skip - 1)
+            return
+        for i in range(len(self._stack) - 1, -1, -1):
+            if self._stack[i].tag == tag:
+                while len(self._stack) > i:
+                    self._pop()
+                return
+
+    def handle_data(self, data):
+        if self._skip:
+            return
+        if self._items:
+            self._stack[self._items[-1]].text.append(data)
+        elif self._blocks:
+            self._stack[self._blocks[-1]].text.append(data)
+
+    def close(self):
+        super().close()
+        while self._stack:
+            self._pop()
+
+    def _push(self, tag: str, kind: str) -> None:
+        self._stack.append(_Frame(tag, kind))
+        index = len(self._stack) - 1
+        if kind in ("cell", "item"):
+            self._items.append(index)
+        elif kind == "block":
+            self._blocks.append(index)
+        if kind in ("cell", "item", "block", "table"):
+            # o texto que o antepassado já tinha fica separado do novo
+            self.handle_data(" ")
+
+    def _close_inside(self, *kinds: str, stop_at_kind: Optional[str] = None) -> None:
+        """
+        Fecha os elementos abertos dentro do último de `kinds` (ex.: um <td>
+        fecha a célula anterior da mesma linha). Com `stop_at_kind`, só fecha
+        se encontrar esse tipo antes (um <li> só fecha o <li> irmão).
+        """
+        for i in range(len(self._stack) - 1, -1, -1):
+            kind = self._stack[i].kind
+            if kind in kinds:
+                if stop_at_kind is None:
+                    while len(self._stack) > i + 1:
+                        self._pop()
+                return
+            if stop_at_kind is not None and kind == stop_at_kind:
+                while len(self._stack) > i:
+                    self._pop()
+                return
+
+    def _pop(self) -> None:
+        frame = self._stack.pop()
+        index = len(self._stack)
+        if self._items and self._items[-1] == index:
+            self._items.pop()
+        if self._blocks and self._blocks[-1] == index:
+            self._blocks.pop()
+
+        parent = self._stack[-1] if self._stack else None
+        if frame.kind == "cell":
+            if parent is not None and parent.kind == "row":
+                parent.cells.append(_clean(frame.text))
+        elif frame.kind == "row":
+            table = next((f for f in reversed(self._stack) if f.kind == "table"), None)
+            if table is not None and frame.cells:
+                table.rows.append(frame.cells)
+        elif frame.kind == "table":
+            self._table_rows(frame.rows)
+        elif frame.kind == "item":
+            self._item_text(_clean(frame.text))
+        elif frame.kind == "block":
+            self._block_text(_clean(frame.text))
+
+    # ---------- heurísticas ----------
+
+    def _table_rows(self, rows: List[List[str]]) -> None:
+        """Tabelas com cabeçalhos (primeira linha)."""
+        if len(rows) < 2:
+            return
+        headers = [h.lower() for h in rows[0]]
+        for cols in rows[1:]:
+            if len(cols) != len(headers):
+                continue
+            row = dict(zip(headers, cols))
+
+            name = (
+                row.get("nome")
+                or row.get("name")
+                or row.get("titular")
+                or row.get("ministro")
+            )
+            if not name:
+                continue
+
+            role = (
+                row.get("cargo")
+                or row.get("funcao")
+                or row.get("função")
+                or row.get("role")
+                or row.get("posição")
+                or row.get("position")
+                or ""
+            )
+            country = (
+                row.get("pais")
+                or row.get("país")
+                or row.get("country")
+                or self.default_country
+            )
+            self.entities.append(
+                {"person_name": name, "role": role, "country": country}
+            )
+
+    def _item_text(self, text: str) -> None:
+        """Listas simples (ul/li) – ex: "Nome – Ministro de X"."""
+        if len(text.split()) < 2 or not _has_role_keyword(text):
+            return
+        # tentar separar em "Nome – Cargo"
+        if "–" in text:
+            parts = [p.strip() for p in text.split("–", 1)]
+        elif "-" in text:
+            parts = [p.strip() for p in text.split("-", 1)]
+        else:
+            parts = [text]
+        self.entities.append(
+            {
+                "person_name": parts[0],
+                "role": parts[1] if len(parts) > 1 else "",
+                "country": self.default_country,
+            }
+        )
+
+    def _block_text(self, text: str) -> None:
+        """Blocos com "Ministro" / "Secretário" / "Governador"."""
+        parts = text.split()
+        if len(parts) < 2 or not _has_role_keyword(text):
+            return
+        self.entities.append(
+            {
+                "person_name": " ".join(parts[0:3]),
+                "role": text,
+                "country": self.default_country,
+            }
+        )
+
+
+def extract_entities_from_html_content(
+    html: str,
+    default_country: str = "Angola",
+) -> List[dict]:
+    """
+    Extrai entidades de uma página HTML (heurística simples, uma passagem).
+    Devolve lista de dicts com chaves: person_name, role, country.
+    """
+    parser = _EntityParser(default_country)
+    parser.feed(html or "")
+    parser.close()
+    return dedupe_entities(parser.entities)
@@ -0,0 +1,342 @@
+# ingestion.py
+"""
+Ingestão de fontes: indexação de ficheiros tabulares (CSV / Excel) e
+escrita em normalized_entities / entity_identifiers. A extracção de
+entidades de HTML e PDF está em html_extraction / pdf_extraction.
+"""
+import hashlib
+import json
+import logging
+import os
+from collections import defaultdict
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from models import InfoSource, NormalizedEntity, EntityIdentifier
+from normalization import name_key_columns, canonical_identifiers
+from payloads import delete_orphan_payloads, store_payloads
+from tabular import (
+    guess_mapping,
+    iter_tabular_rows,
+    iter_workbook_rows,
+    read_tabular_headers,
+    read_workbook_headers,
+)
+
+
+logger = logging.getLogger(__name__)
+
+# Linhas por bloco de INSERT (executemany) durante a ingestão.
+INGEST_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", "5000"))
+
+
+def add_entity_identifiers(db: Session, entities: List[NormalizedEntity]) -> None:
+    """
+    Regista em entity_identifiers os identificadores canónicos das entidades
+    (faz flush para obter os ids; o commit fica a cargo de quem chama).
+    """
+    db.flush()
+    for e in entities:
+        for kind, value in canonical_identifiers(
+            e.person_nif, e.person_passport, e.residence_card
+        ):
+            db.add(EntityIdentifier(kind=kind, value=value, entity_id=e.id))
+
+
+class IngestStats(NamedTuple):
+    added: int
+    removed: int
+    unchanged: int
+
+
+# Campos que entram no row_hash: os mapeados + a linha original.
+ROW_HASH_FIELDS = (
+    "person_name",
+    "person_nif",
+    "person_passport",
+    "residence_card",
+    "role",
+    "country",
+    "raw_payload",
+)
+
+
+def row_hash(entity: dict) -> str:
+    """SHA-256 de ROW_HASH_FIELDS (identifica a mesma linha entre versões)."""
+    fields = {f: entity.get(f) for f in ROW_HASH_FIELDS}
+    raw = json.dumps(fields, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def bulk_insert_entities(
+    db: Session,
+    source_id: int,
+    entities: Iterable[dict],
+    chunk_size: int = INGEST_CHUNK_ROWS,
+    progress: Optional[Callable[[int], None]] = None,
+) -> int:
+    """
+    Insere entidades (dicts com as colunas de NormalizedEntity, sem source_id,
+    e o raw_payload) em blocos de `chunk_size`: por bloco, um executemany em
+    entity_payloads (só os payloads novos), outro em normalized_entities e
+    outro em entity_identifiers. Só um bloco está em memória de cada vez.
+    Devolve o número de entidades inseridas; o commit fica a cargo de quem chama.
+    """
+    entity_insert = (
+        insert(NormalizedEntity.__table__)
+        .returning(NormalizedEntity.__table__.c.id, sort_by_parameter_order=True)
+    )
+    total = 0
+    rows = iter(entities)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        payload_hashes = store_payloads(db, (e.get("raw_payload") for e in chunk))
+        params = [
+            {
+                "source_id": source_id,
+                "row_hash": e.get("row_hash") or row_hash(e),
+                **{k: v for k, v in e.items() if k != "raw_payload"},
+                **name_key_columns(e.get("person_name")),
+                "payload_hash": payload_hash,
+            }
+            for e, payload_hash in zip(chunk, payload_hashes)
+        ]
+        ids = db.execute(entity_insert, params).scalars().all()
+
+        identifiers = [
+            {"kind": kind, "value": value, "entity_id": entity_id}
+            for entity_id, e in zip(ids, chunk)
+            for kind, value in canonical_identifiers(
+                e.get("person_nif"), e.get("person_passport"), e.get("residence_card")
+            )
+        ]
+        if identifiers:
+            db.execute(insert(EntityIdentifier.__table__), identifiers)
+
+        total += len(chunk)
+        logger.info("Fonte %s: %s entidades inseridas", source_id, total)
+        if progress is not None:
+            progress(total)
+    return total
+
+
+def delete_entities(db: Session, entity_ids: List[int]) -> None:
+    """
+    Remove entidades (e os seus identificadores) em blocos de ids, e os
+    payloads que deixam de ser usados.
+    """
+    for i in range(0, len(entity_ids), 500):
+        chunk = entity_ids[i : i + 500]
+        payload_hashes = [
+            h
+            for (h,) in db.query(NormalizedEntity.payload_hash).filter(
+                NormalizedEntity.id.in_(chunk)
+            )
+        ]
+        db.query(EntityIdentifier).filter(EntityIdentifier.entity_id.in_(chunk)).delete(
+            synchronize_session=False
+        )
+        db.query(NormalizedEntity).filter(NormalizedEntity.id.in_(chunk)).delete(
+            synchronize_session=False
+        )
+        delete_orphan_payloads(db, payload_hashes)
+
+
+def delete_source_entities(db: Session, source_id: int) -> None:
+    """Remove todas as entidades de uma fonte (ver delete_entities)."""
+    entity_ids = [
+        entity_id
+        for (entity_id,) in db.query(NormalizedEntity.id).filter(
+            NormalizedEntity.source_id == source_id
+        )
+    ]
+    delete_entities(db, entity_ids)
+
+
+def sync_entities(
+    db: Session,
+    src: InfoSource,
+    entities: Iterable[dict],
+    progress: Optional[Callable[[int], None]] = None,
+) -> IngestStats:
+    """
+    Aplica uma (nova) versão da fonte por diferença de linhas: compara o
+    row_hash de cada entidade com os já gravados para `src`, insere só as
+    novas e remove as que desapareceram. Numa fonte vazia insere tudo.
+    Em memória fica apenas o mapa row_hash -> ids da versão anterior.
+    Um único commit no fim; em caso de erro nada é alterado.
+    `progress` recebe o número de linhas lidas, a cada INGEST_CHUNK_ROWS.
+    """
+    previous: Dict[str, List[int]] = defaultdict(list)
+    for entity_id, h in db.query(NormalizedEntity.id, NormalizedEntity.row_hash).filter(
+        NormalizedEntity.source_id == src.id
+    ):
+        previous[h].append(entity_id)
+
+    unchanged = 0
+    processed = 0
+
+    def new_rows() -> Iterator[dict]:
+        nonlocal unchanged, processed
+        for entity in entities:
+            processed += 1
+            if progress is not None and processed % INGEST_CHUNK_ROWS == 0:
+                progress(processed)
+            h = row_hash(entity)
+            kept = previous.get(h)
+            if kept:
+                kept.pop()
+                unchanged += 1
+                continue
+            yield {**entity, "row_hash": h}
+
+    try:
+        added = bulk_insert_entities(db, src.id, new_rows())
+        if progress is not None:
+            progress(processed)
+        removed_ids = [entity_id for ids in previous.values() for entity_id in ids]
+        delete_entities(db, removed_ids)
+    except Exception:
+        db.rollback()
+        raise
+    src.num_records = added + unchanged
+    db.commit()
+    db.refresh(src)
+    logger.info(
+        "Fonte %s: %s novas, %s removidas, %s inalteradas",
+        src.id,
+        added,
+        len(removed_ids),
+        unchanged,
+    )
+    return IngestStats(added, len(removed_ids), unchanged)
+
+
+def entity_from_row(row: dict, mapping: dict) -> Optional[dict]:
+    """Aplica o mapping a uma linha; None se não tiver nome nem identificadores."""
+
+    def value(field: str) -> Optional[str]:
+        column = mapping.get(field)
+        return row.get(column, "") or None if column else None
+
+    entity = {
+        "person_name": value("name"),
+        "person_nif": value("nif"),
+        "person_passport": value("passport"),
+        "residence_card": value("residence_card"),
+        "role": value("role"),
+        "country": value("country"),
+    }
+    if not any(
+        entity[f] for f in ("person_name", "person_nif", "person_passport", "residence_card")
+    ):
+        return None
+    entity["raw_payload"] = row
+    return entity
+
+
+NAME_COLUMN_REQUIRED = "Não foi possível identificar a coluna do nome. Envia mapping_json explícito."
+
+
+def excel_sheet_mappings(
+    file_path: str,
+    mapping_json: Optional[str],
+    sheets: Optional[List[str]] = None,
+) -> Dict[str, dict]:
+    """
+    Mapping de cada folha a ingerir (todas, ou só as de `sheets`). Cada folha
+    tem o seu cabeçalho; sem mapping_json, o mapping é adivinhado por folha.
+    Folhas sem coluna de nome são ignoradas.
+    """
+    headers = read_workbook_headers(file_path)
+    selected = list(dict.fromkeys(sheets)) if sheets else list(headers)
+    missing = [sheet for sheet in selected if sheet not in headers]
+    if missing:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Folhas inexistentes no Excel: {', '.join(missing)}",
+        )
+
+    explicit = json.loads(mapping_json) if mapping_json else None
+    mappings: Dict[str, dict] = {}
+    for sheet in selected:
+        mapping = explicit or guess_mapping(headers[sheet])
+        if mapping.get("name") in headers[sheet]:
+            mappings[sheet] = mapping
+        else:
+            logger.info("Folha %s de %s sem coluna de nome; ignorada", sheet, file_path)
+
+    if not mappings:
+        raise HTTPException(status_code=400, detail=NAME_COLUMN_REQUIRED)
+    return mappings
+
+
+def index_tabular_file(
+    db: Session,
+    src: InfoSource,
+    file_path: str,
+    mapping_json: Optional[str],
+    ext: str,
+    progress: Optional[Callable[[int], None]] = None,
+    sheets: Optional[List[str]] = None,
+) -> IngestStats:
+    """
+    Lê um ficheiro tabular (CSV ou Excel) em streaming, aplica o mapping linha
+    a linha e sincroniza as entidades da fonte (ver sync_entities): numa fonte
+    nova insere tudo, numa nova versão só as diferenças. As inserções são em
+    blocos, pelo que a memória não depende do tamanho do ficheiro.
+    No Excel são lidas todas as folhas (ou só as de `sheets`), em paralelo,
+    cada uma com o seu mapping (ver excel_sheet_mappings).
+    """
+    if ext.lower() in [".xls", ".xlsx"]:
+        mappings = excel_sheet_mappings(file_path, mapping_json, sheets)
+        rows = (
+            entity_from_row(row, mappings[sheet])
+            for sheet, row in iter_workbook_rows(file_path, list(mappings))
+        )
+    else:
+        if mapping_json:
+            mapping = json.loads(mapping_json)
+        else:
+            mapping = guess_mapping(read_tabular_headers(file_path, ext))
+
+        if "name" not in mapping:
+            raise HTTPException(status_code=400, detail=NAME_COLUMN_REQUIRED)
+        rows = (entity_from_row(row, mapping) for row in iter_tabular_rows(file_path, ext))
+
+    entities = (entity for entity in rows if entity is not None)
+    return sync_entities(db, src, entities, progress=progress)
+
+
+def create_entities_from_extracted(
+    db: Session,
+    src: InfoSource,
+    extracted: List[dict],
+    progress: Optional[Callable[[int], None]] = None,
+) -> IngestStats:
+    """
+    Recebe lista de dicts com chaves (person_name, role, country, opcionalmente nif/passport)
+    e sincroniza as NormalizedEntity da fonte (ver sync_entities).
+    """
+    def entities():
+        for e in extracted:
+            name = (e.get("person_name") or "").strip()
+            if not name:
+                continue
+            yield {
+                "person_name": name,
+                "person_nif": (e.get("person_nif") or None),
+                "person_passport": (e.get("person_passport") or None),
+                "residence_card": (e.get("residence_card") or None),
+                "role": (e.get("role") or None),
+                "country": (e.get("country") or None),
+                "raw_payload": e,
+            }
+
+    return sync_entities(db, src, entities(), progress=progress)
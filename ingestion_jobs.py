@@ -0,0 +1,374 @@
+# ingestion_jobs.py
+"""
+Fila persistente (tabela ingestion_jobs) para a ingestão de fontes.
+
+Os endpoints de upload só gravam o ficheiro (ou a URL), criam o job e
+devolvem 202; um pool de workers faz o download, a extracção e o diff de
+linhas (ingestion.sync_entities) fora do pedido HTTP.
+
+O diff de uma fonte é uma única transacção, e no SQLite não se pode
+escrever o progresso na BD a meio dela: as linhas processadas de um job em
+curso ficam em memória no processo que o executa (live_rows) e só são
+gravadas no fim. As mudanças de etapa (stage) são gravadas logo.
+
+Fila, claim, retoma e heartbeat: ver db_jobs.DbJobRunner. No SQLite a
+escrita do heartbeat espera (e pode falhar) enquanto a transacção do diff
+tem o lock de escrita; não faz mal: com o lock, nenhum outro processo
+consegue reclamar o job.
+"""
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from db_jobs import DbJobRunner, job_rows_per_second
+from downloads import downloader
+from ingestion import (
+    IngestStats,
+    create_entities_from_extracted,
+    index_tabular_file,
+)
+from html_extraction import extract_entities_from_html_content
+from models import IngestionJob, InfoSource, NormalizedEntity
+from pdf_extraction import extract_entities_from_pdf_file
+from rescreening import schedule_rescreen
+from screening import screening
+from utils import ensure_dir
+
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = "data/uploads"
+INGEST_JOBS_WORKERS = int(os.getenv("INGEST_JOBS_WORKERS", "2"))
+# Um job RUNNING sem heartbeat há mais do que isto é dado como interrompido.
+INGEST_JOBS_STALE_SECONDS = int(os.getenv("INGEST_JOBS_STALE_SECONDS", "600"))
+INGEST_JOBS_HEARTBEAT_SECONDS = float(os.getenv("INGEST_JOBS_HEARTBEAT_SECONDS", "30"))
+
+TABULAR_EXTENSIONS = (".csv", ".xls", ".xlsx")
+
+
+def ingest_options(mapping_json: Optional[str], sheets: Optional[List[str]]) -> tuple:
+    """Forma normalizada do mapeamento e das folhas, para comparar versões."""
+    mapping = None
+    if mapping_json and mapping_json.strip():
+        try:
+            mapping = json.dumps(json.loads(mapping_json), sort_keys=True)
+        except ValueError:
+            mapping = mapping_json.strip()
+    return mapping, tuple(sorted(set(sheets))) if sheets else None
+
+
+def last_applied_options(db: Session, source_id: int) -> tuple:
+    """Mapeamento e folhas do último job que aplicou uma versão da fonte."""
+    job = (
+        db.query(IngestionJob)
+        .filter(
+            IngestionJob.source_id == source_id,
+            IngestionJob.status == "DONE",
+            IngestionJob.ingest_status.in_(("CREATED", "UPDATED")),
+        )
+        .order_by(IngestionJob.id.desc())
+        .first()
+    )
+    if job is None:
+        return None, None
+    return ingest_options(job.mapping_json, json.loads(job.sheets_json) if job.sheets_json else None)
+
+
+def find_source_version(
+    db: Session,
+    name: str,
+    source_type: str,
+    content_sha256: str,
+    mapping_json: Optional[str] = None,
+    sheets: Optional[List[str]] = None,
+) -> Tuple[Optional[InfoSource], bool]:
+    """
+    Fonte a que um novo ficheiro corresponde: (fonte, conteúdo idêntico?).
+    Um ficheiro igual a uma fonte do mesmo tipo, com o mesmo mapeamento e as
+    mesmas folhas da versão aplicada, não é ingerido outra vez; senão, uma
+    fonte com o mesmo nome e tipo passa a ter uma nova versão.
+    """
+    same_content = (
+        db.query(InfoSource)
+        .filter(
+            InfoSource.source_type == source_type,
+            InfoSource.content_sha256 == content_sha256,
+        )
+        .order_by(InfoSource.id.desc())
+        .first()
+    )
+    if same_content and last_applied_options(db, same_content.id) == ingest_options(
+        mapping_json, sheets
+    ):
+        return same_content, True
+    previous = (
+        db.query(InfoSource)
+        .filter(InfoSource.name == name, InfoSource.source_type == source_type)
+        .order_by(InfoSource.id.desc())
+        .first()
+    )
+    return previous, False
+
+
+def remove_file(path: Optional[str]) -> None:
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def remove_source_file(db: Session, path: Optional[str], source_id: int) -> None:
+    """
+    Remove o ficheiro de uma fonte, excepto se outra fonte o usar (ficheiros
+    gravados por versões antigas, com nome só pelo conteúdo, são partilhados).
+    """
+    if not path:
+        return
+    shared = (
+        db.query(InfoSource.id)
+        .filter(InfoSource.file_path == path, InfoSource.id != source_id)
+        .first()
+    )
+    if shared is None:
+        remove_file(path)
+
+
+def enqueue_ingestion(
+    db: Session,
+    name: str,
+    source_type: str,
+    description: str,
+    user_id: int,
+    kind: str,
+    ext: str,
+    mapping_json: Optional[str] = None,
+    sheets: Optional[List[str]] = None,
+    url: Optional[str] = None,
+    file_path: Optional[str] = None,
+    file_size: Optional[int] = None,
+    content_sha256: Optional[str] = None,
+) -> Tuple[InfoSource, IngestionJob]:
+    """
+    Cria o job (e a fonte, se ainda não existir uma com o mesmo nome e tipo).
+    Uma fonte nova fica com 0 registos até o job terminar; numa fonte
+    existente nada muda antes do diff. O content_sha256 só é gravado no
+    commit do diff: se o job falhar, o mesmo ficheiro pode voltar a ser
+    enviado sem ser dado como "idêntico".
+    """
+    src = (
+        db.query(InfoSource)
+        .filter(InfoSource.name == name, InfoSource.source_type == source_type)
+        .order_by(InfoSource.id.desc())
+        .first()
+    )
+    created = src is None
+    if created:
+        src = InfoSource(
+            name=name,
+            source_type=source_type,
+            description=description,
+            file_path=file_path or "",
+            file_size=file_size,
+            num_records=0,
+            uploaded_by_id=user_id,
+        )
+        db.add(src)
+        db.flush()
+
+    job = IngestionJob(
+        source_id=src.id,
+        kind=kind,
+        url=url,
+        ext=ext,
+        file_path=file_path,
+        file_size=file_size,
+        content_sha256=content_sha256,
+        mapping_json=mapping_json,
+        sheets_json=json.dumps(sheets) if sheets else None,
+        description=description,
+        created_source=created,
+        created_by_id=user_id,
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(src)
+    db.refresh(job)
+    return src, job
+
+
+def ingest_rows_per_second(job: IngestionJob, rows: Optional[int] = None) -> Optional[float]:
+    return job_rows_per_second(job, job.rows_processed if rows is None else rows)
+
+
+class IngestionJobRunner(DbJobRunner):
+    """Pool de workers (threads) que executa os jobs de ingestão pendentes."""
+
+    model = IngestionJob
+    label = "ingest"
+
+    def __init__(self, session_factory=SessionLocal, workers: int = INGEST_JOBS_WORKERS):
+        super().__init__(
+            session_factory,
+            workers,
+            stale_seconds=INGEST_JOBS_STALE_SECONDS,
+            heartbeat_seconds=INGEST_JOBS_HEARTBEAT_SECONDS,
+            sweep_seconds=60,
+        )
+        self._live_rows: Dict[int, int] = {}
+
+    def start(self) -> None:
+        ensure_dir(UPLOAD_DIR)
+        super().start()
+
+    def live_rows(self, job_id: int) -> Optional[int]:
+        """Linhas já processadas de um job a correr neste processo."""
+        return self._live_rows.get(job_id)
+
+    def _claim_values(self) -> dict:
+        return {IngestionJob.rows_processed: 0}
+
+    def _fail(self, job: IngestionJob, exc: Exception) -> None:
+        super()._fail(job, exc)
+        job.stage = "FAILED"
+
+    def _finished(self, job_id: int) -> None:
+        self._live_rows.pop(job_id, None)
+
+    def _set_stage(self, db: Session, job: IngestionJob, stage: str) -> None:
+        job.stage = stage
+        job.heartbeat_at = datetime.utcnow()
+        db.commit()
+
+    def _process(self, db: Session, job: IngestionJob) -> None:
+        src = db.query(InfoSource).filter(InfoSource.id == job.source_id).first()
+        if src is None:
+            raise RuntimeError("A fonte foi removida antes da ingestão.")
+
+        if job.kind == "URL" and not job.file_path:
+            self._set_stage(db, job, "DOWNLOADING")
+            # GET condicional só contra a versão actual da mesma URL
+            conditional = not job.created_source and src.url == job.url
+            download = downloader.download(
+                job.url,
+                job.ext,
+                UPLOAD_DIR,
+                etag=src.http_etag if conditional else None,
+                last_modified=src.http_last_modified if conditional else None,
+            )
+            if download.not_modified:
+                self._finish(db, job, "UNCHANGED", IngestStats(0, 0, src.num_records or 0))
+                return
+            job.file_path, job.file_size, job.content_sha256 = (
+                download.path,
+                download.size,
+                download.sha256,
+            )
+            job.http_etag, job.http_last_modified = download.etag, download.last_modified
+            db.commit()
+
+        same, identical = find_source_version(
+            db,
+            src.name,
+            src.source_type,
+            job.content_sha256,
+            job.mapping_json,
+            json.loads(job.sheets_json) if job.sheets_json else None,
+        )
+        if identical and same.id != src.id:
+            # conteúdo já existe noutra fonte do mesmo tipo: nada a ingerir
+            remove_file(job.file_path)
+            if job.created_source:
+                db.delete(src)
+            job.source_id = same.id
+            self._finish(db, job, "UNCHANGED", IngestStats(0, 0, same.num_records or 0))
+            return
+        if identical and not job.created_source:
+            # versão já aplicada (ex.: job retomado depois do commit do diff)
+            if job.file_path != src.file_path:
+                remove_file(job.file_path)
+            if job.kind == "URL" and src.url == job.url:
+                src.http_etag, src.http_last_modified = job.http_etag, job.http_last_modified
+            self._finish(db, job, "UNCHANGED", IngestStats(0, 0, src.num_records or 0))
+            return
+
+        def progress(rows: int) -> None:
+            self._live_rows[job.id] = rows
+
+        if job.ext in TABULAR_EXTENSIONS:
+            def ingest() -> IngestStats:
+                return index_tabular_file(
+                    db,
+                    src,
+                    job.file_path,
+                    job.mapping_json,
+                    job.ext,
+                    progress=progress,
+                    sheets=json.loads(job.sheets_json) if job.sheets_json else None,
+                )
+        else:
+            self._set_stage(db, job, "EXTRACTING")
+            if job.ext == ".pdf":
+                extracted, skipped = extract_entities_from_pdf_file(job.file_path)
+                if skipped:
+                    job.warnings = "Páginas não extraídas: " + "; ".join(skipped)
+                    if not job.created_source:
+                        # o diff removeria as entidades das páginas em falta
+                        raise RuntimeError(
+                            f"{job.warnings}. Nova versão não aplicada: "
+                            "a fonte actual mantém-se."
+                        )
+            else:
+                with open(job.file_path, "r", encoding="utf-8") as f:
+                    extracted = extract_entities_from_html_content(
+                        f.read(), default_country="Angola"
+                    )
+
+            def ingest() -> IngestStats:
+                return create_entities_from_extracted(db, src, extracted, progress=progress)
+
+        self._set_stage(db, job, "INDEXING")
+        previous_file = None if job.created_source else src.file_path
+        # gravado no mesmo commit do diff
+        src.file_path = job.file_path
+        src.file_size = job.file_size
+        src.content_sha256 = job.content_sha256
+        src.url = job.url if job.kind == "URL" else None
+        src.http_etag = job.http_etag
+        src.http_last_modified = job.http_last_modified
+        src.description = job.description or src.description
+        src.uploaded_by_id = job.created_by_id
+
+        last_entity_id = db.query(func.max(NormalizedEntity.id)).scalar() or 0
+        stats = ingest()
+        if previous_file and previous_file != src.file_path:
+            remove_source_file(db, previous_file, src.id)
+
+        job.rows_processed = self._live_rows.get(job.id, 0)
+        self._finish(db, job, "CREATED" if job.created_source else "UPDATED", stats)
+
+        if stats.added or stats.removed:
+            screening.mark_changed(db, src.id)
+        if stats.added:
+            # só as entidades novas desta versão
+            schedule_rescreen(src.id, src.source_type, after_entity_id=last_entity_id)
+
+    def _finish(self, db: Session, job: IngestionJob, ingest_status: str, stats: IngestStats) -> None:
+        job.status = "DONE"
+        job.stage = "DONE"
+        job.ingest_status = ingest_status
+        job.rows_added = stats.added
+        job.rows_removed = stats.removed
+        job.rows_unchanged = stats.unchanged
+        job.finished_at = datetime.utcnow()
+        db.commit()
+
+
+ingestion_runner = IngestionJobRunner()
@@ -1,9 +1,7 @@
 # main.py
 import os
-import csv
 import json
-import difflib
-import time
+import shutil
 from typing import List, Optional, Tuple
 
 from fastapi import (
@@ -20,12 +18,25 @@ from fastapi import (
     Response,
 )
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-
-from database import Base, engine
-from models import User, InfoSource, NormalizedEntity, RiskRecord, AuditLog
+from sqlalchemy import or_
+
+from audit import audit_writer, log_event
+from database import Base, SessionLocal, engine, add_missing_columns
+from db_writer import db_writer
+from downloads import downloader, url_extension
+from models import (
+    User,
+    InfoSource,
+    NormalizedEntity,
+    EntityIdentifier,
+    RiskRecord,
+    AuditLog,
+    ScreeningJob,
+    IngestionJob,
+    RiskAlert,
+)
 from schemas import (
     LoginRequest,
     LoginResponse,
@@ -37,8 +48,12 @@ from schemas import (
     RiskFactor,
     RiskHistoryItem,
     InfoSourceRead,
+    InfoSourceIngestRead,
     AuditLogRead,
     RiskDecisionUpdate,
+    ScreeningJobRead,
+    IngestionJobRead,
+    RiskAlertRead,
 )
 from security import (
     get_db,
@@ -47,13 +62,58 @@ from security import (
     create_access_token,
     get_current_user,
     get_current_admin,
+    principal_cache,
+    bump_auth_version,
+    Principal,
 )
 from reporting import build_risk_report_pdf
+from screening import screening
+from normalization import name_key_columns
+from payloads import migrate_raw_payloads
+from entity_fts import entity_fts
+from executors import (
+    io_executor,
+    report_executor,
+    run,
+    stall_detector,
+)
+from matching import screen_request, screening_request_key
+from risk_cache import risk_cache
+from tabular import guess_mapping, read_tabular_headers
+from ingestion import (
+    IngestStats,
+    ROW_HASH_FIELDS,
+    row_hash,
+    add_entity_identifiers,
+    delete_source_entities,
+)
+from ingestion_jobs import (
+    UPLOAD_DIR,
+    enqueue_ingestion,
+    find_source_version,
+    ingest_rows_per_second,
+    ingestion_runner,
+    remove_file,
+    remove_source_file,
+)
+from source_refresh import (
+    check_refresh_interval,
+    refresh_scheduler,
+    set_refresh_interval,
+)
+from risk_jobs import JOBS_DIR, job_runner, follow_results, rows_per_second
+from uploads import save_upload, save_upload_sync
 from utils import ensure_dir
 
 
 # Criar tabelas
 Base.metadata.create_all(bind=engine)
+add_missing_columns(User.__table__)
+add_missing_columns(InfoSource.__table__)
+add_missing_columns(NormalizedEntity.__table__)
+add_missing_columns(IngestionJob.__table__)
+migrate_raw_payloads(engine)
+entity_fts.create(engine)
 
 app = FastAPI(title="Check Insurance Risk Backend", version="3.0.0")
 
@@ -70,27 +130,6 @@ app.add_middleware(
 )
 
 
-# ---------------------- Utilidades ----------------------
-
-
-def log_event(
-    db: Session,
-    action: str,
-    user: Optional[User] = None,
-    details: Optional[str] = None,
-    ip_address: Optional[str] = None,
-) -> None:
-    log = AuditLog(
-        user_id=user.id if user else None,
-        username=user.username if user else None,
-        action=action,
-        details=details,
-        ip_address=ip_address,
-    )
-    db.add(log)
-    db.commit()
-
-
 @app.on_event("startup")
 def create_initial_admin():
     """
@@ -114,6 +153,132 @@ def create_initial_admin():
         db.close()
 
 
+@app.on_event("startup")
+def backfill_entity_keys():
+    """
+    Calcula name_key / name_phonetic, row_hash e os identificadores canónicos
+    para entidades indexadas antes de estas colunas/tabelas existirem.
+    """
+    db = Session(bind=engine)
+    try:
+        pending = (
+            db.query(NormalizedEntity)
+            .filter(
+                NormalizedEntity.name_key.is_(None),
+                NormalizedEntity.person_name.isnot(None),
+            )
+            .yield_per(1000)
+        )
+        for entity in pending:
+            for column, value in name_key_columns(entity.person_name).items():
+                setattr(entity, column, value)
+        db.commit()
+
+        for entity in (
+            db.query(NormalizedEntity)
+            .filter(NormalizedEntity.row_hash.is_(None))
+            .yield_per(1000)
+        ):
+            entity.row_hash = row_hash({f: getattr(entity, f) for f in ROW_HASH_FIELDS})
+        db.commit()
+
+        without_identifiers = (
+            db.query(NormalizedEntity)
+            .filter(
+                or_(
+                    NormalizedEntity.person_nif.isnot(None),
+                    NormalizedEntity.person_passport.isnot(None),
+                    NormalizedEntity.residence_card.isnot(None),
+                ),
+                ~db.query(EntityIdentifier.id)
+                .filter(EntityIdentifier.entity_id == NormalizedEntity.id)
+                .exists(),
+            )
+            .all()
+        )
+        add_entity_identifiers(db, without_identifiers)
+        db.commit()
+    finally:
+        db.close()
+
+
+@app.on_event("startup")
+async def start_stall_detector():
+    """Arranca (no event loop) o detector de bloqueios do loop."""
+    stall_detector.start()
+
+
+@app.on_event("shutdown")
+async def stop_stall_detector():
+    stall_detector.stop()
+
+
+@app.on_event("startup")
+def start_principal_cache():
+    """Arranca a thread que descarta tokens em cache de utilizadores alterados."""
+    principal_cache.start()
+
+
+@app.on_event("shutdown")
+def stop_principal_cache():
+    principal_cache.stop()
+
+
+@app.on_event("startup")
+def start_screening_snapshot():
+    """
+    Constrói o snapshot de screening em memória e arranca a thread que o
+    mantém actualizado.
+    """
+    screening.start()
+
+
+@app.on_event("shutdown")
+def stop_screening_snapshot():
+    screening.stop()
+
+
+@app.on_event("startup")
+def start_ingestion_jobs():
+    """Arranca o pool de ingestão de fontes (retoma jobs pendentes)."""
+    ingestion_runner.start()
+
+
+@app.on_event("shutdown")
+def stop_ingestion_jobs():
+    ingestion_runner.stop()
+    downloader.stop()
+
+
+@app.on_event("startup")
+def start_source_refresh():
+    """Arranca o agendador de refresh das fontes criadas por URL."""
+    refresh_scheduler.start()
+
+
+@app.on_event("shutdown")
+def stop_source_refresh():
+    refresh_scheduler.stop()
+
+
+@app.on_event("shutdown")
+def stop_db_writer():
+    # a fila de auditoria grava pelo escritor: despeja-se antes de o parar
+    audit_writer.stop()
+    db_writer.stop()
+
+
+@app.on_event("startup")
+def start_risk_jobs():
+    """Arranca o pool de screening em massa (retoma jobs interrompidos)."""
+    job_runner.start()
+
+
+@app.on_event("shutdown")
+def stop_risk_jobs():
+    job_runner.stop()
+
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
@@ -141,8 +306,11 @@ def login(
 
 
 @app.get("/auth/me", response_model=UserRead)
-def me(current_user: User = Depends(get_current_user)):
-    return current_user
+def me(
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    return db.query(User).filter(User.id == current_user.id).first()
 
 
 # ---------------------- Gestão de utilizadores (Admin) ----------------------
@@ -152,7 +320,7 @@ def me(current_user: User = Depends(get_current_user)):
 def create_user(
     payload: UserCreate,
     db: Session = Depends(get_db),
-    admin: User = Depends(get_current_admin),
+    admin: Principal = Depends(get_current_admin),
     request: Request = None,
 ):
     existing = db.query(User).filter(User.username == payload.username).first()
@@ -183,7 +351,7 @@ def create_user(
 @app.get("/admin/users", response_model=List[UserRead])
 def list_users(
     db: Session = Depends(get_db),
-    admin: User = Depends(get_current_admin),
+    admin: Principal = Depends(get_current_admin),
 ):
     return db.query(User).order_by(User.created_at.desc()).all()
 
@@ -193,7 +361,7 @@ def update_user_status(
     user_id: int,
     is_active: bool = Query(...),
     db: Session = Depends(get_db),
-    admin: User = Depends(get_current_admin),
+    admin: Principal = Depends(get_current_admin),
     request: Request = None,
 ):
     user = db.query(User).filter(User.id == user_id).first()
@@ -201,8 +369,12 @@ def update_user_status(
         raise HTTPException(status_code=404, detail="Utilizador não encontrado")
 
     user.is_active = is_active
+    bump_auth_version(user)
     db.commit()
     db.refresh(user)
+    # tokens em cache deste utilizador voltam a ser verificados na BD
+    # (nos outros processos, pela nova auth_version)
+    principal_cache.invalidate_user(user.id)
     ip = request.client.host if request and request.client else None
     log_event(
         db,
@@ -219,7 +391,7 @@ def reset_user_password(
     user_id: int,
     new_password: str = Form(...),
     db: Session = Depends(get_db),
-    admin: User = Depends(get_current_admin),
+    admin: Principal = Depends(get_current_admin),
     request: Request = None,
 ):
     user = db.query(User).filter(User.id == user_id).first()
@@ -227,8 +399,10 @@ def reset_user_password(
         raise HTTPException(status_code=404, detail="Utilizador não encontrado")
 
     user.password_hash = hash_password(new_password)
+    bump_auth_version(user)
     db.commit()
     db.refresh(user)
+    principal_cache.invalidate_user(user.id)
     ip = request.client.host if request and request.client else None
     log_event(
         db,
@@ -242,446 +416,87 @@ def reset_user_password(
 
 # ---------------------- Upload e gestão de fontes ----------------------
 
-UPLOAD_DIR = "data/uploads"
 ensure_dir(UPLOAD_DIR)
 
 
-def guess_mapping(headers: List[str]) -> dict:
-    """
-    Faz uma tentativa simples de mapear colunas por nome.
-    Podes sempre enviar mapping_json explícito no upload.
-    """
-    lower_headers = {h.lower(): h for h in headers}
-    mapping = {}
-
-    # Nome
-    for key in ["nome", "name", "full_name", "nome_completo", "titular"]:
-        if key in lower_headers:
-            mapping["name"] = lower_headers[key]
-            break
-
-    # NIF
-    for key in ["nif", "nif_cliente", "tax_id", "nº contribuinte", "num_contribuinte"]:
-        if key in lower_headers:
-            mapping["nif"] = lower_headers[key]
-            break
-
-    # Passaporte
-    for key in ["passaporte", "passport"]:
-        if key in lower_headers:
-            mapping["passport"] = lower_headers[key]
-            break
-
-    # Cartão de residente
-    for key in ["cartao_residente", "residence_card", "cartao_residencia"]:
-        if key in lower_headers:
-            mapping["residence_card"] = lower_headers[key]
-            break
-
-    # Cargo / função
-    for key in ["cargo", "funcao", "função", "role", "position"]:
-        if key in lower_headers:
-            mapping["role"] = lower_headers[key]
-            break
-
-    # País
-    for key in ["pais", "país", "country"]:
-        if key in lower_headers:
-            mapping["country"] = lower_headers[key]
-            break
-
-    return mapping
-
-
-def index_tabular_file(
-    db: Session,
+def ingest_read(
     src: InfoSource,
-    file_path: str,
-    mapping_json: Optional[str],
-    ext: str,
-) -> int:
-    """
-    Lê um ficheiro tabular (CSV ou Excel), aplica o mapping e cria NormalizedEntity.
-    Devolve o número de registos inseridos.
-    """
-    ext = ext.lower()
-    rows: List[dict] = []
-    headers: List[str] = []
-
-    # CSV
-    if ext == ".csv":
-        with open(file_path, "r", encoding="utf-8-sig") as f:
-            reader = csv.DictReader(f)
-            headers = reader.fieldnames or []
-            if not headers:
-                raise HTTPException(status_code=400, detail="CSV sem cabeçalho.")
-            for row in reader:
-                rows.append(row)
-
-    # Excel
-    elif ext in [".xls", ".xlsx"]:
-        try:
-            import openpyxl  # garantir que está no requirements.txt
-        except ImportError:
-            raise HTTPException(
-                status_code=500,
-                detail="Suporte a Excel não está configurado (falta 'openpyxl' no servidor).",
-            )
-
-        wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
-        ws = wb.active
-        first = True
-        for row in ws.iter_rows(values_only=True):
-            if first:
-                headers = [
-                    str(c).strip() if c is not None else "" for c in row
-                ]
-                first = False
-                continue
-            values = [str(c).strip() if c is not None else "" for c in row]
-            if not any(values):
-                continue
-            rows.append(dict(zip(headers, values)))
-        if not headers:
-            raise HTTPException(status_code=400, detail="Excel sem cabeçalho.")
-
-    else:
-        raise HTTPException(status_code=400, detail="Formato tabular não suportado.")
-
-    if mapping_json:
-        mapping = json.loads(mapping_json)
-    else:
-        mapping = guess_mapping(headers)
-
-    if "name" not in mapping:
-        raise HTTPException(
-            status_code=400,
-            detail="Não foi possível identificar a coluna do nome. Envia mapping_json explícito.",
-        )
-
-    num_records = 0
-    for row in rows:
-        person_name = row.get(mapping.get("name", ""), "") or None
-        person_nif = (
-            row.get(mapping.get("nif", ""), "") or None if mapping.get("nif") else None
-        )
-        person_passport = (
-            row.get(mapping.get("passport", ""), "") or None
-            if mapping.get("passport")
-            else None
-        )
-        residence_card = (
-            row.get(mapping.get("residence_card", ""), "") or None
-            if mapping.get("residence_card")
-            else None
-        )
-        role = (
-            row.get(mapping.get("role", ""), "") or None
-            if mapping.get("role")
-            else None
-        )
-        country = (
-            row.get(mapping.get("country", ""), "") or None
-            if mapping.get("country")
-            else None
-        )
-
-        if not any([person_name, person_nif, person_passport, residence_card]):
-            continue
-
-        entity = NormalizedEntity(
-            source_id=src.id,
-            person_name=person_name,
-            person_nif=person_nif,
-            person_passport=person_passport,
-            residence_card=residence_card,
-            role=role,
-            country=country,
-            raw_payload=row,
-        )
-        db.add(entity)
-        num_records += 1
-
-    src.num_records = num_records
-    db.commit()
-    db.refresh(src)
-    return src.num_records
-
-
-# ---------------------- Extractores HTML / PDF ----------------------
-
-
-def extract_entities_from_html_content(
-    html: str,
-    default_country: str = "Angola",
-) -> List[dict]:
-    """
-    Extrai entidades de uma página HTML (heurística simples).
-    Devolve lista de dicts com chaves: person_name, role, country.
-    """
-    try:
-        from bs4 import BeautifulSoup
-    except ImportError:
-        # Se BeautifulSoup não estiver instalado, não quebrar o backend
-        return []
-
-    soup = BeautifulSoup(html, "html.parser")
-    entities: List[dict] = []
-
-    # A) Tabelas com cabeçalhos
-    for table in soup.find_all("table"):
-        rows = table.find_all("tr")
-        if len(rows) < 2:
-            continue
-
-        header_cells = rows[0].find_all(["th", "td"])
-        headers = [(th.get_text(strip=True) or "").lower() for th in header_cells]
-        if not headers:
-            continue
-
-        for tr in rows[1:]:
-            cols = [td.get_text(strip=True) for td in tr.find_all("td")]
-            if not cols or len(cols) != len(headers):
-                continue
-            row = dict(zip(headers, cols))
-
-            name = (
-                row.get("nome")
-                or row.get("name")
-                or row.get("titular")
-                or row.get("ministro")
-            )
-            if not name:
-                continue
-
-            role = (
-                row.get("cargo")
-                or row.get("funcao")
-                or row.get("função")
-                or row.get("role")
-                or row.get("posição")
-                or row.get("position")
-                or ""
-            )
-            country = (
-                row.get("pais")
-                or row.get("país")
-                or row.get("country")
-                or default_country
-            )
-
-            entities.append(
-                {
-                    "person_name": name.strip(),
-                    "role": role.strip(),
-                    "country": country.strip(),
-                }
-            )
-
-    # B) Listas simples (ul/li) – ex: "Nome – Ministro de X"
-    for li in soup.find_all("li"):
-        text = li.get_text(" ", strip=True)
-        lower = text.lower()
-        if len(text.split()) < 2:
-            continue
-
-        if "ministro" in lower or "secretário" in lower or "governador" in lower:
-            # tentar separar em "Nome – Cargo"
-            if "–" in text:
-                parts = [p.strip() for p in text.split("–", 1)]
-            elif "-" in text:
-                parts = [p.strip() for p in text.split("-", 1)]
-            else:
-                parts = [text]
-
-            name = parts[0]
-            cargo = parts[1] if len(parts) > 1 else ""
-
-            entities.append(
-                {
-                    "person_name": name,
-                    "role": cargo,
-                    "country": default_country,
-                }
-            )
-
-    # C) Blocos repetidos – heurística simples (divs grandes com "Ministro")
-    for div in soup.find_all("div"):
-        txt = div.get_text(" ", strip=True)
-        lower = txt.lower()
-        if "ministro" in lower or "secretário" in lower or "governador" in lower:
-            parts = txt.split()
-            if len(parts) >= 2:
-                name = " ".join(parts[0:3])
-                entities.append(
-                    {
-                        "person_name": name,
-                        "role": txt,
-                        "country": default_country,
-                    }
-                )
-
-    # remover duplicados simples por (person_name, role, country)
-    unique = {}
-    for e in entities:
-        key = (
-            (e.get("person_name") or "").upper(),
-            (e.get("role") or "").upper(),
-            (e.get("country") or "").upper(),
-        )
-        if key not in unique:
-            unique[key] = e
-
-    return list(unique.values())
-
-
-def extract_entities_from_pdf_file(
-    file_path: str,
-    default_country: str = "Angola",
-) -> List[dict]:
-    """
-    Extrai entidades de um PDF de forma heurística.
-    Tenta tabelas primeiro; se não houver, tenta texto corrido.
-    """
-    try:
-        import pdfplumber
-    except ImportError:
-        # Se pdfplumber não estiver instalado, não quebrar o backend
-        return []
-
-    entities: List[dict] = []
-
-    try:
-        with pdfplumber.open(file_path) as pdf:
-            for page in pdf.pages:
-                # 1) tentar tabelas
-                table = page.extract_table()
-                if table and len(table) > 1:
-                    headers = [(h or "").strip().lower() for h in table[0]]
-                    for row in table[1:]:
-                        if not any(row):
-                            continue
-                        record = {}
-                        for i in range(min(len(headers), len(row))):
-                            record[headers[i]] = (row[i] or "").strip()
-
-                        name = (
-                            record.get("nome")
-                            or record.get("name")
-                            or record.get("titular")
-                        )
-                        if not name:
-                            continue
-
-                        role = (
-                            record.get("cargo")
-                            or record.get("funcao")
-                            or record.get("função")
-                            or ""
-                        )
-                        country = (
-                            record.get("pais")
-                            or record.get("país")
-                            or record.get("country")
-                            or default_country
-                        )
-
-                        entities.append(
-                            {
-                                "person_name": name,
-                                "role": role,
-                                "country": country,
-                            }
-                        )
-
-                # 2) fallback: texto corrido – muito conservador
-                text = page.extract_text() or ""
-                lines = [ln.strip() for ln in text.split("\n") if ln.strip()]
-                for ln in lines:
-                    # Exemplo simples: linha com pelo menos 2 palavras e "Ministro"/"Secretário"
-                    lower = ln.lower()
-                    if (
-                        ("ministro" in lower or "secretário" in lower)
-                        and len(ln.split()) >= 2
-                    ):
-                        entities.append(
-                            {
-                                "person_name": ln.split(" ", 1)[0],
-                                "role": ln,
-                                "country": default_country,
-                            }
-                        )
-
-    except Exception:
-        # se algo correr mal na leitura do PDF, devolve o que tiver
-        pass
-
-    # remover duplicados simples
-    unique = {}
-    for e in entities:
-        key = (
-            (e.get("person_name") or "").upper(),
-            (e.get("role") or "").upper(),
-            (e.get("country") or "").upper(),
-        )
-        if key not in unique:
-            unique[key] = e
-
-    return list(unique.values())
-
+    status: str,
+    stats: Optional[IngestStats] = None,
+    job_id: Optional[int] = None,
+) -> InfoSourceIngestRead:
+    stats = stats or IngestStats(0, 0, 0)
+    return InfoSourceIngestRead(
+        id=src.id,
+        name=src.name,
+        source_type=src.source_type,
+        description=src.description or "",
+        num_records=src.num_records or 0,
+        file_size=src.file_size,
+        content_sha256=src.content_sha256,
+        url=src.url,
+        refresh_interval_minutes=src.refresh_interval_minutes,
+        next_refresh_at=src.next_refresh_at,
+        created_at=src.created_at,
+        ingest_status=status,
+        job_id=job_id,
+        rows_added=stats.added,
+        rows_removed=stats.removed,
+        rows_unchanged=stats.unchanged,
+    )
 
-def create_entities_from_extracted(
-    db: Session,
-    src: InfoSource,
-    extracted: List[dict],
-) -> int:
-    """
-    Recebe lista de dicts com chaves (person_name, role, country, opcionalmente nif/passport)
-    e cria NormalizedEntity.
-    """
-    num_records = 0
-    for e in extracted:
-        name = (e.get("person_name") or "").strip()
-        if not name:
-            continue
-
-        entity = NormalizedEntity(
-            source_id=src.id,
-            person_name=name,
-            person_nif=(e.get("person_nif") or None),
-            person_passport=(e.get("person_passport") or None),
-            residence_card=(e.get("residence_card") or None),
-            role=(e.get("role") or None),
-            country=(e.get("country") or None),
-            raw_payload=e,
-        )
-        db.add(entity)
-        num_records += 1
 
-    src.num_records = (src.num_records or 0) + num_records
-    db.commit()
-    db.refresh(src)
-    return num_records
+def ingestion_job_read(job: IngestionJob) -> IngestionJobRead:
+    # progresso ao vivo, se o job estiver a correr neste processo
+    live = ingestion_runner.live_rows(job.id) if job.status == "RUNNING" else None
+    rows = live if live is not None else job.rows_processed or 0
+    return IngestionJobRead(
+        id=job.id,
+        source_id=job.source_id,
+        kind=job.kind,
+        status=job.status,
+        stage=job.stage,
+        ingest_status=job.ingest_status,
+        rows_processed=rows,
+        rows_added=job.rows_added or 0,
+        rows_removed=job.rows_removed or 0,
+        rows_unchanged=job.rows_unchanged or 0,
+        rows_per_second=ingest_rows_per_second(job, rows),
+        error=job.error,
+        warnings=job.warnings,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at,
+    )
 
 
 # ---------------------- Endpoints de fontes ----------------------
 
 
-@app.post("/infosources/upload", response_model=InfoSourceRead)
+@app.post("/infosources/upload", response_model=InfoSourceIngestRead, status_code=202)
 async def upload_infosource(
+    response: Response,
     name: str = Form(...),
     source_type: str = Form(...),  # PEP, SANCTIONS, FRAUD, CLAIMS, OTHER
     description: str = Form(""),
     file: UploadFile = File(...),
     mapping_json: Optional[str] = Form(None),
+    sheets: Optional[str] = Form(None),  # Excel: folhas separadas por vírgula
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     request: Request = None,
 ):
     """
     Upload de fontes:
       - CSV / Excel (.xls, .xlsx) → guardado + indexado para matching
+        (Excel: todas as folhas, ou só as indicadas em `sheets`)
       - PDF → guardado + extraído (heurística) para matching
+    O ficheiro é gravado e a ingestão fica em fila (202 + job_id; estado em
+    /infosources/jobs/{job_id}). Um ficheiro idêntico a uma fonte existente
+    (e com o mesmo mapeamento e folhas da versão aplicada) não é ingerido
+    (200, UNCHANGED); com o mesmo nome e tipo de uma fonte
+    existente, é uma nova versão dessa fonte e só as linhas alteradas são
+    inseridas / removidas.
     """
     ext = os.path.splitext(file.filename)[1].lower()
     if ext not in [".csv", ".xls", ".xlsx", ".pdf"]:
@@ -690,59 +505,70 @@ async def upload_infosource(
             detail="Formato não suportado. Use ficheiros CSV, Excel ou PDF.",
         )
 
-    ensure_dir(UPLOAD_DIR)
-    file_path = os.path.join(UPLOAD_DIR, file.filename)
-
-    # Guardar ficheiro
-    with open(file_path, "wb") as f:
-        f.write(await file.read())
-
-    # Criar registo da fonte
-    src = InfoSource(
-        name=name,
-        source_type=source_type.upper(),
-        description=description,
-        file_path=file_path,
-        uploaded_by_id=current_user.id,
-    )
-    db.add(src)
-    db.commit()
-    db.refresh(src)
+    # Guardar ficheiro (em blocos, com hash e limite de tamanho)
+    stored = await save_upload(file, UPLOAD_DIR)
+    source_type = source_type.upper()
+    ip = request.client.host if request and request.client else None
 
-    # Indexar se for tabular (CSV / Excel)
-    if ext in [".csv", ".xls", ".xlsx"]:
-        index_tabular_file(db, src, file_path, mapping_json, ext)
-    else:
-        # PDF: tentar extrair entidades
-        extracted = extract_entities_from_pdf_file(file_path)
-        if extracted:
-            create_entities_from_extracted(db, src, extracted)
-        else:
-            src.num_records = src.num_records or 0
-            db.commit()
-            db.refresh(src)
+    sheet_list = [sh.strip() for sh in sheets.split(",") if sh.strip()] if sheets else None
 
-    ip = request.client.host if request and request.client else None
-    log_event(
-        db,
-        "upload_infosource",
-        user=current_user,
-        details=f"Fonte {src.name} ({src.source_type}) com {src.num_records} registos",
-        ip_address=ip,
-    )
+    def register() -> Tuple[int, InfoSourceIngestRead]:
+        same, identical = find_source_version(
+            db, name, source_type, stored.sha256, mapping_json, sheet_list
+        )
+        if identical:
+            if stored.path != same.file_path:
+                remove_file(stored.path)
+            log_event(
+                db,
+                "upload_infosource",
+                user=current_user,
+                details=f"Fonte {same.name} ({same.source_type}) sem alterações (ficheiro idêntico)",
+                ip_address=ip,
+            )
+            return 200, ingest_read(same, "UNCHANGED", IngestStats(0, 0, same.num_records or 0))
+
+        src, job = enqueue_ingestion(
+            db,
+            name=name,
+            source_type=source_type,
+            description=description,
+            user_id=current_user.id,
+            kind="FILE",
+            ext=ext,
+            mapping_json=mapping_json,
+            sheets=sheet_list,
+            file_path=stored.path,
+            file_size=stored.size,
+            content_sha256=stored.sha256,
+        )
+        ingestion_runner.submit(job.id)
+
+        log_event(
+            db,
+            "upload_infosource",
+            user=current_user,
+            details=f"Fonte {src.name} ({src.source_type}) em fila para ingestão (job {job.id})",
+            ip_address=ip,
+        )
+        return 202, ingest_read(src, "PENDING", job_id=job.id)
 
-    return src
+    # consultas e commits no io_executor: nada bloqueia o event loop
+    response.status_code, result = await run(io_executor, register)
+    return result
 
 
-@app.post("/infosources/from-url", response_model=InfoSourceRead)
+@app.post("/infosources/from-url", response_model=InfoSourceIngestRead, status_code=202)
 def create_infosource_from_url(
     name: str = Body(...),
     source_type: str = Body(...),  # PEP, SANCTIONS, FRAUD, CLAIMS, OTHER
     url: str = Body(...),
     description: str = Body(""),
     mapping_json: Optional[dict] = Body(None),
+    sheets: Optional[List[str]] = Body(None),
+    refresh_interval_minutes: Optional[int] = Body(None),
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     request: Request = None,
 ):
     """
@@ -751,108 +577,65 @@ def create_infosource_from_url(
       - URL termina em .csv / .xls / .xlsx → download + indexar tabular
       - URL termina em .pdf → download + extrair PDF
       - URL sem extensão conhecida → assume HTML e extrai entidades da página
+    O download e a ingestão correm em background (202 + job_id).
+    Conteúdo idêntico / novas versões: como em /infosources/upload.
+    Com `refresh_interval_minutes`, a URL volta a ser lida periodicamente
+    (ver source_refresh.py).
     """
-    try:
-        import requests
-    except ImportError:
-        raise HTTPException(
-            status_code=500,
-            detail="Dependência 'requests' não está instalada no servidor.",
-        )
-
-    try:
-        resp = requests.get(url, timeout=30)
-    except Exception:
-        raise HTTPException(
-            status_code=400, detail="Não foi possível obter o conteúdo da URL."
-        )
+    check_refresh_interval(refresh_interval_minutes)
+    ext = url_extension(url)
 
-    if resp.status_code != 200:
-        raise HTTPException(
-            status_code=400, detail="Não foi possível obter o conteúdo da URL."
-        )
-
-    # Remover querystring para detecção de extensão
-    clean_url = url.split("?", 1)[0]
-    ext = os.path.splitext(clean_url)[1].lower()
-
-    ensure_dir(UPLOAD_DIR)
-    # Definir um nome base para o ficheiro local
-    timestamp = int(time.time())
-
-    # Criar registo da fonte primeiro
-    src = InfoSource(
+    src, job = enqueue_ingestion(
+        db,
         name=name,
         source_type=source_type.upper(),
         description=description,
-        file_path=None,
-        uploaded_by_id=current_user.id,
+        user_id=current_user.id,
+        kind="URL",
+        ext=ext,
+        mapping_json=json.dumps(mapping_json) if mapping_json is not None else None,
+        sheets=sheets,
+        url=url,
     )
-    db.add(src)
-    db.commit()
-    db.refresh(src)
-
-    # Caso 1: CSV / Excel / PDF
-    if ext in [".csv", ".xls", ".xlsx", ".pdf"]:
-        filename = f"url_{timestamp}{ext}"
-        file_path = os.path.join(UPLOAD_DIR, filename)
-        with open(file_path, "wb") as f:
-            f.write(resp.content)
-
-        src.file_path = file_path
+    if refresh_interval_minutes is not None:
+        set_refresh_interval(src, refresh_interval_minutes)
         db.commit()
-        db.refresh(src)
-
-        if ext in [".csv", ".xls", ".xlsx"]:
-            mapping_str = json.dumps(mapping_json) if mapping_json is not None else None
-            index_tabular_file(db, src, file_path, mapping_str, ext)
-        elif ext == ".pdf":
-            extracted = extract_entities_from_pdf_file(file_path)
-            if extracted:
-                create_entities_from_extracted(db, src, extracted)
-            else:
-                src.num_records = src.num_records or 0
-                db.commit()
-                db.refresh(src)
-
-    else:
-        # Caso 2: HTML (sem extensão conhecida)
-        html = resp.text or ""
-        extracted = extract_entities_from_html_content(html, default_country="Angola")
-
-        # guardar um snapshot opcional do HTML
-        filename = f"url_{timestamp}.html"
-        file_path = os.path.join(UPLOAD_DIR, filename)
-        try:
-            with open(file_path, "w", encoding="utf-8") as f:
-                f.write(html)
-            src.file_path = file_path
-        except Exception:
-            src.file_path = None
-
-        if extracted:
-            create_entities_from_extracted(db, src, extracted)
-        else:
-            src.num_records = src.num_records or 0
-            db.commit()
-            db.refresh(src)
+    ingestion_runner.submit(job.id)
 
     ip = request.client.host if request and request.client else None
     log_event(
         db,
         "upload_infosource_url",
         user=current_user,
-        details=f"Fonte {src.name} ({src.source_type}) via URL com {src.num_records} registos",
+        details=f"Fonte {src.name} ({src.source_type}) via URL em fila para ingestão (job {job.id})",
         ip_address=ip,
     )
 
-    return src
+    return ingest_read(src, "PENDING", job_id=job.id)
+
+
+@app.get("/infosources/jobs/{job_id}", response_model=IngestionJobRead)
+def get_ingestion_job_status(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    """Etapa, linhas processadas, débito e erro de um job de ingestão."""
+    job = db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    if job.created_by_id != current_user.id and not current_user.is_admin:
+        raise HTTPException(
+            status_code=403,
+            detail="Apenas o utilizador que criou o job ou um admin o pode consultar.",
+        )
+    return ingestion_job_read(job)
 
 
 @app.get("/infosources", response_model=List[InfoSourceRead])
 def list_infosources(
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
 ):
     return db.query(InfoSource).order_by(InfoSource.created_at.desc()).all()
 
@@ -862,11 +645,13 @@ def update_infosource(
     source_id: int,
     payload: dict = Body(...),
     db: Session = Depends(get_db),
-    admin: User = Depends(get_current_admin),
+    admin: Principal = Depends(get_current_admin),
     request: Request = None,
 ):
     """
     Edita nome / tipo / descrição de uma fonte existente (apenas admin).
+    `refresh_interval_minutes` liga / altera (ou, com null, desliga) o
+    refresh automático de uma fonte criada por URL.
     """
     src = db.query(InfoSource).filter(InfoSource.id == source_id).first()
     if not src:
@@ -875,9 +660,12 @@ def update_infosource(
     for field in ["name", "source_type", "description"]:
         if field in payload and payload[field] is not None:
             setattr(src, field, payload[field])
+    if "refresh_interval_minutes" in payload:
+        set_refresh_interval(src, payload["refresh_interval_minutes"])
 
     db.commit()
     db.refresh(src)
+    screening.mark_changed(db)
 
     ip = request.client.host if request and request.client else None
     log_event(
@@ -895,7 +683,7 @@ def update_infosource(
 def delete_infosource(
     source_id: int,
     db: Session = Depends(get_db),
-    admin: User = Depends(get_current_admin),
+    admin: Principal = Depends(get_current_admin),
     request: Request = None,
 ):
     """
@@ -905,20 +693,20 @@ def delete_infosource(
     if not src:
         raise HTTPException(status_code=404, detail="Fonte não encontrada")
 
-    # Apagar entidades normalizadas associadas
-    db.query(NormalizedEntity).filter(
-        NormalizedEntity.source_id == src.id
-    ).delete()
+    # Apagar entidades normalizadas associadas (identificadores e payloads)
+    delete_source_entities(db, src.id)
 
-    # Tentar remover o ficheiro físico
-    if src.file_path:
-        try:
-            os.remove(src.file_path)
-        except FileNotFoundError:
-            pass
+    # Jobs de ingestão da fonte deixam de apontar para ela (os pendentes falham)
+    db.query(IngestionJob).filter(IngestionJob.source_id == src.id).update(
+        {IngestionJob.source_id: None}, synchronize_session=False
+    )
+
+    # Remover o ficheiro físico (se nenhuma outra fonte o usar)
+    remove_source_file(db, src.file_path, src.id)
 
     db.delete(src)
     db.commit()
+    screening.mark_changed(db)
 
     ip = request.client.host if request and request.client else None
     log_event(
@@ -932,228 +720,290 @@ def delete_infosource(
     return Response(status_code=204)
 
 
-# ---------------------- Lógica de matching e risco ----------------------
+# ---------------------- Registos de risco ----------------------
 
 
-def find_matches(
-    db: Session,
+def build_risk_record(
     req: RiskCheckRequest,
-) -> List[Match]:
-    """
-    Procura matches nas entidades normalizadas,
-    usando NIF, passaporte, cartão e nome aproximado.
-    """
-    matches: List[Match] = []
+    matches: List[Match],
+    risk: Tuple[int, str, bool, bool, List[RiskFactor]],
+    analyst_id: int,
+) -> RiskRecord:
+    score, level, is_pep, has_sanctions, factors = risk
+    return RiskRecord(
+        full_name=req.full_name,
+        nif=req.nif,
+        passport=req.passport,
+        residence_card=req.residence_card,
+        risk_score=score,
+        risk_level=level,
+        is_pep=is_pep,
+        has_sanctions=has_sanctions,
+        matches_json=json.dumps([m.dict() for m in matches], ensure_ascii=False),
+        factors_json=json.dumps([f.dict() for f in factors], ensure_ascii=False),
+        decision=None,
+        analyst_notes=req.extra_info or "",
+        analyst_id=analyst_id,
+        primary_match_json=None,
+    )
+
 
-    q = db.query(NormalizedEntity, InfoSource).join(
-        InfoSource, NormalizedEntity.source_id == InfoSource.id
+def build_risk_response(
+    record: RiskRecord,
+    matches: List[Match],
+    factors: List[RiskFactor],
+) -> RiskCheckResponse:
+    return RiskCheckResponse(
+        id=record.id,
+        full_name=record.full_name,
+        nif=record.nif,
+        passport=record.passport,
+        residence_card=record.residence_card,
+        risk_score=record.risk_score,
+        risk_level=record.risk_level,
+        is_pep=record.is_pep,
+        has_sanctions=record.has_sanctions,
+        matches=matches,
+        factors=factors,
+        decision=record.decision,
+        analyst_notes=record.analyst_notes,
+        created_at=record.created_at,
     )
 
-    if req.nif:
-        candidates = (
-            q.filter(func.lower(NormalizedEntity.person_nif) == req.nif.lower())
-            .limit(200)
-            .all()
-        )
-    elif req.passport:
-        candidates = (
-            q.filter(
-                func.lower(NormalizedEntity.person_passport) == req.passport.lower()
-            )
-            .limit(200)
-            .all()
-        )
-    elif req.residence_card:
-        candidates = (
-            q.filter(
-                func.lower(NormalizedEntity.residence_card)
-                == req.residence_card.lower()
-            )
-            .limit(200)
-            .all()
-        )
-    else:
-        name = req.full_name.strip().upper()
-        candidates = (
-            q.filter(func.upper(NormalizedEntity.person_name).like(f"%{name}%"))
-            .limit(200)
-            .all()
+
+def require_identifier(req: RiskCheckRequest, position: Optional[int] = None) -> None:
+    if not any([req.full_name, req.nif, req.passport, req.residence_card]):
+        where = f" (item {position})" if position is not None else ""
+        raise HTTPException(
+            status_code=400,
+            detail=f"Fornece pelo menos um identificador (nome, NIF, passaporte ou cartão){where}.",
         )
 
-    def sim(a: str, b: str) -> float:
-        return difflib.SequenceMatcher(
-            None, (a or "").upper(), (b or "").upper()
-        ).ratio()
 
-    for entity, src in candidates:
-        similarity = sim(req.full_name, entity.person_name or "")
-        if not any([req.nif, req.passport, req.residence_card]) and similarity < 0.6:
-            continue
+# ---------------------- Análise de risco ----------------------
 
-        identifier = (
-            entity.person_nif or entity.person_passport or entity.residence_card or None
-        )
 
-        matches.append(
-            Match(
-                source_id=src.id,
-                source_name=src.name,
-                source_type=src.source_type,
-                match_name=entity.person_name or "",
-                match_identifier=identifier,
-                similarity=similarity,
-                details={
-                    "role": entity.role,
-                    "country": entity.country,
-                },
-            )
+@app.post("/risk/check", response_model=RiskCheckResponse)
+def risk_check(
+    payload: RiskCheckRequest,
+    current_user: Principal = Depends(get_current_user),
+    request: Request = None,
+):
+    require_identifier(payload)
+
+    # o RiskRecord grava-se sempre (auditoria); o matching pode vir da cache.
+    # Só a verificação individual junta os candidatos por token (FTS5, na BD).
+    matches, risk = screen_request(payload, token_search=entity_fts.search)
+    ip = request.client.host if request and request.client else None
+
+    def save(db: Session) -> RiskRecord:
+        record = build_risk_record(payload, matches, risk, current_user.id)
+        db.add(record)
+        db.flush()
+        log_event(
+            db,
+            "risk_check",
+            user=current_user,
+            details=f"RiskRecord {record.id} para {record.full_name} (score={record.risk_score})",
+            ip_address=ip,
         )
+        return record
 
-    return matches
+    # RiskRecord no escritor único (ver db_writer.py); a auditoria vai em lote (audit.py)
+    record = db_writer.run(save)
+    return build_risk_response(record, matches, risk[4])
 
 
-def compute_risk_from_matches(
-    req: RiskCheckRequest,
-    matches: List[Match],
-) -> Tuple[int, str, bool, bool, List[RiskFactor]]:
-    factors: List[RiskFactor] = []
-    score = 0
-    is_pep = False
-    has_sanctions = False
-
-    for m in matches:
-        st = (m.source_type or "").upper()
-        if st == "PEP":
-            is_pep = True
-            factors.append(
-                RiskFactor(code="PEP", description="Presença em lista PEP", weight=70)
-            )
-            score += 70
-        elif st == "SANCTIONS":
-            has_sanctions = True
-            factors.append(
-                RiskFactor(
-                    code="SANCTIONS",
-                    description="Presença em lista de sanções",
-                    weight=100,
-                )
-            )
-            score += 100
-        elif st == "FRAUD":
-            factors.append(
-                RiskFactor(
-                    code="FRAUD",
-                    description="Registo em base interna de fraude",
-                    weight=60,
-                )
-            )
-            score += 60
-        elif st == "CLAIMS":
-            factors.append(
-                RiskFactor(
-                    code="CLAIMS",
-                    description="Histórico de sinistros relevante",
-                    weight=30,
-                )
-            )
-            score += 30
+RISK_BATCH_MAX_ITEMS = int(os.getenv("RISK_BATCH_MAX_ITEMS", "5000"))
 
-    if not req.nif:
-        factors.append(
-            RiskFactor(code="NO_NIF", description="NIF não fornecido", weight=10)
+
+@app.post("/risk/check/batch", response_model=List[RiskCheckResponse])
+def risk_check_batch(
+    payload: List[RiskCheckRequest] = Body(...),
+    current_user: Principal = Depends(get_current_user),
+    request: Request = None,
+):
+    """
+    Verificação em lote (campanhas de onboarding).
+    Todos os pedidos usam o mesmo snapshot; pedidos repetidos (mesma chave
+    normalizada) são calculados uma só vez. Os RiskRecord são gravados numa
+    só transacção, com um único registo de auditoria. A resposta segue a ordem
+    do pedido.
+    """
+    if not payload:
+        raise HTTPException(status_code=400, detail="Lote vazio.")
+    if len(payload) > RISK_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Lote demasiado grande (máximo {RISK_BATCH_MAX_ITEMS} itens).",
         )
-        score += 10
-
-    if score == 0 and req.nif:
-        factors.append(
-            RiskFactor(
-                code="CLEAN",
-                description="Sem ocorrências negativas nas fontes",
-                weight=0,
-            )
+    for position, item in enumerate(payload):
+        require_identifier(item, position)
+
+    snapshot = screening.current
+    results = {}
+    for item in payload:
+        key = screening_request_key(item)
+        if key not in results:
+            results[key] = screen_request(item, snapshot)
+
+    ip = request.client.host if request and request.client else None
+
+    def save(db: Session) -> List[RiskRecord]:
+        records: List[RiskRecord] = []
+        for item in payload:
+            matches, risk = results[screening_request_key(item)]
+            records.append(build_risk_record(item, matches, risk, current_user.id))
+        db.add_all(records)
+        db.flush()
+
+        levels = {}
+        for record in records:
+            levels[record.risk_level] = levels.get(record.risk_level, 0) + 1
+        summary = ", ".join(f"{lvl}={n}" for lvl, n in sorted(levels.items()))
+
+        log_event(
+            db,
+            "risk_check_batch",
+            user=current_user,
+            details=(
+                f"Lote de {len(records)} verificações "
+                f"(RiskRecord {records[0].id}-{records[-1].id}; {summary})"
+            ),
+            ip_address=ip,
         )
+        return records
 
-    score = max(0, min(score, 100))
+    # RiskRecords numa só transacção, no escritor único
+    records = db_writer.run(save)
 
-    if score <= 30:
-        level = "LOW"
-    elif score <= 60:
-        level = "MEDIUM"
-    elif score <= 85:
-        level = "HIGH"
-    else:
-        level = "CRITICAL"
+    responses: List[RiskCheckResponse] = []
+    for item, record in zip(payload, records):
+        matches, risk = results[screening_request_key(item)]
+        responses.append(build_risk_response(record, matches, risk[4]))
+    return responses
 
-    return score, level, is_pep, has_sanctions, factors
 
+# ---------------------- Screening em massa (jobs) ----------------------
 
-# ---------------------- Análise de risco ----------------------
 
+def screening_job_read(job: ScreeningJob) -> ScreeningJobRead:
+    return ScreeningJobRead(
+        id=job.id,
+        status=job.status,
+        total_rows=job.total_rows,
+        rows_done=job.rows_done or 0,
+        rows_matched=job.rows_matched or 0,
+        rows_per_second=rows_per_second(job),
+        error=job.error,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at,
+    )
 
-@app.post("/risk/check", response_model=RiskCheckResponse)
-def risk_check(
-    payload: RiskCheckRequest,
+
+def get_screening_job(db: Session, job_id: int, current_user: Principal) -> ScreeningJob:
+    job = db.query(ScreeningJob).filter(ScreeningJob.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    if job.created_by_id != current_user.id and not current_user.is_admin:
+        raise HTTPException(
+            status_code=403,
+            detail="Apenas o analista criador ou um admin pode consultar o job.",
+        )
+    return job
+
+
+@app.post("/risk/jobs", response_model=ScreeningJobRead, status_code=202)
+def create_screening_job(
+    file: UploadFile = File(...),
+    mapping_json: Optional[str] = Form(None),
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     request: Request = None,
 ):
-    if not any(
-        [payload.full_name, payload.nif, payload.passport, payload.residence_card]
-    ):
+    """
+    Screening de uma carteira de clientes (CSV / Excel) em background.
+    Devolve logo o job; progresso em /risk/jobs/{id} e resultados (NDJSON)
+    em /risk/jobs/{id}/results, mesmo enquanto o job corre.
+    """
+    ext = os.path.splitext(file.filename)[1].lower()
+    if ext not in [".csv", ".xls", ".xlsx"]:
         raise HTTPException(
             status_code=400,
-            detail="Fornece pelo menos um identificador (nome, NIF, passaporte ou cartão).",
+            detail="Formato não suportado. Use ficheiros CSV ou Excel.",
         )
 
-    matches = find_matches(db, payload)
-    score, level, is_pep, has_sanctions, factors = compute_risk_from_matches(
-        payload, matches
+    job = ScreeningJob(
+        status="UPLOADING",
+        file_path="",
+        results_path="",
+        mapping_json=mapping_json,
+        created_by_id=current_user.id,
     )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
 
-    record = RiskRecord(
-        full_name=payload.full_name,
-        nif=payload.nif,
-        passport=payload.passport,
-        residence_card=payload.residence_card,
-        risk_score=score,
-        risk_level=level,
-        is_pep=is_pep,
-        has_sanctions=has_sanctions,
-        matches_json=json.dumps([m.dict() for m in matches], ensure_ascii=False),
-        factors_json=json.dumps([f.dict() for f in factors], ensure_ascii=False),
-        decision=None,
-        analyst_notes=payload.extra_info or "",
-        analyst_id=current_user.id,
-        primary_match_json=None,
-    )
-    db.add(record)
+    job_dir = os.path.join(JOBS_DIR, str(job.id))
+    ensure_dir(job_dir)
+    job.results_path = os.path.join(job_dir, "resultados.ndjson")
+    # qualquer falha daqui até PENDING apaga o job e a sua pasta
+    try:
+        job.file_path = save_upload_sync(file, job_dir, f"clientes{ext}").path
+        if mapping_json:
+            try:
+                mapping = json.loads(mapping_json)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="mapping_json inválido.")
+        else:
+            mapping = guess_mapping(read_tabular_headers(job.file_path, ext))
+        if not isinstance(mapping, dict) or "name" not in mapping:
+            raise HTTPException(
+                status_code=400,
+                detail="Não foi possível identificar a coluna do nome. Envia mapping_json explícito.",
+            )
+    except BaseException:
+        db.rollback()
+        db.delete(job)
+        db.commit()
+        shutil.rmtree(job_dir, ignore_errors=True)
+        raise
+
+    job.status = "PENDING"
     db.commit()
-    db.refresh(record)
+    db.refresh(job)
+    job_runner.submit(job.id)
 
     ip = request.client.host if request and request.client else None
     log_event(
         db,
-        "risk_check",
+        "create_screening_job",
         user=current_user,
-        details=f"RiskRecord {record.id} para {record.full_name} (score={record.risk_score})",
+        details=f"Job de screening {job.id} ({file.filename})",
         ip_address=ip,
     )
+    return screening_job_read(job)
 
-    return RiskCheckResponse(
-        id=record.id,
-        full_name=record.full_name,
-        nif=record.nif,
-        passport=record.passport,
-        residence_card=record.residence_card,
-        risk_score=record.risk_score,
-        risk_level=record.risk_level,
-        is_pep=record.is_pep,
-        has_sanctions=record.has_sanctions,
-        matches=matches,
-        factors=factors,
-        decision=record.decision,
-        analyst_notes=record.analyst_notes,
-        created_at=record.created_at,
+
+@app.get("/risk/jobs/{job_id}", response_model=ScreeningJobRead)
+def get_screening_job_status(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    return screening_job_read(get_screening_job(db, job_id, current_user))
+
+
+@app.get("/risk/jobs/{job_id}/results")
+def stream_screening_job_results(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    get_screening_job(db, job_id, current_user)
+    return StreamingResponse(
+        follow_results(job_id), media_type="application/x-ndjson"
     )
 
 
@@ -1165,7 +1015,7 @@ def update_risk_decision(
     record_id: int,
     payload: RiskDecisionUpdate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     request: Request = None,
 ):
     record = db.query(RiskRecord).filter(RiskRecord.id == record_id).first()
@@ -1222,6 +1072,68 @@ def update_risk_decision(
     )
 
 
+# ---------------------- Alertas de re-screening ----------------------
+
+
+def risk_alert_read(alert: RiskAlert) -> RiskAlertRead:
+    return RiskAlertRead(
+        id=alert.id,
+        risk_record_id=alert.risk_record_id,
+        source_id=alert.source_id,
+        previous_score=alert.previous_score,
+        previous_level=alert.previous_level,
+        new_score=alert.new_score,
+        new_level=alert.new_level,
+        matches=[Match(**m) for m in json.loads(alert.matches_json)],
+        status=alert.status,
+        created_at=alert.created_at,
+    )
+
+
+@app.get("/risk/alerts", response_model=List[RiskAlertRead])
+def list_risk_alerts(
+    status_filter: Optional[str] = Query("OPEN", alias="status"),
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    """
+    Clientes já verificados cujo nível de risco mudaria com uma lista nova.
+    """
+    q = db.query(RiskAlert)
+    if status_filter:
+        q = q.filter(RiskAlert.status == status_filter.upper())
+    alerts = q.order_by(RiskAlert.created_at.desc()).limit(limit).all()
+    return [risk_alert_read(a) for a in alerts]
+
+
+@app.patch("/risk/alerts/{alert_id}/ack", response_model=RiskAlertRead)
+def acknowledge_risk_alert(
+    alert_id: int,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+    request: Request = None,
+):
+    alert = db.query(RiskAlert).filter(RiskAlert.id == alert_id).first()
+    if not alert:
+        raise HTTPException(status_code=404, detail="Alerta não encontrado")
+
+    alert.status = "ACKNOWLEDGED"
+    alert.acknowledged_by_id = current_user.id
+    db.commit()
+    db.refresh(alert)
+
+    ip = request.client.host if request and request.client else None
+    log_event(
+        db,
+        "acknowledge_risk_alert",
+        user=current_user,
+        details=f"Tratou alerta {alert.id} (RiskRecord {alert.risk_record_id})",
+        ip_address=ip,
+    )
+    return risk_alert_read(alert)
+
+
 # ---------------------- Histórico ----------------------
 
 
@@ -1229,7 +1141,7 @@ def update_risk_decision(
 def risk_history(
     limit: int = Query(50, ge=1, le=500),
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
 ):
     qs = (
         db.query(RiskRecord)
@@ -1261,26 +1173,39 @@ BASE_APP_URL = os.getenv("BASE_APP_URL", "https://teu-front.netlify.app")
 
 
 @app.get("/risk/{record_id}/report.pdf")
-def download_risk_report(
+async def download_risk_report(
     record_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     request: Request = None,
 ):
-    record = db.query(RiskRecord).filter(RiskRecord.id == record_id).first()
-    if not record:
-        raise HTTPException(status_code=404, detail="Registo de risco não encontrado")
+    """
+    O PDF é gerado no report_executor (no máximo REPORT_WORKERS em
+    simultâneo), com uma sessão própria: enquanto espera, o pedido não
+    ocupa nenhuma thread do threadpool.
+    """
+    ip = request.client.host if request and request.client else None
 
-    pdf_path = build_risk_report_pdf(db, record_id, BASE_APP_URL)
+    def render() -> Optional[str]:
+        db = SessionLocal()
+        try:
+            record = db.query(RiskRecord.id).filter(RiskRecord.id == record_id).first()
+            if not record:
+                return None
+            pdf_path = build_risk_report_pdf(db, record_id, BASE_APP_URL)
+            log_event(
+                db,
+                "download_report",
+                user=current_user,
+                details=f"Download de relatório PDF para RiskRecord {record_id}",
+                ip_address=ip,
+            )
+            return pdf_path
+        finally:
+            db.close()
 
-    ip = request.client.host if request and request.client else None
-    log_event(
-        db,
-        "download_report",
-        user=current_user,
-        details=f"Download de relatório PDF para RiskRecord {record_id}",
-        ip_address=ip,
-    )
+    pdf_path = await run(report_executor, render)
+    if pdf_path is None:
+        raise HTTPException(status_code=404, detail="Registo de risco não encontrado")
 
     return FileResponse(
         pdf_path,
@@ -1292,11 +1217,19 @@ def download_risk_report(
 # ---------------------- Logs / Auditoria ----------------------
 
 
+@app.get("/admin/cache")
+def get_cache_stats(
+    admin: Principal = Depends(get_current_admin),
+):
+    """Contadores da cache de resultados do /risk/check (deste worker)."""
+    return risk_cache.stats()
+
+
 @app.get("/admin/logs", response_model=List[AuditLogRead])
 def get_logs(
     limit: int = Query(100, ge=1, le=1000),
     db: Session = Depends(get_db),
-    admin: User = Depends(get_current_admin),
+    admin: Principal = Depends(get_current_admin),
 ):
     logs = (
         db.query(AuditLog)
@@ -0,0 +1,260 @@
+# matching.py
+"""
+Lógica de matching e risco: procura de candidatos no snapshot de screening,
+scoring de similaridade e cálculo do score de risco.
+"""
+import json
+import os
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from normalization import (
+    fold_name,
+    name_key,
+    phonetic_key,
+    canonical_identifiers,
+)
+from risk_cache import risk_cache
+from schemas import RiskCheckRequest, Match, RiskFactor
+from screening import screening, ScreeningSnapshot
+from similarity import NAME_MATCH_THRESHOLD, name_similarity_many
+
+
+# Quantos candidatos (por tipo de fonte) passam do pré-score do índice de
+# trigramas para a similaridade completa, e com que limiar. Afinável por
+# tipo com SCREENING_SOURCE_SETTINGS, ex.:
+#   {"SANCTIONS": {"top_k": 100, "threshold": 0.55}, "CLAIMS": {"top_k": 20}}
+SCREENING_TOP_K = int(os.getenv("SCREENING_TOP_K", "50"))
+SOURCE_TYPE_SETTINGS = {
+    source_type.upper(): settings
+    for source_type, settings in json.loads(
+        os.getenv("SCREENING_SOURCE_SETTINGS", "{}")
+    ).items()
+}
+# Entra na chave da cache: mudar a configuração não serve resultados antigos.
+SCREENING_SETTINGS_KEY = json.dumps(
+    [SCREENING_TOP_K, NAME_MATCH_THRESHOLD, SOURCE_TYPE_SETTINGS], sort_keys=True
+)
+
+
+def source_top_k(source_type: str) -> int:
+    settings = SOURCE_TYPE_SETTINGS.get((source_type or "").upper(), {})
+    return int(settings.get("top_k", SCREENING_TOP_K))
+
+
+def source_threshold(source_type: str) -> float:
+    settings = SOURCE_TYPE_SETTINGS.get((source_type or "").upper(), {})
+    return float(settings.get("threshold", NAME_MATCH_THRESHOLD))
+
+
+# limiar mais baixo configurado: é o que o scoring em lote pode usar para sair cedo
+MIN_NAME_THRESHOLD = min(
+    [NAME_MATCH_THRESHOLD]
+    + [float(s["threshold"]) for s in SOURCE_TYPE_SETTINGS.values() if "threshold" in s]
+)
+
+
+def find_matches(
+    req: RiskCheckRequest,
+    snapshot: Optional[ScreeningSnapshot] = None,
+    token_search: Optional[Callable[[str], Iterable[int]]] = None,
+) -> List[Match]:
+    """
+    Procura matches nas entidades normalizadas,
+    usando NIF, passaporte, cartão e nome aproximado.
+    Lê só do snapshot em memória. `token_search` (ex.: entity_fts.search,
+    passado pelo /risk/check) junta à pesquisa por nome os candidatos por
+    token; é uma query à BD, por isso o screening em massa não o usa.
+    """
+    snapshot = snapshot or screening.current
+    matches: List[Match] = []
+    query_key = name_key(req.full_name)
+    query_phonetic = phonetic_key(req.full_name)
+
+    identifiers = canonical_identifiers(req.nif, req.passport, req.residence_card)
+
+    if identifiers:
+        # Todos os identificadores fornecidos, via índice (kind, value)
+        entity_ids = snapshot.ids_for_identifiers(identifiers)[:200]
+    else:
+        # Nome: igualdade nas chaves calculadas no ingest
+        # + top-K por tipo de fonte dos trigramas e dos tokens (FTS5, bm25)
+        entity_ids = snapshot.ids_for_name(
+            req.full_name,
+            query_key,
+            query_phonetic,
+            top_k=source_top_k,
+            token_ranked=token_search(req.full_name) if token_search else (),
+        )
+    candidates = [snapshot.entities[i] for i in entity_ids]
+
+    has_identifier = bool(identifiers)
+    # com identificador os candidatos ficam todos (o score é só informativo)
+    threshold = 0.0 if has_identifier else MIN_NAME_THRESHOLD
+    scores = name_similarity_many(
+        req.full_name,
+        [entity.person_name for entity in candidates],
+        threshold,
+        candidate_keys=[entity.name_key for entity in candidates],
+    )
+
+    for entity, similarity in zip(candidates, scores):
+        src = snapshot.sources.get(entity.source_id)
+        if src is None:
+            continue
+        # name_key igual: mesmo nome com outra ordem/acentos/partículas.
+        # A chave fonética só serve para trazer candidatos (ignora as vogais
+        # internas: 'Maria'/'Mario' coincidem); o score é o de name_similarity.
+        if query_key and entity.name_key == query_key:
+            similarity = 1.0
+        if not has_identifier and similarity < source_threshold(src.source_type):
+            continue
+
+        identifier = (
+            entity.person_nif or entity.person_passport or entity.residence_card or None
+        )
+
+        matches.append(
+            Match(
+                source_id=src.id,
+                source_name=src.name,
+                source_type=src.source_type,
+                match_name=entity.person_name or "",
+                match_identifier=identifier,
+                similarity=similarity,
+                details={
+                    "role": entity.role,
+                    "country": entity.country,
+                },
+            )
+        )
+
+    return matches
+
+
+def compute_risk_from_matches(
+    req: RiskCheckRequest,
+    matches: List[Match],
+) -> Tuple[int, str, bool, bool, List[RiskFactor]]:
+    factors: List[RiskFactor] = []
+    score = 0
+    is_pep = False
+    has_sanctions = False
+
+    for m in matches:
+        st = (m.source_type or "").upper()
+        if st == "PEP":
+            is_pep = True
+            factors.append(
+                RiskFactor(code="PEP", description="Presença em lista PEP", weight=70)
+            )
+            score += 70
+        elif st == "SANCTIONS":
+            has_sanctions = True
+            factors.append(
+                RiskFactor(
+                    code="SANCTIONS",
+                    description="Presença em lista de sanções",
+                    weight=100,
+                )
+            )
+            score += 100
+        elif st == "FRAUD":
+            factors.append(
+                RiskFactor(
+                    code="FRAUD",
+                    description="Registo em base interna de fraude",
+                    weight=60,
+                )
+            )
+            score += 60
+        elif st == "CLAIMS":
+            factors.append(
+                RiskFactor(
+                    code="CLAIMS",
+                    description="Histórico de sinistros relevante",
+                    weight=30,
+                )
+            )
+            score += 30
+
+    if not req.nif:
+        factors.append(
+            RiskFactor(code="NO_NIF", description="NIF não fornecido", weight=10)
+        )
+        score += 10
+
+    if score == 0 and req.nif:
+        factors.append(
+            RiskFactor(
+                code="CLEAN",
+                description="Sem ocorrências negativas nas fontes",
+                weight=0,
+            )
+        )
+
+    score = max(0, min(score, 100))
+
+    if score <= 30:
+        level = "LOW"
+    elif score <= 60:
+        level = "MEDIUM"
+    elif score <= 85:
+        level = "HIGH"
+    else:
+        level = "CRITICAL"
+
+    return score, level, is_pep, has_sanctions, factors
+
+
+def screening_request_key(req: RiskCheckRequest) -> tuple:
+    """
+    Chave normalizada de um pedido: dois pedidos com a mesma chave produzem
+    os mesmos matches e o mesmo score. Leva os valores que o find_matches
+    usa: fold_name (trigramas), name_key e phonetic_key (que trata o 'ç'
+    antes de tirar acentos: 'Lourenço' e 'Lourenco' têm chaves diferentes).
+    """
+    return (
+        fold_name(req.full_name),
+        name_key(req.full_name),
+        phonetic_key(req.full_name),
+        tuple(canonical_identifiers(req.nif, req.passport, req.residence_card)),
+        bool(req.nif),
+    )
+
+
+def screen_request(
+    req: RiskCheckRequest,
+    snapshot: Optional[ScreeningSnapshot] = None,
+    token_search: Optional[Callable[[str], Iterable[int]]] = None,
+) -> Tuple[List[Match], Tuple[int, str, bool, bool, List[RiskFactor]]]:
+    """
+    find_matches + compute_risk_from_matches, com cache por pedido
+    normalizado e geração do corpus (ver risk_cache.py). Só numa falha da
+    cache é que `token_search` é chamado.
+    """
+    snapshot = snapshot or screening.current
+    key = (screening_request_key(req), SCREENING_SETTINGS_KEY, token_search is not None)
+    cached = risk_cache.get(key, snapshot.generation)
+    if cached is not None:
+        matches = [Match(**m) for m in cached["matches"]]
+        score, level, is_pep, has_sanctions, factors = cached["risk"]
+        return matches, (
+            score,
+            level,
+            is_pep,
+            has_sanctions,
+            [RiskFactor(**f) for f in factors],
+        )
+
+    matches = find_matches(req, snapshot, token_search)
+    risk = compute_risk_from_matches(req, matches)
+    score, level, is_pep, has_sanctions, factors = risk
+    risk_cache.put(
+        key,
+        snapshot.generation,
+        {
+            "matches": [m.dict() for m in matches],
+            "risk": [score, level, is_pep, has_sanctions, [f.dict() for f in factors]],
+        },
+    )
+    return matches, risk
@@ -1,15 +1,18 @@
 # models.py
+import json
+import zlib
 from datetime import datetime
 from sqlalchemy import (
     Column,
     Integer,
+    BigInteger,
     String,
     Boolean,
     DateTime,
     Text,
     ForeignKey,
-    JSON,
     Index,
+    LargeBinary,
 )
 from sqlalchemy.orm import relationship
 from database import Base
@@ -24,6 +27,9 @@ class User(Base):
     password_hash = Column(String(255), nullable=False)
     is_admin = Column(Boolean, default=False)
     is_active = Column(Boolean, default=True)
+    # Incrementada quando o estado ou a password mudam: os outros processos
+    # descartam os tokens em cache deste utilizador (ver security.PrincipalCache)
+    auth_version = Column(Integer, default=0)
     created_at = Column(DateTime, default=datetime.utcnow)
 
     risk_records = relationship("RiskRecord", back_populates="analyst")
@@ -37,7 +43,21 @@ class InfoSource(Base):
     source_type = Column(String(50), nullable=False)  # PEP, SANCTIONS, FRAUD, CLAIMS, OTHER
     description = Column(Text, default="")
     file_path = Column(String(500), nullable=False)
+    # Calculados durante a gravação do upload (ver uploads.save_upload)
+    file_size = Column(BigInteger, nullable=True)
+    content_sha256 = Column(String(64), index=True, nullable=True)
+    # Fontes criadas por URL: a URL e os validadores HTTP da versão actual
+    # (GET condicional: um 304 não volta a ingerir)
+    url = Column(Text, nullable=True)
+    http_etag = Column(String(500), nullable=True)
+    http_last_modified = Column(String(100), nullable=True)
+    # Refresh automático da URL (ver source_refresh.py); None = desligado
+    refresh_interval_minutes = Column(Integer, nullable=True)
+    next_refresh_at = Column(DateTime, nullable=True)
     num_records = Column(Integer, default=0)
+    # Geração do corpus em que as entidades da fonte mudaram pela última vez:
+    # o snapshot de screening só recarrega as fontes em que mudou
+    entities_generation = Column(Integer, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     uploaded_by_id = Column(Integer, ForeignKey("users.id"))
 
@@ -57,16 +77,70 @@ class NormalizedEntity(Base):
     person_passport = Column(String(50), index=True, nullable=True)
     residence_card = Column(String(50), index=True, nullable=True)
 
+    # Chaves calculadas no ingest (ver normalization.name_key_columns)
+    name_key = Column(String(300), nullable=True)
+    name_phonetic = Column(String(300), nullable=True)
+    # SHA-256 da linha (ver ingestion.row_hash), para o diff entre versões
+    row_hash = Column(String(64), nullable=True)
+
     role = Column(String(200), nullable=True)
     country = Column(String(100), nullable=True)
 
-    raw_payload = Column(JSON, nullable=False)
+    # Linha original, em entity_payloads (ver payloads.py)
+    payload_hash = Column(
+        String(64), ForeignKey("entity_payloads.payload_hash"), nullable=True
+    )
     created_at = Column(DateTime, default=datetime.utcnow)
 
     source = relationship("InfoSource")
+    payload = relationship("EntityPayload", lazy="select")
+
+    @property
+    def raw_payload(self):
+        return self.payload.content if self.payload is not None else None
 
 Index("idx_normalized_entities_nif", NormalizedEntity.person_nif)
 Index("idx_normalized_entities_name", NormalizedEntity.person_name)
+Index("idx_normalized_entities_name_key", NormalizedEntity.name_key)
+Index("idx_normalized_entities_name_phonetic", NormalizedEntity.name_phonetic)
+Index("idx_normalized_entities_payload_hash", NormalizedEntity.payload_hash)
+Index(
+    "idx_normalized_entities_source_row_hash",
+    NormalizedEntity.source_id,
+    NormalizedEntity.row_hash,
+)
+
+
+class EntityPayload(Base):
+    """
+    Linha original de uma ou mais entidades: JSON comprimido (zlib),
+    identificado pelo SHA-256 do JSON canónico (ver payloads.py).
+    """
+    __tablename__ = "entity_payloads"
+
+    payload_hash = Column(String(64), primary_key=True)
+    data = Column(LargeBinary, nullable=False)
+
+    @property
+    def content(self):
+        return json.loads(zlib.decompress(self.data).decode("utf-8"))
+
+
+class EntityIdentifier(Base):
+    """
+    Identificadores canónicos (NIF, passaporte, cartão) de cada entidade,
+    numa só tabela para que uma pesquisa indexada cubra todos os tipos.
+    """
+    __tablename__ = "entity_identifiers"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String(20), nullable=False)  # nif, passport, residence_card
+    value = Column(String(50), nullable=False)
+    entity_id = Column(
+        Integer, ForeignKey("normalized_entities.id"), nullable=False, index=True
+    )
+
+Index("idx_entity_identifiers_kind_value", EntityIdentifier.kind, EntityIdentifier.value)
 
 
 class RiskRecord(Base):
@@ -98,6 +172,29 @@ class RiskRecord(Base):
     analyst = relationship("User", back_populates="risk_records")
 
 
+class RiskAlert(Base):
+    """
+    Alerta gerado pelo re-screening: um RiskRecord existente cujo nível de
+    risco mudaria com as entidades de uma fonte nova.
+    """
+    __tablename__ = "risk_alerts"
+
+    id = Column(Integer, primary_key=True, index=True)
+    risk_record_id = Column(Integer, ForeignKey("risk_records.id"), nullable=False, index=True)
+    source_id = Column(Integer, ForeignKey("info_sources.id"), nullable=True)
+
+    previous_score = Column(Integer, nullable=False)
+    previous_level = Column(String(20), nullable=False)
+    new_score = Column(Integer, nullable=False)
+    new_level = Column(String(20), nullable=False)
+    # Matches novos (JSON serializado)
+    matches_json = Column(Text, nullable=False)
+
+    status = Column(String(20), default="OPEN")  # OPEN, ACKNOWLEDGED
+    created_at = Column(DateTime, default=datetime.utcnow)
+    acknowledged_by_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+
+
 class AuditLog(Base):
     __tablename__ = "audit_logs"
 
@@ -108,3 +205,88 @@ class AuditLog(Base):
     action = Column(String(100), nullable=False)
     details = Column(Text, nullable=True)
     ip_address = Column(String(100), nullable=True)
+
+
+class CorpusState(Base):
+    """
+    Linha única com a geração do corpus de screening. Qualquer alteração às
+    fontes incrementa-a; cada processo reconstrói o seu snapshot quando a
+    geração muda.
+    """
+    __tablename__ = "corpus_state"
+
+    id = Column(Integer, primary_key=True)
+    generation = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class IngestionJob(Base):
+    """
+    Ingestão de uma fonte (upload ou URL) em background. O ficheiro fica em
+    disco; a fonte só muda quando o diff é aplicado (um único commit).
+    """
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    source_id = Column(Integer, ForeignKey("info_sources.id"), nullable=True)
+    kind = Column(String(10), nullable=False)  # FILE, URL
+    status = Column(String(20), nullable=False, default="PENDING")  # PENDING, RUNNING, DONE, FAILED
+    # QUEUED, DOWNLOADING, EXTRACTING, INDEXING, DONE, FAILED
+    stage = Column(String(20), nullable=False, default="QUEUED")
+
+    url = Column(Text, nullable=True)
+    ext = Column(String(10), nullable=True)
+    file_path = Column(String(500), nullable=True)
+    file_size = Column(BigInteger, nullable=True)
+    content_sha256 = Column(String(64), nullable=True)
+    http_etag = Column(String(500), nullable=True)
+    http_last_modified = Column(String(100), nullable=True)
+    mapping_json = Column(Text, nullable=True)
+    # Excel: lista JSON das folhas a ingerir (None = todas)
+    sheets_json = Column(Text, nullable=True)
+    description = Column(Text, default="")
+    # a fonte foi criada por este job (removida se o conteúdo for duplicado)
+    created_source = Column(Boolean, default=False)
+
+    ingest_status = Column(String(20), nullable=True)  # CREATED, UPDATED, UNCHANGED
+    rows_processed = Column(Integer, default=0)
+    rows_added = Column(Integer, default=0)
+    rows_removed = Column(Integer, default=0)
+    rows_unchanged = Column(Integer, default=0)
+    error = Column(Text, nullable=True)
+    # avisos de um job concluído (ex.: páginas de um PDF não extraídas)
+    warnings = Column(Text, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    created_by_id = Column(Integer, ForeignKey("users.id"))
+
+
+class ScreeningJob(Base):
+    """
+    Screening assíncrono de uma carteira de clientes (CSV / Excel).
+    Os resultados vão para um ficheiro NDJSON; rows_done / results_bytes são
+    o checkpoint a partir do qual um job interrompido é retomado.
+    """
+    __tablename__ = "screening_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    status = Column(String(20), nullable=False, default="PENDING")  # PENDING, RUNNING, DONE, FAILED
+    file_path = Column(String(500), nullable=False)
+    results_path = Column(String(500), nullable=False)
+    mapping_json = Column(Text, nullable=True)
+
+    total_rows = Column(Integer, nullable=True)
+    rows_done = Column(Integer, default=0)
+    rows_matched = Column(Integer, default=0)
+    results_bytes = Column(Integer, default=0)
+    resumed_from_row = Column(Integer, default=0)
+    error = Column(Text, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    created_by_id = Column(Integer, ForeignKey("users.id"))
@@ -0,0 +1,94 @@
+# name_index.py
+"""
+Índice invertido de trigramas sobre NormalizedEntity.person_name
+(usado pelo snapshot de screening, ver screening.py).
+
+Substitui o `LIKE '%NOME%'` (varrimento completo da tabela) na pesquisa por
+nome: cada trigrama aponta para o conjunto de entidades que o contém e os
+candidatos saem da intersecção (aproximada) das listas dos trigramas da query.
+"""
+import math
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+from normalization import name_tokens
+
+
+# Fracção mínima de trigramas da query que um candidato tem de partilhar.
+MIN_TRIGRAM_OVERLAP = 0.5
+
+
+def trigrams(name: Optional[str]) -> Set[str]:
+    """
+    Trigramas por palavra (estilo pg_trgm): cada token é prefixado com dois
+    espaços e terminado com um, para que o início das palavras pese mais.
+    """
+    grams: Set[str] = set()
+    for token in name_tokens(name):
+        padded = f"  {token} "
+        for i in range(len(padded) - 2):
+            grams.add(padded[i : i + 3])
+    return grams
+
+
+class TrigramIndex:
+    """
+    Índice em memória. É preenchido uma vez (na construção do snapshot) e a
+    partir daí só é lido, sem locks: nunca é alterado depois de publicado.
+    De cada entidade guarda só o número de trigramas (para o pré-score).
+    """
+
+    def __init__(self) -> None:
+        self._postings: Dict[str, Set[int]] = defaultdict(set)
+        self._gram_counts: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._gram_counts)
+
+    def add(self, entity_id: int, name: Optional[str]) -> None:
+        grams = trigrams(name)
+        if not grams:
+            return
+        self._gram_counts[entity_id] = len(grams)
+        for g in grams:
+            self._postings[g].add(entity_id)
+
+    def search_scored(
+        self,
+        name: str,
+        min_overlap: float = MIN_TRIGRAM_OVERLAP,
+    ) -> List[Tuple[int, float]]:
+        """
+        Entidades que partilham pelo menos `min_overlap` dos trigramas da
+        query, com o pré-score Dice (2 * comuns / (|q| + |e|)), da melhor
+        para a pior. Serve para escolher os K candidatos que vale a pena
+        pontuar com a similaridade completa.
+
+        Um candidato com `t` trigramas em comum tem de aparecer numa das
+        `len(q) - t + 1` listas mais curtas, por isso só essas são percorridas;
+        as restantes servem apenas para confirmar contagens (lookup em set).
+        """
+        query = trigrams(name)
+        if not query:
+            return []
+        needed = max(1, math.ceil(len(query) * min_overlap))
+
+        empty: Set[int] = set()
+        postings = sorted((self._postings.get(g, empty) for g in query), key=len)
+        prefix = len(postings) - needed + 1
+        counts: Dict[int, int] = defaultdict(int)
+        for posting in postings[:prefix]:
+            for entity_id in posting:
+                counts[entity_id] += 1
+        for posting in postings[prefix:]:
+            for entity_id in counts:
+                if entity_id in posting:
+                    counts[entity_id] += 1
+        scored = [
+            (eid, 2.0 * c / (len(query) + self._gram_counts[eid]))
+            for eid, c in counts.items()
+            if c >= needed
+        ]
+
+        scored.sort(key=lambda item: -item[1])
+        return scored
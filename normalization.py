@@ -0,0 +1,132 @@
+# normalization.py
+"""
+Funções de normalização de texto usadas no matching de nomes.
+"""
+import re
+import unicodedata
+from typing import List, Optional
+
+
+_NON_ALNUM = re.compile(r"[^0-9A-Z]+")
+
+
+def fold_accents(text: Optional[str]) -> str:
+    """Remove acentos/diacríticos ('José' -> 'Jose')."""
+    if not text:
+        return ""
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def fold_name(name: Optional[str]) -> str:
+    """
+    Forma canónica de um nome para pesquisa:
+    sem acentos, maiúsculas e só letras/dígitos separados por um espaço.
+    """
+    folded = fold_accents(name).upper()
+    return _NON_ALNUM.sub(" ", folded).strip()
+
+
+def name_tokens(name: Optional[str]) -> List[str]:
+    return fold_name(name).split()
+
+
+# ---------------------- Chaves persistidas ----------------------
+
+# Partículas de ligação que não distinguem pessoas ("José Eduardo dos Santos").
+NAME_PARTICLES = {"DA", "DAS", "DE", "DI", "DO", "DOS", "DU", "E", "D"}
+
+# Regras fonéticas (ordem importa): dígrafos primeiro, depois letras simples.
+_PHONETIC_RULES = [
+    (re.compile(r"LH"), "L"),
+    (re.compile(r"NH"), "N"),
+    (re.compile(r"[CS]H"), "X"),
+    (re.compile(r"PH"), "F"),
+    (re.compile(r"TH"), "T"),
+    (re.compile(r"QU(?=[EI])"), "K"),
+    (re.compile(r"GU(?=[EI])"), "G"),
+    (re.compile(r"C(?=[EIY])"), "S"),
+    (re.compile(r"G(?=[EIY])"), "J"),
+    (re.compile(r"Q"), "K"),
+    (re.compile(r"C"), "K"),
+    (re.compile(r"Z"), "S"),
+    (re.compile(r"W"), "V"),
+    (re.compile(r"Y"), "I"),
+    (re.compile(r"H"), ""),
+    (re.compile(r"M$"), "N"),
+]
+_VOWELS = re.compile(r"[AEIOU]")
+_REPEATS = re.compile(r"(.)\1+")
+
+
+def _significant_tokens(name: Optional[str]) -> List[str]:
+    return [t for t in name_tokens(name) if t not in NAME_PARTICLES]
+
+
+def name_key(name: Optional[str]) -> Optional[str]:
+    """
+    Chave normalizada: sem acentos, sem partículas, tokens ordenados.
+    'José Eduardo dos Santos' e 'Santos, Jose Eduardo' -> 'EDUARDO JOSE SANTOS'.
+    """
+    tokens = _significant_tokens(name)
+    return " ".join(sorted(tokens)) or None
+
+
+def _phonetic_token(token: str) -> str:
+    for pattern, repl in _PHONETIC_RULES:
+        token = pattern.sub(repl, token)
+    if not token:
+        return ""
+    # a primeira letra mantém-se (distingue 'ANA' de 'NA'); vogais internas caem
+    return _REPEATS.sub(r"\1", token[0] + _VOWELS.sub("", token[1:]))
+
+
+def phonetic_key(name: Optional[str]) -> Optional[str]:
+    """
+    Chave fonética simplificada para português (LH/NH/CH, Ç/SS/Z, C/G
+    antes de E/I, H mudo, vogais internas ignoradas), com tokens ordenados.
+    'João Lourenço' e 'Joao Lorenso' -> a mesma chave.
+    É grosseira de propósito: serve para recolher candidatos, não para
+    decidir um match ('Maria' e 'Mario' também coincidem).
+    """
+    if not name:
+        return None
+    # Ç perde-se ao remover acentos; tratá-lo antes como S
+    name = name.replace("ç", "s").replace("Ç", "S")
+    keys = [_phonetic_token(t) for t in _significant_tokens(name)]
+    return " ".join(sorted(k for k in keys if k)) or None
+
+
+def name_key_columns(name: Optional[str]) -> dict:
+    """Valores das colunas name_key / name_phonetic para um NormalizedEntity."""
+    return {"name_key": name_key(name), "name_phonetic": phonetic_key(name)}
+
+
+# ---------------------- Identificadores ----------------------
+
+IDENTIFIER_KINDS = ("nif", "passport", "residence_card")
+
+
+def canonical_identifier(value: Optional[str]) -> Optional[str]:
+    """
+    Forma canónica de um NIF / passaporte / cartão: minúsculas, sem espaços
+    nem pontuação ('AB 12.345-C' -> 'ab12345c').
+    """
+    if value is None:
+        return None
+    canonical = "".join(c for c in str(value).casefold() if c.isalnum())
+    return canonical or None
+
+
+def canonical_identifiers(
+    nif: Optional[str] = None,
+    passport: Optional[str] = None,
+    residence_card: Optional[str] = None,
+) -> List[tuple]:
+    """Pares (kind, value) canónicos dos identificadores preenchidos."""
+    pairs = []
+    for kind, raw in zip(IDENTIFIER_KINDS, (nif, passport, residence_card)):
+        value = canonical_identifier(raw)
+        if value:
+            pairs.append((kind, value))
+    return pairs
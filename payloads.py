@@ -0,0 +1,123 @@
+# payloads.py
+"""
+Linha original de cada entidade (raw_payload), fora de normalized_entities.
+
+O raw_payload só é lido para auditoria / recálculo do row_hash; o screening
+usa as colunas mapeadas. Por isso fica numa tabela à parte (entity_payloads),
+em JSON comprimido com zlib e guardado uma vez por conteúdo: a entidade
+guarda só o SHA-256 (payload_hash), e linhas iguais (na mesma fonte ou em
+versões / fontes diferentes) partilham o mesmo registo.
+NormalizedEntity.raw_payload carrega-o (lazy) quando é pedido.
+"""
+import hashlib
+import json
+import logging
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import bindparam, insert, inspect, text
+from sqlalchemy.orm import Session
+
+from models import EntityPayload, NormalizedEntity
+
+
+logger = logging.getLogger(__name__)
+
+PAYLOAD_ZLIB_LEVEL = 6
+
+
+def encode_payload(payload: Optional[dict]) -> Tuple[str, bytes]:
+    """(SHA-256, JSON comprimido) de um payload; o hash é do JSON canónico."""
+    raw = json.dumps(
+        payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str
+    ).encode("utf-8")
+    return hashlib.sha256(raw).hexdigest(), zlib.compress(raw, PAYLOAD_ZLIB_LEVEL)
+
+
+def store_payloads(db: Session, payloads: Iterable[Optional[dict]]) -> List[str]:
+    """
+    Guarda os payloads que ainda não existem (um executemany) e devolve o
+    payload_hash de cada um, pela mesma ordem. Não faz commit.
+    """
+    hashes: List[str] = []
+    encoded: Dict[str, bytes] = {}
+    for payload in payloads:
+        payload_hash, data = encode_payload(payload)
+        hashes.append(payload_hash)
+        encoded.setdefault(payload_hash, data)
+
+    existing = set()
+    keys = list(encoded)
+    for i in range(0, len(keys), 500):
+        existing.update(
+            h
+            for (h,) in db.query(EntityPayload.payload_hash).filter(
+                EntityPayload.payload_hash.in_(keys[i : i + 500])
+            )
+        )
+    new = [
+        {"payload_hash": h, "data": data} for h, data in encoded.items() if h not in existing
+    ]
+    if new:
+        db.execute(insert(EntityPayload.__table__), new)
+    return hashes
+
+
+def delete_orphan_payloads(db: Session, payload_hashes: Iterable[Optional[str]]) -> None:
+    """Apaga, dos `payload_hashes`, os que já nenhuma entidade usa. Não faz commit."""
+    keys = list({h for h in payload_hashes if h})
+    for i in range(0, len(keys), 500):
+        db.query(EntityPayload).filter(
+            EntityPayload.payload_hash.in_(keys[i : i + 500]),
+            ~db.query(NormalizedEntity.id)
+            .filter(NormalizedEntity.payload_hash == EntityPayload.payload_hash)
+            .exists(),
+        ).delete(synchronize_session=False)
+
+
+def migrate_raw_payloads(engine, batch_size: int = 5000) -> None:
+    """
+    Bases de dados anteriores guardam o raw_payload (JSON) em cada linha de
+    normalized_entities: passa-os para entity_payloads e remove a coluna.
+    Em SQLite corre VACUUM no fim, para o ficheiro encolher de facto.
+    """
+    columns = {c["name"] for c in inspect(engine).get_columns(NormalizedEntity.__tablename__)}
+    if "raw_payload" not in columns:
+        return
+
+    logger.info("A mover raw_payload de normalized_entities para entity_payloads")
+    db = Session(bind=engine)
+    try:
+        last_id = 0
+        while True:
+            rows = db.execute(
+                text(
+                    "SELECT id, raw_payload FROM normalized_entities "
+                    "WHERE id > :last_id ORDER BY id LIMIT :n"
+                ),
+                {"last_id": last_id, "n": batch_size},
+            ).all()
+            if not rows:
+                break
+            payloads = [
+                json.loads(raw) if isinstance(raw, (str, bytes)) else raw for _, raw in rows
+            ]
+            hashes = store_payloads(db, payloads)
+            db.execute(
+                NormalizedEntity.__table__.update()
+                .where(NormalizedEntity.__table__.c.id == bindparam("entity_id"))
+                .values(payload_hash=bindparam("h")),
+                [{"entity_id": entity_id, "h": h} for (entity_id, _), h in zip(rows, hashes)],
+            )
+            last_id = rows[-1][0]
+        db.execute(text("ALTER TABLE normalized_entities DROP COLUMN raw_payload"))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    if engine.dialect.name == "sqlite":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("VACUUM"))
@@ -0,0 +1,256 @@
+# pdf_extraction.py
+"""
+Extracção heurística de entidades de PDFs (tabelas e, em fallback, texto
+corrido), página a página.
+
+O extract_table / extract_text do pdfplumber é pesado em CPU: o PDF é
+dividido em intervalos de PDF_PAGES_PER_TASK páginas, cada um extraído num
+processo próprio (no máximo PDF_EXTRACT_WORKERS em simultâneo). Cada
+intervalo tem um tempo máximo (PDF_PAGE_TIMEOUT_SECONDS por página), contado
+a partir do arranque do seu processo; um intervalo que o ultrapasse é
+terminado, para que uma página malformada não pare a ingestão. O mesmo
+vale com um só worker: a extracção nunca corre no processo de quem chama.
+
+As páginas não extraídas (tempo excedido, processo morto ou erro do
+pdfplumber) vêm em PdfExtraction.skipped, para quem chama as reportar.
+
+Este módulo só depende do pdfplumber: é importado pelos processos filhos.
+"""
+import logging
+import multiprocessing
+import os
+import time
+from multiprocessing.connection import wait
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "4"))
+PDF_PAGE_TIMEOUT_SECONDS = float(os.getenv("PDF_PAGE_TIMEOUT_SECONDS", "30"))
+# Intervalo para verificar se os processos de extracção continuam vivos.
+PDF_POLL_SECONDS = 1.0
+
+
+class PdfExtraction(NamedTuple):
+    entities: List[dict]
+    # páginas não extraídas: "páginas 5-8: tempo máximo excedido", ...
+    skipped: List[str]
+
+
+def extract_page_entities(page, default_country: str) -> List[dict]:
+    """Entidades de uma página: tabelas primeiro e depois texto corrido."""
+    entities: List[dict] = []
+
+    # 1) tentar tabelas
+    table = page.extract_table()
+    if table and len(table) > 1:
+        headers = [(h or "").strip().lower() for h in table[0]]
+        for row in table[1:]:
+            if not any(row):
+                continue
+            record = {}
+            for i in range(min(len(headers), len(row))):
+                record[headers[i]] = (row[i] or "").strip()
+
+            name = (
+                record.get("nome")
+                or record.get("name")
+                or record.get("titular")
+            )
+            if not name:
+                continue
+
+            role = (
+                record.get("cargo")
+                or record.get("funcao")
+                or record.get("função")
+                or ""
+            )
+            country = (
+                record.get("pais")
+                or record.get("país")
+                or record.get("country")
+                or default_country
+            )
+
+            entities.append(
+                {
+                    "person_name": name,
+                    "role": role,
+                    "country": country,
+                }
+            )
+
+    # 2) fallback: texto corrido – muito conservador
+    text = page.extract_text() or ""
+    lines = [ln.strip() for ln in text.split("\n") if ln.strip()]
+    for ln in lines:
+        # Exemplo simples: linha com pelo menos 2 palavras e "Ministro"/"Secretário"
+        lower = ln.lower()
+        if (
+            ("ministro" in lower or "secretário" in lower)
+            and len(ln.split()) >= 2
+        ):
+            entities.append(
+                {
+                    "person_name": ln.split(" ", 1)[0],
+                    "role": ln,
+                    "country": default_country,
+                }
+            )
+
+    return entities
+
+
+def extract_page_range(
+    file_path: str, start: int, end: int, default_country: str
+) -> Tuple[List[dict], List[int]]:
+    """
+    Entidades das páginas [start, end) e números (1-based) das páginas em
+    que o pdfplumber falhou. Corre num processo filho.
+    """
+    import pdfplumber
+
+    entities: List[dict] = []
+    failed: List[int] = []
+    with pdfplumber.open(file_path) as pdf:
+        for number in range(start, end):
+            page = pdf.pages[number]
+            try:
+                entities.extend(extract_page_entities(page, default_country))
+            except Exception:
+                logger.warning("Falha a extrair a página %s de %s", number + 1, file_path)
+                failed.append(number + 1)
+            finally:
+                # liberta os objectos já interpretados da página
+                page.close()
+    return entities, failed
+
+
+def _range_worker(conn, file_path: str, start: int, end: int, default_country: str) -> None:
+    """Corre no processo filho: envia (entidades, páginas falhadas, erro)."""
+    try:
+        entities, failed = extract_page_range(file_path, start, end, default_country)
+        conn.send((entities, failed, None))
+    except Exception as exc:
+        conn.send(([], [], f"{type(exc).__name__}: {exc}"))
+    finally:
+        conn.close()
+
+
+def page_ranges(num_pages: int, per_task: int) -> List[Tuple[int, int]]:
+    per_task = max(1, per_task)
+    return [(i, min(i + per_task, num_pages)) for i in range(0, num_pages, per_task)]
+
+
+def _describe_range(start: int, end: int, reason: str) -> str:
+    pages = f"página {start + 1}" if end - start == 1 else f"páginas {start + 1}-{end}"
+    return f"{pages}: {reason}"
+
+
+def _extract_ranges(
+    file_path: str, num_pages: int, default_country: str, workers: int
+) -> PdfExtraction:
+    # spawn: os workers de ingestão são threads, e fork com threads é frágil
+    ctx = multiprocessing.get_context("spawn")
+    waiting = page_ranges(num_pages, PDF_PAGES_PER_TASK)
+    # conn -> (start, end, processo, prazo)
+    running: Dict[object, Tuple[int, int, multiprocessing.process.BaseProcess, float]] = {}
+    results: Dict[int, List[dict]] = {}
+    skipped: List[str] = []
+
+    def stop(conn) -> None:
+        _, _, proc, _ = running.pop(conn)
+        if proc.is_alive():
+            proc.terminate()
+        proc.join()
+        conn.close()
+
+    try:
+        while waiting or running:
+            while waiting and len(running) < max(1, workers):
+                start, end = waiting.pop(0)
+                receiver, sender = ctx.Pipe(duplex=False)
+                proc = ctx.Process(
+                    target=_range_worker,
+                    args=(sender, file_path, start, end, default_country),
+                    daemon=True,
+                )
+                proc.start()
+                sender.close()
+                deadline = time.monotonic() + PDF_PAGE_TIMEOUT_SECONDS * (end - start)
+                running[receiver] = (start, end, proc, deadline)
+
+            next_deadline = min(deadline for _, _, _, deadline in running.values())
+            timeout = max(0.0, min(PDF_POLL_SECONDS, next_deadline - time.monotonic()))
+            for conn in wait(list(running), timeout=timeout):
+                start, end, _, _ = running[conn]
+                try:
+                    entities, failed, error = conn.recv()
+                except EOFError:
+                    # processo morreu sem enviar nada (OOM, segfault, arranque)
+                    entities, failed, error = [], [], "o processo de extracção terminou"
+                stop(conn)
+                if error:
+                    skipped.append(_describe_range(start, end, error))
+                    continue
+                results[start] = entities
+                skipped.extend(_describe_range(p - 1, p, "erro do pdfplumber") for p in failed)
+
+            now = time.monotonic()
+            for conn, (start, end, _, deadline) in list(running.items()):
+                if now >= deadline:
+                    stop(conn)
+                    skipped.append(_describe_range(start, end, "tempo máximo excedido"))
+    finally:
+        # termina também processos presos numa página
+        for conn in list(running):
+            stop(conn)
+
+    entities = [e for start in sorted(results) for e in results[start]]
+    return PdfExtraction(entities, skipped)
+
+
+def dedupe_entities(entities: List[dict]) -> List[dict]:
+    """Remove duplicados simples por (nome, cargo, país), mantendo o primeiro."""
+    unique = {}
+    for e in entities:
+        key = (
+            (e.get("person_name") or "").upper(),
+            (e.get("role") or "").upper(),
+            (e.get("country") or "").upper(),
+        )
+        if key not in unique:
+            unique[key] = e
+    return list(unique.values())
+
+
+def extract_entities_from_pdf_file(
+    file_path: str,
+    default_country: str = "Angola",
+    workers: Optional[int] = None,
+) -> PdfExtraction:
+    """
+    Extrai entidades de um PDF de forma heurística.
+    Tenta tabelas primeiro; se não houver, tenta texto corrido.
+    Páginas em processos filhos, com tempo máximo (ver docstring do módulo).
+    Um PDF que nem se consegue abrir dá erro (não é uma lista vazia).
+    """
+    try:
+        import pdfplumber
+    except ImportError:
+        # Se pdfplumber não estiver instalado, não quebrar o backend
+        return PdfExtraction([], [])
+
+    workers = PDF_EXTRACT_WORKERS if workers is None else workers
+    with pdfplumber.open(file_path) as pdf:
+        num_pages = len(pdf.pages)
+
+    extraction = _extract_ranges(file_path, num_pages, default_country, workers)
+    if extraction.skipped:
+        logger.warning(
+            "PDF %s: páginas não extraídas: %s", file_path, "; ".join(extraction.skipped)
+        )
+    return PdfExtraction(dedupe_entities(extraction.entities), extraction.skipped)
@@ -0,0 +1,158 @@
+# rescreening.py
+"""
+Re-screening incremental da carteira quando entra uma lista nova.
+
+Em vez de voltar a correr toda a carteira contra todo o corpus, constrói-se
+um snapshot só com as entidades acabadas de inserir (o delta) e cada
+cliente já verificado (risk_records) é procurado nesse snapshot pequeno.
+O custo por cliente é um lookup num índice do tamanho do delta. Quando os
+matches novos mudam o nível de risco, é criado um RiskAlert.
+
+Só as inserções são vistas: uma pessoa retirada de uma lista não baixa o
+nível de nenhum cliente (isso fica para o próximo /risk/check).
+"""
+import json
+import logging
+import threading
+from typing import List, Optional, Sequence
+
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from matching import compute_risk_from_matches, find_matches, screening_request_key
+from models import NormalizedEntity, RiskAlert, RiskRecord
+from schemas import Match, RiskCheckRequest
+from screening import ScreeningSnapshot
+
+
+logger = logging.getLogger(__name__)
+
+# Tipos de fonte que disparam re-screening da carteira.
+RESCREEN_SOURCE_TYPES = {"PEP", "SANCTIONS"}
+
+
+def rescreen_entities(
+    db: Session,
+    entity_ids: Sequence[int],
+    source_id: Optional[int] = None,
+) -> List[RiskAlert]:
+    """
+    Compara a carteira (último RiskRecord de cada cliente) com as entidades
+    `entity_ids` e cria alertas para os registos cujo nível mudaria.
+    """
+    if not entity_ids:
+        return []
+    delta = ScreeningSnapshot.build(db, entity_ids=entity_ids)
+
+    records = (
+        db.query(
+            RiskRecord.id,
+            RiskRecord.full_name,
+            RiskRecord.nif,
+            RiskRecord.passport,
+            RiskRecord.residence_card,
+        )
+        .order_by(RiskRecord.id.desc())
+        .yield_per(5000)
+    )
+
+    seen = set()
+    hits = []
+    for row in records:
+        req = RiskCheckRequest(
+            full_name=row.full_name or "",
+            nif=row.nif,
+            passport=row.passport,
+            residence_card=row.residence_card,
+        )
+        key = screening_request_key(req)
+        if key in seen:  # só o registo mais recente de cada cliente
+            continue
+        seen.add(key)
+        new_matches = find_matches(req, delta)
+        if new_matches:
+            hits.append((row.id, req, new_matches))
+
+    # Numa nova versão de `source_id` uma linha alterada (ex.: cargo editado)
+    # é removida e inserida de novo: o match antigo e o novo são a mesma
+    # pessoa. Os matches antigos dessa fonte são trocados pelos da versão
+    # actual completa (só se houver clientes afectados).
+    source_snapshot = None
+    if hits and source_id is not None:
+        source_snapshot = ScreeningSnapshot.build(
+            db, entity_ids=source_entity_ids(db, source_id)
+        )
+
+    alerts: List[RiskAlert] = []
+    for record_id, req, new_matches in hits:
+        record = db.query(RiskRecord).filter(RiskRecord.id == record_id).first()
+        old_matches = [Match(**m) for m in json.loads(record.matches_json)]
+        if source_snapshot is not None:
+            current = [m for m in old_matches if m.source_id != source_id]
+            current += find_matches(req, source_snapshot)
+        else:
+            current = old_matches + new_matches
+        score, level, *_ = compute_risk_from_matches(req, current)
+        if level == record.risk_level:
+            continue
+        alert = RiskAlert(
+            risk_record_id=record.id,
+            source_id=source_id,
+            previous_score=record.risk_score,
+            previous_level=record.risk_level,
+            new_score=score,
+            new_level=level,
+            matches_json=json.dumps([m.dict() for m in new_matches], ensure_ascii=False),
+        )
+        db.add(alert)
+        alerts.append(alert)
+
+    db.commit()
+    return alerts
+
+
+def source_entity_ids(db: Session, source_id: int, after_entity_id: int = 0) -> List[int]:
+    """Ids das entidades de uma fonte (só as com id > `after_entity_id`)."""
+    return [
+        entity_id
+        for (entity_id,) in db.query(NormalizedEntity.id).filter(
+            NormalizedEntity.source_id == source_id,
+            NormalizedEntity.id > after_entity_id,
+        )
+    ]
+
+
+def rescreen_source(
+    source_id: int, after_entity_id: int = 0, session_factory=SessionLocal
+) -> int:
+    """
+    Re-screening com as entidades de uma fonte acabada de indexar; numa nova
+    versão, só as inseridas (id > `after_entity_id`).
+    """
+    db = session_factory()
+    try:
+        entity_ids = source_entity_ids(db, source_id, after_entity_id)
+        alerts = rescreen_entities(db, entity_ids, source_id=source_id)
+        logger.info(
+            "Re-screening da fonte %s: %s entidades novas, %s alertas",
+            source_id,
+            len(entity_ids),
+            len(alerts),
+        )
+        return len(alerts)
+    finally:
+        db.close()
+
+
+def schedule_rescreen(source_id: int, source_type: str, after_entity_id: int = 0) -> None:
+    """Lança o re-screening em background, se o tipo de fonte o justificar."""
+    if (source_type or "").upper() not in RESCREEN_SOURCE_TYPES:
+        return
+
+    def run() -> None:
+        try:
+            rescreen_source(source_id, after_entity_id)
+        except Exception:
+            logger.exception("Falha no re-screening da fonte %s", source_id)
+
+    threading.Thread(target=run, name=f"rescreen-{source_id}", daemon=True).start()
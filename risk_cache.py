@@ -0,0 +1,246 @@
+# risk_cache.py
+"""
+Cache do resultado de matching + score do /risk/check.
+
+Chave = campos normalizados do pedido (matching.screening_request_key) +
+geração do corpus: qualquer upload, edição ou remoção de fonte muda a
+geração e torna as entradas antigas inalcançáveis.
+
+Dois níveis:
+  - LRU em memória, por processo;
+  - SQLite em disco, partilhado por todos os workers do uvicorn.
+Ambos com TTL e limite de tamanho; contadores de hits/misses por nível.
+O ficheiro SQLite só é aberto (e criado) no primeiro acesso.
+"""
+import json
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from utils import ensure_dir
+
+
+logger = logging.getLogger(__name__)
+
+RISK_CACHE_ENABLED = os.getenv("RISK_CACHE_ENABLED", "1") == "1"
+RISK_CACHE_TTL_SECONDS = float(os.getenv("RISK_CACHE_TTL_SECONDS", "3600"))
+RISK_CACHE_MEMORY_ITEMS = int(os.getenv("RISK_CACHE_MEMORY_ITEMS", "2048"))
+RISK_CACHE_DISK_ITEMS = int(os.getenv("RISK_CACHE_DISK_ITEMS", "100000"))
+# Vazio desactiva o nível em disco.
+RISK_CACHE_PATH = os.getenv("RISK_CACHE_PATH", "data/cache/risk_cache.sqlite3")
+# Um hit só actualiza last_access (uma escrita) se o valor gravado tiver mais
+# do que isto: entradas quentes não escrevem na BD partilhada a cada leitura.
+RISK_CACHE_TOUCH_SECONDS = float(os.getenv("RISK_CACHE_TOUCH_SECONDS", "60"))
+
+
+class MemoryLRU:
+    def __init__(self, max_items: int, ttl: float) -> None:
+        self._items: "OrderedDict[str, tuple]" = OrderedDict()
+        self._max_items = max_items
+        self._ttl = ttl
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._items[key] = (time.monotonic() + self._ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self._max_items:
+                self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class DiskCache:
+    """Tabela SQLite (WAL) com uma ligação por thread."""
+
+    def __init__(
+        self,
+        path: str,
+        max_items: int,
+        ttl: float,
+        touch_seconds: float = RISK_CACHE_TOUCH_SECONDS,
+    ) -> None:
+        ensure_dir(os.path.dirname(path) or ".")
+        self._path = path
+        self._max_items = max_items
+        self._ttl = ttl
+        self._touch_seconds = touch_seconds
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS risk_cache ("
+            " key TEXT PRIMARY KEY,"
+            " generation INTEGER NOT NULL,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_risk_cache_access ON risk_cache(last_access)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        row = self._conn().execute(
+            "SELECT value, expires_at, last_access FROM risk_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or row[1] < now:
+            return None
+        if now - row[2] > self._touch_seconds:
+            self._conn().execute(
+                "UPDATE risk_cache SET last_access = ? WHERE key = ?", (now, key)
+            )
+        return json.loads(row[0])
+
+    def put(self, key: str, generation: int, value: Any) -> None:
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO risk_cache VALUES (?, ?, ?, ?, ?)",
+            (key, generation, json.dumps(value, ensure_ascii=False), now + self._ttl, now),
+        )
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self.evict(generation)
+
+    def evict(self, generation: int) -> None:
+        """Remove gerações antigas, expirados e o excesso (menos usados)."""
+        conn = self._conn()
+        conn.execute(
+            "DELETE FROM risk_cache WHERE generation < ? OR expires_at < ?",
+            (generation, time.time()),
+        )
+        conn.execute(
+            "DELETE FROM risk_cache WHERE key IN ("
+            " SELECT key FROM risk_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (self._max_items,),
+        )
+
+    def clear(self) -> None:
+        self._conn().execute("DELETE FROM risk_cache")
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM risk_cache").fetchone()[0]
+
+
+class RiskResultCache:
+    def __init__(
+        self,
+        enabled: bool = RISK_CACHE_ENABLED,
+        path: str = RISK_CACHE_PATH,
+        memory_items: int = RISK_CACHE_MEMORY_ITEMS,
+        disk_items: int = RISK_CACHE_DISK_ITEMS,
+        ttl: float = RISK_CACHE_TTL_SECONDS,
+    ) -> None:
+        self.enabled = enabled
+        self._memory = MemoryLRU(memory_items, ttl)
+        self._path = path if enabled else ""
+        self._disk_items = disk_items
+        self._ttl = ttl
+        self._disk_cache: Optional[DiskCache] = None
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        self._lock = threading.Lock()
+
+    @property
+    def _disk(self) -> Optional[DiskCache]:
+        """Abre a cache em disco no primeiro uso (None se desactivada ou indisponível)."""
+        if self._disk_cache is None and self._path:
+            with self._lock:
+                if self._disk_cache is None and self._path:
+                    try:
+                        self._disk_cache = DiskCache(self._path, self._disk_items, self._ttl)
+                    except (sqlite3.Error, OSError):
+                        logger.exception("Cache em disco indisponível; só memória")
+                        self._path = ""
+        return self._disk_cache
+
+    @staticmethod
+    def make_key(request_key: tuple, generation: int) -> str:
+        raw = json.dumps([generation, request_key], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def get(self, request_key: tuple, generation: int) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        key = self.make_key(request_key, generation)
+        value = self._memory.get(key)
+        if value is not None:
+            self._count("memory_hits")
+            return value
+        if self._disk is not None:
+            try:
+                value = self._disk.get(key)
+            except sqlite3.Error:
+                logger.warning("Falha a ler a cache em disco", exc_info=True)
+                value = None
+            if value is not None:
+                self._memory.put(key, value)
+                self._count("disk_hits")
+                return value
+        self._count("misses")
+        return None
+
+    def put(self, request_key: tuple, generation: int, value: Any) -> None:
+        if not self.enabled:
+            return
+        key = self.make_key(request_key, generation)
+        self._memory.put(key, value)
+        if self._disk is not None:
+            try:
+                self._disk.put(key, generation, value)
+            except sqlite3.Error:
+                logger.warning("Falha a escrever na cache em disco", exc_info=True)
+
+    def clear(self) -> None:
+        self._memory.clear()
+        if self._disk is not None:
+            self._disk.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._counters)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = (
+            round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 3) if lookups else None
+        )
+        stats["memory_items"] = len(self._memory)
+        stats["disk_items"] = len(self._disk) if self._disk is not None else None
+        stats["enabled"] = self.enabled
+        return stats
+
+
+risk_cache = RiskResultCache()
@@ -0,0 +1,213 @@
+# risk_jobs.py
+"""
+Screening assíncrono de carteiras de clientes (100k+ linhas).
+
+Cada job lê o ficheiro do cliente linha a linha, aplica a mesma lógica do
+/risk/check (find_matches + compute_risk_from_matches) e escreve uma linha
+NDJSON por cliente. A cada RISK_JOBS_CHECKPOINT_ROWS linhas os resultados
+são sincronizados para disco e o progresso gravado na BD (checkpoint).
+Um job interrompido (reinício, crash) é retomado a partir do último
+checkpoint: o ficheiro de resultados é truncado para o tamanho gravado e
+as linhas já tratadas são saltadas.
+
+Fila, claim, retoma e heartbeat: ver db_jobs.DbJobRunner. O heartbeat é
+gravado por uma thread a cada RISK_JOBS_HEARTBEAT_SECONDS, e não só a cada
+checkpoint: um bloco lento (corpus grande) não faz o job parecer
+interrompido, e um segundo worker não o retoma e reescreve o mesmo ficheiro
+de resultados.
+"""
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from itertools import islice
+from typing import Iterator, Optional
+
+from database import SessionLocal
+from db_jobs import DbJobRunner, job_rows_per_second
+from matching import compute_risk_from_matches, find_matches, screening_request_key
+from models import ScreeningJob
+from schemas import RiskCheckRequest
+from screening import screening
+from tabular import guess_mapping, iter_tabular_rows, read_tabular_headers
+from utils import ensure_dir
+
+
+logger = logging.getLogger(__name__)
+
+JOBS_DIR = "data/jobs"
+RISK_JOBS_WORKERS = int(os.getenv("RISK_JOBS_WORKERS", "2"))
+RISK_JOBS_CHECKPOINT_ROWS = int(os.getenv("RISK_JOBS_CHECKPOINT_ROWS", "500"))
+# Um job RUNNING sem heartbeat há mais do que isto é dado como interrompido.
+RISK_JOBS_STALE_SECONDS = int(os.getenv("RISK_JOBS_STALE_SECONDS", "120"))
+RISK_JOBS_HEARTBEAT_SECONDS = float(os.getenv("RISK_JOBS_HEARTBEAT_SECONDS", "15"))
+# Intervalo de polling do stream de resultados enquanto o job corre.
+RESULTS_POLL_SECONDS = 0.5
+
+FINISHED_STATUSES = ("DONE", "FAILED")
+
+
+def job_mapping(job: ScreeningJob) -> dict:
+    if job.mapping_json:
+        return json.loads(job.mapping_json)
+    ext = os.path.splitext(job.file_path)[1]
+    return guess_mapping(read_tabular_headers(job.file_path, ext))
+
+
+def row_to_request(row: dict, mapping: dict) -> RiskCheckRequest:
+    def value(field: str) -> Optional[str]:
+        column = mapping.get(field)
+        return (row.get(column) or "").strip() or None if column else None
+
+    return RiskCheckRequest(
+        full_name=value("name") or "",
+        nif=value("nif"),
+        passport=value("passport"),
+        residence_card=value("residence_card"),
+    )
+
+
+def rows_per_second(job: ScreeningJob) -> Optional[float]:
+    """Débito da execução actual (desde o arranque ou a última retoma)."""
+    return job_rows_per_second(job, (job.rows_done or 0) - (job.resumed_from_row or 0))
+
+
+class ScreeningJobRunner(DbJobRunner):
+    """
+    Pool de workers (threads) que executa os jobs pendentes. Ao parar, os
+    jobs em curso gravam checkpoint e voltam a PENDING.
+    """
+
+    model = ScreeningJob
+    label = "risk"
+
+    def __init__(self, session_factory=SessionLocal, workers: int = RISK_JOBS_WORKERS):
+        super().__init__(
+            session_factory,
+            workers,
+            stale_seconds=RISK_JOBS_STALE_SECONDS,
+            heartbeat_seconds=RISK_JOBS_HEARTBEAT_SECONDS,
+            sweep_seconds=RISK_JOBS_STALE_SECONDS / 2,
+        )
+
+    def start(self) -> None:
+        ensure_dir(JOBS_DIR)
+        super().start()
+
+    def _claim_values(self) -> dict:
+        return {ScreeningJob.resumed_from_row: ScreeningJob.rows_done}
+
+    def _process(self, db, job: ScreeningJob) -> None:
+        ext = os.path.splitext(job.file_path)[1]
+        mapping = job_mapping(job)
+        if "name" not in mapping:
+            raise ValueError("Não foi possível identificar a coluna do nome.")
+
+        if job.total_rows is None:
+            job.total_rows = sum(1 for _ in iter_tabular_rows(job.file_path, ext))
+            db.commit()
+
+        # descartar o que foi escrito depois do último checkpoint
+        with open(job.results_path, "ab") as out:
+            out.truncate(job.results_bytes or 0)
+
+        rows = islice(iter_tabular_rows(job.file_path, ext), job.rows_done or 0, None)
+        position = job.rows_done or 0
+        with open(job.results_path, "ab") as out:
+            while True:
+                chunk = list(islice(rows, RISK_JOBS_CHECKPOINT_ROWS))
+                if not chunk:
+                    break
+                lines, matched = self._screen_chunk(chunk, mapping, position)
+                out.write("".join(lines).encode("utf-8"))
+                out.flush()
+                os.fsync(out.fileno())
+
+                position += len(chunk)
+                job.rows_done = position
+                job.rows_matched = (job.rows_matched or 0) + matched
+                job.results_bytes = out.tell()
+                job.heartbeat_at = datetime.utcnow()
+                if self._stop.is_set():
+                    job.status = "PENDING"
+                    db.commit()
+                    return
+                db.commit()
+
+        job.status = "DONE"
+        job.finished_at = datetime.utcnow()
+        db.commit()
+
+    def _screen_chunk(self, chunk, mapping: dict, offset: int):
+        snapshot = screening.current
+        cache = {}
+        lines = []
+        matched = 0
+        for i, row in enumerate(chunk, start=offset + 1):
+            req = row_to_request(row, mapping)
+            result = {
+                "row": i,
+                "full_name": req.full_name,
+                "nif": req.nif,
+                "passport": req.passport,
+                "residence_card": req.residence_card,
+            }
+            if not any([req.full_name, req.nif, req.passport, req.residence_card]):
+                result["error"] = "Linha sem nome nem identificadores"
+            else:
+                key = screening_request_key(req)
+                if key not in cache:
+                    matches = find_matches(req, snapshot)
+                    cache[key] = (matches, compute_risk_from_matches(req, matches))
+                matches, (score, level, is_pep, has_sanctions, factors) = cache[key]
+                matched += bool(matches)
+                result.update(
+                    risk_score=score,
+                    risk_level=level,
+                    is_pep=is_pep,
+                    has_sanctions=has_sanctions,
+                    matches=[m.dict() for m in matches],
+                    factors=[f.dict() for f in factors],
+                )
+            lines.append(json.dumps(result, ensure_ascii=False) + "\n")
+        return lines, matched
+
+
+def follow_results(job_id: int, session_factory=SessionLocal) -> Iterator[bytes]:
+    """
+    Stream NDJSON dos resultados, incluindo os de um job ainda a correr:
+    envia o que já está confirmado por checkpoint e espera por mais até o
+    job terminar.
+    """
+    sent = 0
+    while True:
+        db = session_factory()
+        try:
+            job = db.query(ScreeningJob).filter(ScreeningJob.id == job_id).first()
+            if job is None:
+                return
+            available = job.results_bytes or 0
+            finished = job.status in FINISHED_STATUSES
+            path = job.results_path
+        finally:
+            db.close()
+
+        if available > sent:
+            with open(path, "rb") as f:
+                f.seek(sent)
+                remaining = available - sent
+                while remaining > 0:
+                    block = f.read(min(64 * 1024, remaining))
+                    if not block:
+                        break
+                    remaining -= len(block)
+                    sent += len(block)
+                    yield block
+        elif finished:
+            return
+        else:
+            time.sleep(RESULTS_POLL_SECONDS)
+
+
+job_runner = ScreeningJobRunner()
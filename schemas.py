@@ -107,6 +107,57 @@ class RiskDecisionUpdate(BaseModel):
     )
 
 
+class ScreeningJobRead(BaseModel):
+    id: int
+    status: str
+    total_rows: Optional[int]
+    rows_done: int
+    rows_matched: int
+    rows_per_second: Optional[float] = None
+    error: Optional[str]
+    created_at: datetime
+    started_at: Optional[datetime]
+    finished_at: Optional[datetime]
+
+    class Config:
+        orm_mode = True
+
+
+class IngestionJobRead(BaseModel):
+    id: int
+    source_id: Optional[int]
+    kind: str
+    status: str
+    stage: str
+    ingest_status: Optional[str]
+    rows_processed: int
+    rows_added: int
+    rows_removed: int
+    rows_unchanged: int
+    rows_per_second: Optional[float] = None
+    error: Optional[str]
+    warnings: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime]
+    finished_at: Optional[datetime]
+
+    class Config:
+        orm_mode = True
+
+
+class RiskAlertRead(BaseModel):
+    id: int
+    risk_record_id: int
+    source_id: Optional[int]
+    previous_score: int
+    previous_level: str
+    new_score: int
+    new_level: str
+    matches: List[Match]
+    status: str
+    created_at: datetime
+
+
 # ---------- Info Sources ----------
 
 class InfoSourceRead(BaseModel):
@@ -115,12 +166,29 @@ class InfoSourceRead(BaseModel):
     source_type: str
     description: str
     num_records: int
+    file_size: Optional[int] = None
+    content_sha256: Optional[str] = None
+    url: Optional[str] = None
+    refresh_interval_minutes: Optional[int] = None
+    next_refresh_at: Optional[datetime] = None
     created_at: datetime
 
     class Config:
         orm_mode = True
 
 
+class InfoSourceIngestRead(InfoSourceRead):
+    """
+    Fonte + estado da ingestão: PENDING (em fila, ver job_id) ou, já
+    concluída, CREATED / UPDATED / UNCHANGED.
+    """
+    ingest_status: str
+    job_id: Optional[int] = None
+    rows_added: int = 0
+    rows_removed: int = 0
+    rows_unchanged: int = 0
+
+
 # ---------- Audit Logs ----------
 
 class AuditLogRead(BaseModel):
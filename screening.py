@@ -0,0 +1,408 @@
+# screening.py
+"""
+Snapshot em memória, só de leitura, do corpus de screening (entidades +
+metadados das fontes), marcado com um número de geração.
+
+O find_matches lê apenas do snapshot: sem queries nem locks do SQLite no
+caminho quente. Uploads, edições e remoções de fontes incrementam a geração
+persistida (tabela corpus_state); uma thread de fundo reconstrói o snapshot
+e troca-o de forma atómica (simples atribuição de referência). Os índices
+estão em segmentos por fonte: a reconstrução só relê as fontes cujas
+entidades mudaram (InfoSource.entities_generation) e partilha as restantes
+com o snapshot anterior. A mesma
+thread verifica periodicamente a geração na BD, para apanhar alterações
+feitas por outros workers do uvicorn.
+"""
+import logging
+import os
+import threading
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import CorpusState, EntityIdentifier, InfoSource, NormalizedEntity
+from name_index import TrigramIndex
+
+
+logger = logging.getLogger(__name__)
+
+# Intervalo (segundos) entre verificações da geração na BD.
+SNAPSHOT_POLL_SECONDS = float(os.getenv("SCREENING_SNAPSHOT_POLL_SECONDS", "5"))
+
+
+class EntityRecord(NamedTuple):
+    id: int
+    source_id: int
+    person_name: Optional[str]
+    person_nif: Optional[str]
+    person_passport: Optional[str]
+    residence_card: Optional[str]
+    role: Optional[str]
+    country: Optional[str]
+    name_key: Optional[str]
+    name_phonetic: Optional[str]
+
+
+class SourceRecord(NamedTuple):
+    id: int
+    name: str
+    source_type: str
+
+
+# -------------------------------------------------
+# GERAÇÃO DO CORPUS
+# -------------------------------------------------
+def read_generation(db: Session) -> int:
+    state = db.query(CorpusState.generation).filter(CorpusState.id == 1).first()
+    return state[0] if state else 0
+
+
+def bump_generation(db: Session, source_id: Optional[int] = None) -> int:
+    """
+    Incrementa (atomicamente) a geração persistida e devolve o novo valor.
+    Com `source_id`, as entidades dessa fonte ficam marcadas com a nova
+    geração (o snapshot recarrega só essa fonte).
+    """
+    updated = (
+        db.query(CorpusState)
+        .filter(CorpusState.id == 1)
+        .update({CorpusState.generation: CorpusState.generation + 1})
+    )
+    if not updated:
+        db.add(CorpusState(id=1, generation=1))
+    generation = read_generation(db)
+    if source_id is not None:
+        db.query(InfoSource).filter(InfoSource.id == source_id).update(
+            {InfoSource.entities_generation: generation}, synchronize_session=False
+        )
+    db.commit()
+    return generation
+
+
+# -------------------------------------------------
+# SNAPSHOT
+# -------------------------------------------------
+class SourceSegment:
+    """
+    Entidades de uma fonte e os seus índices, na versão `version`
+    (InfoSource.entities_generation). Imutável depois de construído: snapshots
+    sucessivos partilham os segmentos das fontes que não mudaram.
+    """
+
+    def __init__(self, version: int = 0) -> None:
+        self.version = version
+        self.entities: Dict[int, EntityRecord] = {}
+        self.name_index = TrigramIndex()
+        self.by_name_key: Dict[str, List[int]] = defaultdict(list)
+        self.by_phonetic: Dict[str, List[int]] = defaultdict(list)
+        self.by_identifier: Dict[Tuple[str, str], List[int]] = defaultdict(list)
+
+    def add(self, entity: EntityRecord) -> None:
+        self.entities[entity.id] = entity
+        self.name_index.add(entity.id, entity.person_name)
+        if entity.name_key:
+            self.by_name_key[entity.name_key].append(entity.id)
+        if entity.name_phonetic:
+            self.by_phonetic[entity.name_phonetic].append(entity.id)
+
+
+def _chunks(ids: Sequence[int], size: int = 500) -> List[List[int]]:
+    ids = list(ids)
+    return [ids[i : i + size] for i in range(0, len(ids), size)]
+
+
+def load_segments(
+    db: Session,
+    versions: Dict[int, int],
+    source_ids: Optional[Sequence[int]] = None,
+    entity_ids: Optional[Sequence[int]] = None,
+) -> Dict[int, SourceSegment]:
+    """
+    Segmentos (por fonte) de todo o corpus, só das fontes `source_ids` ou só
+    das entidades `entity_ids`.
+    """
+    columns = [getattr(NormalizedEntity, f) for f in EntityRecord._fields]
+    identifier_query = db.query(
+        EntityIdentifier.kind,
+        EntityIdentifier.value,
+        EntityIdentifier.entity_id,
+        NormalizedEntity.source_id,
+    ).join(NormalizedEntity, NormalizedEntity.id == EntityIdentifier.entity_id)
+
+    if entity_ids is not None:
+        chunks = _chunks(entity_ids)
+        entity_queries = [db.query(*columns).filter(NormalizedEntity.id.in_(c)) for c in chunks]
+        identifier_queries = [
+            identifier_query.filter(EntityIdentifier.entity_id.in_(c)) for c in chunks
+        ]
+    elif source_ids is not None:
+        chunks = _chunks(source_ids)
+        entity_queries = [
+            db.query(*columns).filter(NormalizedEntity.source_id.in_(c)) for c in chunks
+        ]
+        identifier_queries = [
+            identifier_query.filter(NormalizedEntity.source_id.in_(c)) for c in chunks
+        ]
+    else:
+        entity_queries = [db.query(*columns)]
+        identifier_queries = [identifier_query]
+
+    # as fontes pedidas sem entidades também têm segmento (vazio): não voltam
+    # a ser lidas na próxima reconstrução
+    if entity_ids is not None:
+        requested: Iterable[int] = ()
+    else:
+        requested = versions if source_ids is None else source_ids
+    segments = {
+        source_id: SourceSegment(versions.get(source_id, 0)) for source_id in requested
+    }
+
+    def segment(source_id: int) -> SourceSegment:
+        if source_id not in segments:
+            segments[source_id] = SourceSegment(versions.get(source_id, 0))
+        return segments[source_id]
+
+    for query in entity_queries:
+        for row in query.yield_per(5000):
+            entity = EntityRecord(*row)
+            segment(entity.source_id).add(entity)
+    for query in identifier_queries:
+        for kind, value, entity_id, source_id in query.yield_per(5000):
+            segment(source_id).by_identifier[(kind, value)].append(entity_id)
+    return segments
+
+
+class ScreeningSnapshot:
+    """
+    Estrutura imutável depois de construída; partilhada entre threads.
+    Os índices estão nos segmentos de cada fonte; `entities` junta as
+    entidades de todos, para acesso por id.
+    """
+
+    def __init__(
+        self,
+        generation: int = 0,
+        sources: Optional[Dict[int, SourceRecord]] = None,
+        segments: Optional[Dict[int, SourceSegment]] = None,
+    ) -> None:
+        self.generation = generation
+        self.sources: Dict[int, SourceRecord] = sources or {}
+        self.segments: Dict[int, SourceSegment] = segments or {}
+        self.entities: Dict[int, EntityRecord] = {}
+        for segment in self.segments.values():
+            self.entities.update(segment.entities)
+
+    def __len__(self) -> int:
+        return len(self.entities)
+
+    @classmethod
+    def build(
+        cls,
+        db: Session,
+        entity_ids: Optional[Sequence[int]] = None,
+        previous: Optional["ScreeningSnapshot"] = None,
+    ) -> "ScreeningSnapshot":
+        """
+        Snapshot de todo o corpus ou, com `entity_ids`, só dessas entidades
+        (delta de um ingest, usado no re-screening da carteira). Com
+        `previous`, os segmentos das fontes cujas entidades não mudaram são
+        reaproveitados: uma edição de metadados não relê entidades e uma nova
+        versão de uma fonte só relê essa fonte.
+        """
+        # a geração e as versões lêem-se antes dos dados: se mudarem a meio,
+        # a próxima verificação volta a ler as fontes afectadas
+        generation = read_generation(db)
+        sources: Dict[int, SourceRecord] = {}
+        versions: Dict[int, int] = {}
+        for row in db.query(
+            InfoSource.id,
+            InfoSource.name,
+            InfoSource.source_type,
+            InfoSource.entities_generation,
+        ):
+            sources[row.id] = SourceRecord(row.id, row.name, row.source_type)
+            versions[row.id] = row.entities_generation or 0
+
+        if entity_ids is not None:
+            return cls(generation, sources, load_segments(db, versions, entity_ids=entity_ids))
+
+        segments: Dict[int, SourceSegment] = {}
+        stale: List[int] = []
+        for source_id, version in versions.items():
+            segment = previous.segments.get(source_id) if previous else None
+            if segment is not None and segment.version == version:
+                segments[source_id] = segment
+            else:
+                stale.append(source_id)
+        if stale:
+            segments.update(
+                load_segments(db, versions, source_ids=None if not segments else stale)
+            )
+        return cls(generation, sources, segments)
+
+    def ids_for_identifiers(self, identifiers: Iterable[Tuple[str, str]]) -> List[int]:
+        return _unique(
+            eid
+            for pair in identifiers
+            for segment in self.segments.values()
+            for eid in segment.by_identifier.get(pair, ())
+        )
+
+    def ids_for_name(
+        self,
+        name: str,
+        query_key: Optional[str],
+        query_phonetic: Optional[str],
+        top_k: Callable[[str], int],
+        token_ranked: Iterable[int] = (),
+    ) -> List[int]:
+        """
+        Candidatos por nome, em cada tipo de fonte:
+          - igualdade no name_key: entram sempre (são matches com score 1.0);
+          - igualdade na chave fonética: os `top_k(source_type)` com melhor
+            pré-score de trigramas (um nome comum tem milhares);
+          - os `top_k(source_type)` melhores do índice de trigramas (por
+            pré-score) e de `token_ranked` (ids do índice FTS, por bm25; os
+            que não estão neste snapshot são ignorados).
+        """
+        segments = list(self.segments.values())
+        exact = [
+            entity_id
+            for segment in segments
+            for entity_id in segment.by_name_key.get(query_key, ())
+        ] if query_key else []
+        scored = [
+            item for segment in segments for item in segment.name_index.search_scored(name)
+        ]
+        scored.sort(key=lambda item: -item[1])
+        fuzzy = self._top_k_by_source_type((entity_id for entity_id, _ in scored), top_k)
+        phonetic: List[int] = []
+        if query_phonetic:
+            prescore = dict(scored)
+            members = [
+                entity_id
+                for segment in segments
+                for entity_id in segment.by_phonetic.get(query_phonetic, ())
+            ]
+            # fora do índice de trigramas (pouca sobreposição) ficam no fim
+            members.sort(key=lambda entity_id: -prescore.get(entity_id, 0.0))
+            phonetic = self._top_k_by_source_type(members, top_k)
+        tokens = self._top_k_by_source_type(
+            (entity_id for entity_id in token_ranked if entity_id in self.entities), top_k
+        )
+        return _unique(exact + phonetic + fuzzy + tokens)
+
+    def _top_k_by_source_type(
+        self, ranked: Iterable[int], top_k: Callable[[str], int]
+    ) -> List[int]:
+        taken: Dict[str, int] = defaultdict(int)
+        selected: List[int] = []
+        for entity_id in ranked:
+            source = self.sources.get(self.entities[entity_id].source_id)
+            if source is None:
+                continue
+            if taken[source.source_type] >= top_k(source.source_type):
+                continue
+            taken[source.source_type] += 1
+            selected.append(entity_id)
+        return selected
+
+
+def _unique(ids: Iterable[int]) -> List[int]:
+    return list(dict.fromkeys(ids))
+
+
+# -------------------------------------------------
+# GESTÃO DO SNAPSHOT (reconstrução em background)
+# -------------------------------------------------
+class SnapshotManager:
+    def __init__(self, session_factory=SessionLocal, poll_seconds: float = SNAPSHOT_POLL_SECONDS):
+        self._session_factory = session_factory
+        self._poll_seconds = poll_seconds
+        self._snapshot = ScreeningSnapshot()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def current(self) -> ScreeningSnapshot:
+        return self._snapshot
+
+    @property
+    def generation(self) -> int:
+        return self._snapshot.generation
+
+    def refresh(self) -> ScreeningSnapshot:
+        """
+        Reconstrói o snapshot (síncrono), relendo só as fontes que mudaram,
+        e troca-o pelo actual.
+        """
+        previous = self._snapshot
+        db = self._session_factory()
+        try:
+            snapshot = ScreeningSnapshot.build(db, previous=previous)
+        finally:
+            db.close()
+        self._snapshot = snapshot
+        reloaded = sum(
+            1
+            for source_id, segment in snapshot.segments.items()
+            if previous.segments.get(source_id) is not segment
+        )
+        logger.info(
+            "Snapshot de screening g%s: %s entidades (%s/%s fontes relidas)",
+            snapshot.generation,
+            len(snapshot),
+            reloaded,
+            len(snapshot.segments),
+        )
+        return snapshot
+
+    def start(self) -> None:
+        self.refresh()
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="screening-snapshot", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def mark_changed(self, db: Session, source_id: Optional[int] = None) -> int:
+        """
+        Chamado depois de alterar o corpus: nova geração + rebuild em
+        background. `source_id` é a fonte cujas entidades mudaram (sem ela,
+        ex.: edição de metadados ou fonte apagada, nenhuma fonte é relida).
+        """
+        generation = bump_generation(db, source_id)
+        self._wakeup.set()
+        return generation
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wakeup.wait(self._poll_seconds)
+            self._wakeup.clear()
+            if self._stop.is_set():
+                break
+            try:
+                db = self._session_factory()
+                try:
+                    stale = read_generation(db) != self._snapshot.generation
+                finally:
+                    db.close()
+                if stale:
+                    self.refresh()
+            except Exception:
+                logger.exception("Falha a reconstruir o snapshot de screening")
+
+
+screening = SnapshotManager()
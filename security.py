@@ -2,18 +2,23 @@
 import os
 import hmac
 import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Dict, NamedTuple, Optional, Set, Tuple
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from sqlalchemy.orm import Session
 
 from database import SessionLocal
 from models import User
 
 
+logger = logging.getLogger(__name__)
+
 # -------------------------------------------------
 # CONFIGURAÇÃO JWT E HASH
 # -------------------------------------------------
@@ -23,6 +28,12 @@ ACCESS_TOKEN_EXPIRE_HOURS = 12
 
 PASSWORD_SALT = os.getenv("PASSWORD_SALT", "cir-dev-salt")
 
+# Cache token -> utilizador (ver PrincipalCache)
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+AUTH_CACHE_MAX_TOKENS = int(os.getenv("AUTH_CACHE_MAX_TOKENS", "10000"))
+# Intervalo (segundos) entre leituras de users.auth_version (ver PrincipalCache)
+AUTH_CACHE_POLL_SECONDS = float(os.getenv("AUTH_CACHE_POLL_SECONDS", "2"))
+
 
 # -------------------------------------------------
 # DB
@@ -59,6 +70,9 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
+    # o "sub" de um JWT é uma string (o jose rejeita inteiros no decode)
+    if "sub" in to_encode:
+        to_encode["sub"] = str(to_encode["sub"])
     expire = datetime.utcnow() + (expires_delta or timedelta(hours=ACCESS_TOKEN_EXPIRE_HOURS))
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
@@ -68,10 +82,150 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
 # -------------------------------------------------
 # UTILIZADOR AUTENTICADO
 # -------------------------------------------------
-def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db),
-) -> User:
+class Principal(NamedTuple):
+    """O que os endpoints precisam do utilizador autenticado."""
+    id: int
+    username: str
+    is_admin: bool
+    is_active: bool
+
+
+def bump_auth_version(user: User) -> None:
+    """Chamar ao alterar o estado ou a password (gravado no mesmo commit)."""
+    user.auth_version = (user.auth_version or 0) + 1
+
+
+class PrincipalCache:
+    """
+    Tokens já verificados -> Principal, com TTL (AUTH_CACHE_TTL_SECONDS,
+    nunca para além da expiração do token) e no máximo `max_tokens`
+    entradas (sai a usada há mais tempo). Um pedido com um token em cache
+    não faz jwt.decode nem SELECT.
+
+    Cada entrada guarda o users.auth_version lido na verificação. Quem altera
+    um utilizador incrementa-o (bump_auth_version) e chama invalidate_user;
+    nos outros processos, uma thread lê (id, auth_version) de todos os
+    utilizadores a cada AUTH_CACHE_POLL_SECONDS e descarta os tokens com
+    versão antiga (tabela pequena: uma query barata, fora dos pedidos).
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = AUTH_CACHE_TTL_SECONDS,
+        max_tokens: int = AUTH_CACHE_MAX_TOKENS,
+        session_factory=SessionLocal,
+        poll_seconds: float = AUTH_CACHE_POLL_SECONDS,
+    ) -> None:
+        self._ttl = ttl_seconds
+        self._max_tokens = max_tokens
+        self._session_factory = session_factory
+        self._poll_seconds = poll_seconds
+        self._entries: "OrderedDict[str, Tuple[Principal, float, int]]" = OrderedDict()
+        self._by_user: Dict[int, Set[str]] = {}
+        # últimas versões lidas pela thread de polling
+        self._versions: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def get(self, token: str) -> Optional[Principal]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            principal, expires_at, _ = entry
+            if expires_at <= time.monotonic():
+                self._discard(token)
+                return None
+            self._entries.move_to_end(token)
+            return principal
+
+    def put(
+        self,
+        token: str,
+        principal: Principal,
+        token_exp: Optional[float],
+        auth_version: int = 0,
+    ) -> None:
+        if self._ttl <= 0 or self._max_tokens <= 0:
+            return
+        expires_at = time.monotonic() + self._ttl
+        if token_exp is not None:
+            expires_at = min(expires_at, time.monotonic() + (token_exp - time.time()))
+        with self._lock:
+            if self._versions.get(principal.id, auth_version) > auth_version:
+                return  # o utilizador mudou depois de lido
+            self._discard(token)
+            self._entries[token] = (principal, expires_at, auth_version)
+            self._by_user.setdefault(principal.id, set()).add(token)
+            while len(self._entries) > self._max_tokens:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self._lock:
+            for token in list(self._by_user.get(user_id, ())):
+                self._discard(token)
+
+    def apply_versions(self, versions: Dict[int, int]) -> None:
+        """Descarta os tokens de utilizadores alterados (ou apagados)."""
+        with self._lock:
+            self._versions = versions
+            for user_id, tokens in list(self._by_user.items()):
+                current = versions.get(user_id)
+                for token in list(tokens):
+                    if self._entries[token][2] != current:
+                        self._discard(token)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    def start(self) -> None:
+        if self._ttl <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="auth-cache-poll", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._poll_seconds):
+            try:
+                db = self._session_factory()
+                try:
+                    versions = {
+                        user_id: version or 0
+                        for user_id, version in db.query(User.id, User.auth_version)
+                    }
+                finally:
+                    db.close()
+                self.apply_versions(versions)
+            except Exception:
+                logger.exception("Falha a ler as versões dos utilizadores")
+
+    def _discard(self, token: str) -> None:
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        tokens = self._by_user.get(entry[0].id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._by_user[entry[0].id]
+
+
+principal_cache = PrincipalCache()
+
+
+def get_current_user(token: str = Depends(oauth2_scheme)) -> Principal:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Token inválido ou não fornecido",
@@ -80,6 +234,10 @@ def get_current_user(
     if not token:
         raise credentials_exception
 
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         sub = payload.get("sub")
@@ -94,14 +252,21 @@ def get_current_user(
     except (TypeError, ValueError):
         raise credentials_exception
 
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user or not user.is_active:
-        raise credentials_exception
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.id == user_id).first()
+        if not user or not user.is_active:
+            raise credentials_exception
+        principal = Principal(user.id, user.username, user.is_admin, user.is_active)
+        auth_version = user.auth_version or 0
+    finally:
+        db.close()
 
-    return user
+    principal_cache.put(token, principal, payload.get("exp"), auth_version)
+    return principal
 
 
-def get_current_admin(current_user: User = Depends(get_current_user)) -> User:
+def get_current_admin(current_user: Principal = Depends(get_current_user)) -> Principal:
     if not current_user.is_admin:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
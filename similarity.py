@@ -0,0 +1,272 @@
+# similarity.py
+"""
+Similaridade de nomes para screening (substitui difflib.SequenceMatcher).
+
+O score compara tokens (sem acentos e sem partículas "da/dos/de"): cada
+token de um nome é emparelhado com o token mais parecido do outro nome por
+Jaro-Winkler, e pares abaixo de TOKEN_MATCH_THRESHOLD contam zero.
+O resultado é a média simétrica desses máximos:
+
+    score = (soma_melhores(A->B) + soma_melhores(B->A)) / (|A| + |B|)
+
+Assim a ordem dos nomes não pesa, erros de escrita num token perdem pouco
+("Lorenco"/"Lourenço") e nomes que só partilham um apelido ficam abaixo do
+limiar, ao contrário de um token-set ratio (que daria 1.0 a "Santos"
+contra "José Eduardo dos Santos").
+"""
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence
+
+from normalization import name_key
+
+try:
+    import numpy as np
+except ImportError:  # o caminho escalar continua a funcionar sem numpy
+    np = None
+
+
+# Limiar usado pelo find_matches quando não há identificadores.
+NAME_MATCH_THRESHOLD = 0.6
+# Abaixo disto dois tokens são considerados diferentes.
+TOKEN_MATCH_THRESHOLD = 0.8
+
+WINKLER_PREFIX_WEIGHT = 0.1
+WINKLER_MAX_PREFIX = 4
+
+
+def jaro_upper_bound(len_a: int, len_b: int) -> float:
+    """
+    Máximo Jaro-Winkler possível só pelos comprimentos: no melhor caso
+    todos os caracteres da string curta coincidem, sem transposições,
+    e o prefixo comum é máximo.
+    """
+    if not len_a or not len_b:
+        return 0.0
+    short, long_ = sorted((len_a, len_b))
+    jaro = (2.0 + short / long_) / 3.0
+    prefix = min(WINKLER_MAX_PREFIX, short)
+    return jaro + prefix * WINKLER_PREFIX_WEIGHT * (1.0 - jaro)
+
+
+def jaro_winkler(a: str, b: str, threshold: float = 0.0) -> float:
+    """
+    Jaro-Winkler clássico. Devolve 0.0 sem comparar caracteres quando o
+    limite superior pelos comprimentos não chega a `threshold`.
+    """
+    la, lb = len(a), len(b)
+    if not la or not lb:
+        return 0.0
+    if a == b:
+        return 1.0
+    if jaro_upper_bound(la, lb) < threshold:
+        return 0.0
+
+    window = max(0, max(la, lb) // 2 - 1)
+    b_free = list(b)  # posições já emparelhadas passam a None
+    a_matched: List[str] = []
+    for i, ch in enumerate(a):
+        try:
+            j = b_free.index(ch, max(0, i - window), min(lb, i + window + 1))
+        except ValueError:
+            continue
+        b_free[j] = None
+        a_matched.append(ch)
+
+    m = len(a_matched)
+    if not m:
+        return 0.0
+    b_matched = [c for c, free in zip(b, b_free) if free is None]
+    transpositions = sum(x != y for x, y in zip(a_matched, b_matched)) / 2.0
+    jaro = (m / la + m / lb + (m - transpositions) / m) / 3.0
+
+    prefix = 0
+    for x, y in zip(a[:WINKLER_MAX_PREFIX], b[:WINKLER_MAX_PREFIX]):
+        if x != y:
+            break
+        prefix += 1
+    return jaro + prefix * WINKLER_PREFIX_WEIGHT * (1.0 - jaro)
+
+
+@lru_cache(maxsize=65536)
+def token_similarity(a: str, b: str) -> float:
+    """Jaro-Winkler entre tokens, a zero abaixo de TOKEN_MATCH_THRESHOLD."""
+    score = jaro_winkler(a, b, TOKEN_MATCH_THRESHOLD)
+    return score if score >= TOKEN_MATCH_THRESHOLD else 0.0
+
+
+def _tokens(name: Optional[str], key: Optional[str] = None) -> List[str]:
+    return (key if key is not None else name_key(name) or "").split()
+
+
+def name_similarity(
+    a: Optional[str],
+    b: Optional[str],
+    threshold: float = 0.0,
+    b_key: Optional[str] = None,
+) -> float:
+    """
+    Similaridade entre dois nomes em [0, 1] (ver docstring do módulo).
+    `b_key` permite passar o name_key já calculado no ingest.
+
+    Sai cedo (devolve 0.0) quando nem com todos os tokens restantes
+    perfeitos o score chegaria a `threshold`.
+    """
+    ta, tb = _tokens(a), _tokens(b, b_key)
+    total = len(ta) + len(tb)
+    if not total or not ta or not tb:
+        return 0.0
+
+    best_b = [0.0] * len(tb)
+    acc_a = 0.0
+    for i, t in enumerate(ta):
+        best = 0.0
+        for j, u in enumerate(tb):
+            s = token_similarity(t, u)
+            if s > best:
+                best = s
+            if s > best_b[j]:
+                best_b[j] = s
+        acc_a += best
+        # limite superior: tokens de A por ver perfeitos + todos os de B
+        if (acc_a + (len(ta) - i - 1) + len(tb)) / total < threshold:
+            return 0.0
+    score = (acc_a + sum(best_b)) / total
+    return score if score >= threshold else 0.0
+
+
+# ---------------------- Caminho vectorizado (numpy) ----------------------
+
+
+def _encode(strings: Sequence[str]):
+    """Matriz (n, max_len) de code points, com -1 como padding."""
+    lengths = np.fromiter((len(s) for s in strings), dtype=np.int64, count=len(strings))
+    width = int(lengths.max()) if len(strings) else 0
+    out = np.full((len(strings), max(width, 1)), -1, dtype=np.int32)
+    for row, s in enumerate(strings):
+        if s:
+            out[row, : len(s)] = np.frombuffer(s.encode("utf-32-le"), dtype=np.int32)
+    return out, lengths
+
+
+def _jaro_winkler_many(query: str, B, lb, threshold: float):
+    """
+    Jaro-Winkler de uma string contra N strings já codificadas (_encode).
+    O ciclo é sobre os caracteres da query (tokens curtos); cada passo
+    trata as N strings de uma vez com operações de matriz.
+    """
+    n = B.shape[0]
+    scores = np.zeros(n, dtype=np.float64)
+    la = len(query)
+    if not la or not n:
+        return scores
+
+    short = np.minimum(la, lb)
+    long_ = np.maximum(la, lb)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        jaro_ub = (2.0 + short / long_) / 3.0
+    upper = jaro_ub + np.minimum(WINKLER_MAX_PREFIX, short) * WINKLER_PREFIX_WEIGHT * (1.0 - jaro_ub)
+    alive = np.flatnonzero((lb > 0) & (upper >= threshold))
+    if not alive.size:
+        return scores
+
+    B, lb = B[alive], lb[alive]
+    rows = np.arange(alive.size)
+    cols = np.arange(B.shape[1])
+    window = np.maximum(0, np.maximum(la, lb) // 2 - 1)
+    A = np.frombuffer(query.encode("utf-32-le"), dtype=np.int32)
+
+    b_used = np.zeros(B.shape, dtype=bool)
+    a_used = np.zeros((alive.size, la), dtype=bool)
+    for i in range(la):
+        in_window = (cols >= (i - window)[:, None]) & (cols <= (i + window)[:, None])
+        hit = (B == A[i]) & ~b_used & in_window
+        found = hit.any(axis=1)
+        first = hit.argmax(axis=1)
+        b_used[rows[found], first[found]] = True
+        a_used[:, i] = found
+
+    m = a_used.sum(axis=1)
+    # caracteres emparelhados por ordem, alinhados à esquerda em cada linha
+    a_seq = np.take_along_axis(
+        np.broadcast_to(A, a_used.shape), np.argsort(~a_used, axis=1, kind="stable"), axis=1
+    )
+    b_seq = np.take_along_axis(B, np.argsort(~b_used, axis=1, kind="stable"), axis=1)
+    k = min(a_seq.shape[1], b_seq.shape[1])
+    valid = np.arange(k) < m[:, None]
+    transpositions = ((a_seq[:, :k] != b_seq[:, :k]) & valid).sum(axis=1) / 2.0
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        jaro = np.where(m > 0, (m / la + m / lb + (m - transpositions) / m) / 3.0, 0.0)
+
+    p = min(WINKLER_MAX_PREFIX, la, B.shape[1])
+    prefix = np.cumprod(B[:, :p] == A[:p], axis=1).sum(axis=1)
+    scores[alive] = jaro + prefix * WINKLER_PREFIX_WEIGHT * (1.0 - jaro)
+    return scores
+
+
+def name_similarity_many(
+    query: Optional[str],
+    candidates: Sequence[Optional[str]],
+    threshold: float = 0.0,
+    candidate_keys: Optional[Sequence[Optional[str]]] = None,
+) -> List[float]:
+    """
+    Versão em lote de `name_similarity`: um nome contra uma lista de nomes.
+
+    Os nomes partilham muito vocabulário, por isso cada token distinto dos
+    candidatos é comparado uma única vez com cada token da query (numpy);
+    os scores por candidato saem depois por indexação. Sem numpy, ou para
+    listas pequenas, compara um a um.
+    """
+    if candidate_keys is None:
+        candidate_keys = [None] * len(candidates)
+    # chaves em falta (ex.: entidades antigas) calculam-se aqui
+    candidate_keys = [
+        k if k is not None else name_key(c) or "" for c, k in zip(candidates, candidate_keys)
+    ]
+    if np is None or len(candidates) < 8:
+        return [
+            name_similarity(query, c, threshold, b_key=k)
+            for c, k in zip(candidates, candidate_keys)
+        ]
+
+    q_tokens = _tokens(query)
+    n = len(candidates)
+    if not q_tokens:
+        return [0.0] * n
+
+    # vocabulário dos candidatos e, por candidato, os índices dos seus tokens
+    vocab: Dict[str, int] = {}
+    token_ids: List[int] = []
+    owners: List[int] = []
+    for row, key in enumerate(candidate_keys):
+        for t in key.split():
+            token_ids.append(vocab.setdefault(t, len(vocab)))
+            owners.append(row)
+    if not vocab:
+        return [0.0] * n
+
+    B, lb = _encode(list(vocab))
+    # sim[q, v]: query token q contra token v do vocabulário
+    sim = np.stack(
+        [_jaro_winkler_many(t, B, lb, TOKEN_MATCH_THRESHOLD) for t in q_tokens]
+    )
+    sim[sim < TOKEN_MATCH_THRESHOLD] = 0.0
+
+    token_ids = np.asarray(token_ids)
+    owners = np.asarray(owners)
+    per_token = sim[:, token_ids]  # (len(q), total de tokens dos candidatos)
+
+    # melhor token do candidato para cada token da query
+    best_for_query = np.zeros((len(q_tokens), n))
+    np.maximum.at(best_for_query, (slice(None), owners), per_token)
+    # melhor token da query para cada token do candidato
+    best_for_candidate = np.bincount(owners, weights=per_token.max(axis=0), minlength=n)
+    counts = np.bincount(owners, minlength=n)
+
+    total = len(q_tokens) + counts
+    scores = np.where(
+        counts > 0, (best_for_query.sum(axis=0) + best_for_candidate) / total, 0.0
+    )
+    scores[scores < threshold] = 0.0
+    return scores.tolist()
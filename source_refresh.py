@@ -0,0 +1,176 @@
+# source_refresh.py
+"""
+Refresh automático das fontes criadas por URL.
+
+Uma fonte com `url` e `refresh_interval_minutes` é posta na fila de
+ingestão (ingestion_jobs) quando `next_refresh_at` passa. O download é
+condicional (ETag / Last-Modified: um 304 não volta a ingerir) e uma nova
+versão é aplicada por diferença de linhas, como num upload. Os refreshes
+correm no pool de ingestão, em paralelo e limitados por INGEST_JOBS_WORKERS;
+o screening continua a ler o snapshot em memória, que só é trocado depois
+de cada diff.
+
+Com vários processos (uvicorn --workers) cada refresh é reclamado com um
+UPDATE condicional de next_refresh_at: só um processo o põe em fila.
+"""
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from downloads import url_extension
+from ingestion_jobs import ingestion_runner
+from models import IngestionJob, InfoSource
+
+
+logger = logging.getLogger(__name__)
+
+SOURCE_REFRESH_POLL_SECONDS = float(os.getenv("SOURCE_REFRESH_POLL_SECONDS", "60"))
+SOURCE_REFRESH_MIN_MINUTES = int(os.getenv("SOURCE_REFRESH_MIN_MINUTES", "5"))
+
+
+def check_refresh_interval(minutes: Optional[int]) -> None:
+    if minutes is not None and minutes < SOURCE_REFRESH_MIN_MINUTES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Intervalo de refresh mínimo: {SOURCE_REFRESH_MIN_MINUTES} minutos.",
+        )
+
+
+def set_refresh_interval(src: InfoSource, minutes: Optional[int]) -> None:
+    """Define (ou, com None, desliga) o refresh de uma fonte; não faz commit."""
+    check_refresh_interval(minutes)
+    if minutes is None:
+        src.refresh_interval_minutes = None
+        src.next_refresh_at = None
+        return
+    src.refresh_interval_minutes = minutes
+    src.next_refresh_at = datetime.utcnow() + timedelta(minutes=minutes)
+
+
+def due_sources(db: Session, now: datetime) -> List[InfoSource]:
+    return (
+        db.query(InfoSource)
+        .filter(
+            InfoSource.url.isnot(None),
+            InfoSource.refresh_interval_minutes.isnot(None),
+            or_(InfoSource.next_refresh_at.is_(None), InfoSource.next_refresh_at <= now),
+        )
+        .order_by(InfoSource.next_refresh_at)
+        .all()
+    )
+
+
+def enqueue_refresh(db: Session, src: InfoSource, now: datetime) -> Optional[IngestionJob]:
+    """
+    Reclama o refresh (avança next_refresh_at) e cria o job URL, com o
+    mapping / folhas do último job da fonte. None se outro processo o
+    reclamou ou se a fonte já tem um job em fila ou a correr.
+    """
+    previous = src.next_refresh_at
+    claimed = (
+        db.query(InfoSource)
+        .filter(
+            InfoSource.id == src.id,
+            InfoSource.next_refresh_at.is_(None)
+            if previous is None
+            else InfoSource.next_refresh_at == previous,
+        )
+        .update(
+            {InfoSource.next_refresh_at: now + timedelta(minutes=src.refresh_interval_minutes)},
+            synchronize_session=False,
+        )
+    )
+    if not claimed:
+        db.rollback()
+        return None
+
+    busy = (
+        db.query(IngestionJob.id)
+        .filter(
+            IngestionJob.source_id == src.id,
+            IngestionJob.status.in_(("PENDING", "RUNNING")),
+        )
+        .first()
+    )
+    if busy:
+        db.commit()
+        return None
+
+    last = (
+        db.query(IngestionJob)
+        .filter(IngestionJob.source_id == src.id, IngestionJob.kind == "URL")
+        .order_by(IngestionJob.id.desc())
+        .first()
+    )
+    job = IngestionJob(
+        source_id=src.id,
+        kind="URL",
+        url=src.url,
+        ext=url_extension(src.url),
+        mapping_json=last.mapping_json if last else None,
+        sheets_json=last.sheets_json if last else None,
+        description=src.description,
+        created_source=False,
+        created_by_id=src.uploaded_by_id,
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+class SourceRefreshScheduler:
+    """Thread que, a cada SOURCE_REFRESH_POLL_SECONDS, põe em fila as fontes devidas."""
+
+    def __init__(self, session_factory=SessionLocal, poll_seconds: float = SOURCE_REFRESH_POLL_SECONDS):
+        self._session_factory = session_factory
+        self._poll_seconds = poll_seconds
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="source-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def run_due(self) -> int:
+        """Põe em fila os refreshes devidos; devolve quantos jobs criou."""
+        db = self._session_factory()
+        try:
+            now = datetime.utcnow()
+            jobs = []
+            for src in due_sources(db, now):
+                job = enqueue_refresh(db, src, now)
+                if job is not None:
+                    jobs.append(job.id)
+                    logger.info("Refresh da fonte %s (%s) em fila: job %s", src.id, src.name, job.id)
+        finally:
+            db.close()
+        for job_id in jobs:
+            ingestion_runner.submit(job_id)
+        return len(jobs)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._poll_seconds):
+            try:
+                self.run_due()
+            except Exception:
+                logger.exception("Falha a agendar o refresh de fontes")
+
+
+refresh_scheduler = SourceRefreshScheduler()
@@ -0,0 +1,259 @@
+# tabular.py
+"""
+Leitura de ficheiros tabulares (CSV / Excel) usados como fontes ou como
+carteiras de clientes.
+"""
+import csv
+import multiprocessing
+import os
+from queue import Empty
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+
+# Leitura de livros Excel com várias folhas: uma folha por processo.
+EXCEL_SHEET_WORKERS = int(os.getenv("EXCEL_SHEET_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Linhas por bloco enviado de um worker para quem consome.
+EXCEL_CHUNK_ROWS = int(os.getenv("EXCEL_CHUNK_ROWS", "1000"))
+# Blocos em trânsito na fila (limita a memória se o consumo for mais lento).
+EXCEL_QUEUE_CHUNKS = int(os.getenv("EXCEL_QUEUE_CHUNKS", "16"))
+# Intervalo para verificar se os processos de leitura continuam vivos.
+EXCEL_POLL_SECONDS = float(os.getenv("EXCEL_POLL_SECONDS", "1"))
+
+
+def guess_mapping(headers: List[str]) -> dict:
+    """
+    Faz uma tentativa simples de mapear colunas por nome.
+    Podes sempre enviar mapping_json explícito no upload.
+    """
+    lower_headers = {h.lower(): h for h in headers}
+    mapping = {}
+
+    # Nome
+    for key in ["nome", "name", "full_name", "nome_completo", "titular"]:
+        if key in lower_headers:
+            mapping["name"] = lower_headers[key]
+            break
+
+    # NIF
+    for key in ["nif", "nif_cliente", "tax_id", "nº contribuinte", "num_contribuinte"]:
+        if key in lower_headers:
+            mapping["nif"] = lower_headers[key]
+            break
+
+    # Passaporte
+    for key in ["passaporte", "passport"]:
+        if key in lower_headers:
+            mapping["passport"] = lower_headers[key]
+            break
+
+    # Cartão de residente
+    for key in ["cartao_residente", "residence_card", "cartao_residencia"]:
+        if key in lower_headers:
+            mapping["residence_card"] = lower_headers[key]
+            break
+
+    # Cargo / função
+    for key in ["cargo", "funcao", "função", "role", "position"]:
+        if key in lower_headers:
+            mapping["role"] = lower_headers[key]
+            break
+
+    # País
+    for key in ["pais", "país", "country"]:
+        if key in lower_headers:
+            mapping["country"] = lower_headers[key]
+            break
+
+    return mapping
+
+
+def _cell(value) -> str:
+    return str(value).strip() if value is not None else ""
+
+
+def _open_workbook(file_path: str):
+    try:
+        import openpyxl  # garantir que está no requirements.txt
+    except ImportError:
+        raise HTTPException(
+            status_code=500,
+            detail="Suporte a Excel não está configurado (falta 'openpyxl' no servidor).",
+        )
+    return openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+
+
+def _split_header(rows) -> Tuple[List[str], Iterator]:
+    """Cabeçalho = primeira linha não vazia; devolve-o com as linhas seguintes."""
+    for row in rows:
+        headers = [_cell(c) for c in row]
+        if any(headers):
+            return headers, rows
+    return [], iter(())
+
+
+def read_sheet_headers(file_path: str, sheet: Optional[str] = None) -> List[str]:
+    """Cabeçalho de uma folha Excel (por omissão a folha activa)."""
+    wb = _open_workbook(file_path)
+    try:
+        ws = wb[sheet] if sheet is not None else wb.active
+        headers, _ = _split_header(ws.iter_rows(values_only=True))
+    finally:
+        wb.close()
+    return headers
+
+
+def read_workbook_headers(file_path: str) -> Dict[str, List[str]]:
+    """Cabeçalho de cada folha de um livro Excel, pela ordem do ficheiro."""
+    wb = _open_workbook(file_path)
+    try:
+        return {
+            ws.title: _split_header(ws.iter_rows(values_only=True))[0]
+            for ws in wb.worksheets
+        }
+    finally:
+        wb.close()
+
+
+def iter_sheet_rows(file_path: str, sheet: Optional[str] = None) -> Iterator[dict]:
+    """
+    Linhas de dados de uma folha Excel (por omissão a folha activa) em
+    streaming; o cabeçalho é detectado por folha. Linhas vazias são ignoradas.
+    """
+    wb = _open_workbook(file_path)
+    try:
+        ws = wb[sheet] if sheet is not None else wb.active
+        headers, rows = _split_header(ws.iter_rows(values_only=True))
+        for row in rows:
+            values = [_cell(c) for c in row]
+            if any(values):
+                yield dict(zip(headers, values))
+    finally:
+        wb.close()
+
+
+def read_tabular_headers(file_path: str, ext: str) -> List[str]:
+    """Cabeçalho (primeira linha) de um CSV / Excel."""
+    ext = ext.lower()
+    if ext == ".csv":
+        with open(file_path, "r", encoding="utf-8-sig") as f:
+            headers = csv.DictReader(f).fieldnames or []
+        if not headers:
+            raise HTTPException(status_code=400, detail="CSV sem cabeçalho.")
+        return headers
+
+    if ext in [".xls", ".xlsx"]:
+        headers = read_sheet_headers(file_path)
+        if not headers:
+            raise HTTPException(status_code=400, detail="Excel sem cabeçalho.")
+        return headers
+
+    raise HTTPException(status_code=400, detail="Formato tabular não suportado.")
+
+
+def iter_tabular_rows(file_path: str, ext: str) -> Iterator[dict]:
+    """
+    Lê as linhas de dados (dict cabeçalho -> valor) uma a uma, sem carregar
+    o ficheiro em memória. Linhas Excel vazias são ignoradas.
+    """
+    ext = ext.lower()
+    if ext == ".csv":
+        with open(file_path, "r", encoding="utf-8-sig") as f:
+            yield from csv.DictReader(f)
+        return
+
+    if ext in [".xls", ".xlsx"]:
+        yield from iter_sheet_rows(file_path)
+        return
+
+    raise HTTPException(status_code=400, detail="Formato tabular não suportado.")
+
+
+# ---------------------- Livros Excel em paralelo ----------------------
+
+def _read_sheet_into_queue(queue, file_path: str, sheet: str, chunk_rows: int) -> None:
+    """
+    Corre num processo: envia (sheet, bloco, None) por cada bloco de linhas e,
+    no fim, (sheet, None, erro) — erro é None se a folha foi lida até ao fim.
+    """
+    error = None
+    try:
+        chunk: List[dict] = []
+        for row in iter_sheet_rows(file_path, sheet):
+            chunk.append(row)
+            if len(chunk) >= chunk_rows:
+                queue.put((sheet, chunk, None))
+                chunk = []
+        if chunk:
+            queue.put((sheet, chunk, None))
+    except Exception as exc:
+        error = f"{type(exc).__name__}: {exc}"
+    queue.put((sheet, None, error))
+
+
+def iter_workbook_rows(
+    file_path: str,
+    sheets: List[str],
+    workers: Optional[int] = None,
+) -> Iterator[Tuple[str, dict]]:
+    """
+    Linhas (folha, dict cabeçalho -> valor) das folhas indicadas. Com mais de
+    uma folha e workers > 1, as folhas são lidas em simultâneo (um processo
+    por folha, no máximo `workers` de cada vez) e as linhas chegam em blocos
+    por uma fila limitada: a memória não depende do tamanho do livro. A ordem
+    entre folhas não é garantida.
+
+    Um processo que morra sem enviar o fim da folha (OOM, segfault, falha no
+    arranque) é detectado enquanto se espera pela fila e dá RuntimeError, em
+    vez de a ingestão ficar parada.
+    """
+    workers = EXCEL_SHEET_WORKERS if workers is None else workers
+    if workers <= 1 or len(sheets) <= 1:
+        for sheet in sheets:
+            for row in iter_sheet_rows(file_path, sheet):
+                yield sheet, row
+        return
+
+    # spawn: quem chama corre em threads (workers de ingestão)
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue(maxsize=EXCEL_QUEUE_CHUNKS)
+    waiting = list(sheets)
+    running: Dict[str, multiprocessing.process.BaseProcess] = {}
+    try:
+        while waiting or running:
+            while waiting and len(running) < workers:
+                sheet = waiting.pop(0)
+                proc = ctx.Process(
+                    target=_read_sheet_into_queue,
+                    args=(queue, file_path, sheet, EXCEL_CHUNK_ROWS),
+                    daemon=True,
+                )
+                proc.start()
+                running[sheet] = proc
+
+            try:
+                sheet, chunk, error = queue.get(timeout=EXCEL_POLL_SECONDS)
+            except Empty:
+                for sheet, proc in running.items():
+                    # o fim da folha é enviado antes de o processo sair com 0
+                    if proc.exitcode not in (None, 0):
+                        raise RuntimeError(
+                            f"Leitura da folha {sheet} terminou inesperadamente "
+                            f"(exitcode {proc.exitcode})."
+                        )
+                continue
+
+            if chunk is None:
+                running.pop(sheet).join()
+                if error:
+                    raise RuntimeError(f"Falha a ler a folha {sheet}: {error}")
+                continue
+            for row in chunk:
+                yield sheet, row
+    finally:
+        # termina também processos bloqueados na fila (consumo interrompido)
+        for proc in running.values():
+            if proc.is_alive():
+                proc.terminate()
+            proc.join()
@@ -0,0 +1,92 @@
+# tests/test_downloads.py
+"""
+Downloader contra um servidor HTTP local (http.server): 200 gravado em
+disco com SHA-256, 304 por ETag sem gravar nada, e corpo acima do limite
+recusado com 413 sem deixar ficheiros.
+"""
+import hashlib
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from fastapi import HTTPException
+
+from downloads import Downloader
+
+
+BODY = b"nome,nif,cargo\nJoao Lourenco,123,Presidente\nAna Dias,456,Ministra\n"
+ETAG = '"v1"'
+MAX_BYTES = 1024
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path == "/big.csv":
+            body = b"x" * (MAX_BYTES * 4)
+        elif self.headers.get("If-None-Match") == ETAG:
+            self.send_response(304)
+            self.send_header("ETag", ETAG)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        else:
+            body = BODY
+        self.send_response(200)
+        self.send_header("ETag", ETAG)
+        self.send_header("Last-Modified", "Wed, 14 Oct 2026 10:00:00 GMT")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def base_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def downloader():
+    d = Downloader(max_bytes=MAX_BYTES)
+    yield d
+    d.stop()
+
+
+def test_download_200_is_stored_with_hash_and_validators(base_url, downloader, tmp_path):
+    result = downloader.download(f"{base_url}/list.csv", ".csv", str(tmp_path))
+
+    assert not result.not_modified
+    assert result.size == len(BODY)
+    assert result.sha256 == hashlib.sha256(BODY).hexdigest()
+    assert result.etag == ETAG
+    assert result.last_modified == "Wed, 14 Oct 2026 10:00:00 GMT"
+    with open(result.path, "rb") as f:
+        assert f.read() == BODY
+
+
+def test_download_304_with_etag_writes_nothing(base_url, downloader, tmp_path):
+    result = downloader.download(f"{base_url}/list.csv", ".csv", str(tmp_path), etag=ETAG)
+
+    assert result.not_modified
+    assert result.path is None
+    assert result.etag == ETAG
+    assert os.listdir(tmp_path) == []
+
+
+def test_download_over_limit_is_rejected_with_413(base_url, downloader, tmp_path):
+    with pytest.raises(HTTPException) as exc_info:
+        downloader.download(f"{base_url}/big.csv", ".csv", str(tmp_path))
+
+    assert exc_info.value.status_code == 413
+    # o ficheiro temporário é removido
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,128 @@
+# uploads.py
+"""
+Gravação de ficheiros enviados (UploadFile) para disco em blocos de tamanho
+fixo, sem nunca ter o ficheiro inteiro em memória. O SHA-256 e o tamanho
+calculam-se durante a cópia e o limite UPLOAD_MAX_BYTES é verificado a
+cada bloco: um upload demasiado grande é cortado logo (413) e o ficheiro
+parcial apagado.
+"""
+import hashlib
+import os
+import uuid
+from typing import NamedTuple, Optional
+
+from fastapi import HTTPException, UploadFile
+
+from executors import io_executor, run
+from utils import ensure_dir
+
+
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(200 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+
+class StoredFile(NamedTuple):
+    path: str
+    size: int
+    sha256: str
+
+
+class UploadWriter:
+    """Ficheiro temporário (.part) + hash + contagem de bytes."""
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        ensure_dir(directory)
+        self.tmp_path = os.path.join(directory, f".{uuid.uuid4().hex}.part")
+        self._file = open(self.tmp_path, "wb")
+        self._hash = hashlib.sha256()
+        self._max_bytes = max_bytes
+        self.size = 0
+
+    def write(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self._max_bytes and self.size > self._max_bytes:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Ficheiro excede o tamanho máximo permitido ({self._max_bytes} bytes).",
+            )
+        self._hash.update(chunk)
+        self._file.write(chunk)
+
+    def commit(self, directory: str, filename: str, content_named: bool) -> StoredFile:
+        """
+        Fecha e move para o nome final: `filename` tal como vem ou, com
+        `content_named`, <sha256[:16]>_<id>_<filename>. O id é único por
+        upload: duas fontes com o mesmo conteúdo (ex.: tipos diferentes) não
+        partilham o ficheiro, e apagar uma não apaga o da outra.
+        """
+        self._file.close()
+        sha256 = self._hash.hexdigest()
+        name = safe_filename(filename)
+        if content_named:
+            name = f"{sha256[:16]}_{uuid.uuid4().hex[:8]}_{name}"
+        path = os.path.join(directory, name)
+        os.replace(self.tmp_path, path)
+        return StoredFile(path, self.size, sha256)
+
+    def abort(self) -> None:
+        self._file.close()
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+
+def safe_filename(filename: str) -> str:
+    """Só o nome base (sem directórios vindos do cliente)."""
+    name = os.path.basename((filename or "").replace("\\", "/")).strip()
+    return name or "upload"
+
+
+async def save_upload(
+    file: UploadFile,
+    directory: str,
+    filename: Optional[str] = None,
+    max_bytes: int = UPLOAD_MAX_BYTES,
+) -> StoredFile:
+    """
+    Versão para endpoints async (lê com `await file.read(n)`; as escritas
+    em disco correm no io_executor, fora do event loop). Sem `filename`, o
+    nome final deriva do hash e do nome original.
+    """
+    writer = await run(io_executor, UploadWriter, directory, max_bytes)
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            await run(io_executor, writer.write, chunk)
+    except BaseException:
+        writer.abort()
+        raise
+    return await run(
+        io_executor,
+        writer.commit,
+        directory,
+        filename or file.filename,
+        content_named=filename is None,
+    )
+
+
+def save_upload_sync(
+    file: UploadFile,
+    directory: str,
+    filename: Optional[str] = None,
+    max_bytes: int = UPLOAD_MAX_BYTES,
+) -> StoredFile:
+    """Igual a `save_upload`, para endpoints síncronos (lê de `file.file`)."""
+    writer = UploadWriter(directory, max_bytes)
+    try:
+        while True:
+            chunk = file.file.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            writer.write(chunk)
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.commit(directory, filename or file.filename, content_named=filename is None)